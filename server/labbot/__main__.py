@@ -1,22 +1,34 @@
 import asyncio
-from datetime import datetime
 import functools
-import importlib
 import json # For reading the secrets file
 import os
 import sys
 import threading
 import time
 import traceback
-import pytz
 
 import slack_bolt# Slack file
 from slack_bolt.adapter.fastapi import SlackRequestHandler
+from slack_sdk.signature import SignatureVerifier
 import fastapi
 import contextlib
 import uvicorn
 
-ETC = pytz.timezone('America/New_York')
+from labbot import fastjson
+from labbot.async_compat import to_async_listener
+from labbot.dedup import DeliveryCache, delivery_key
+from labbot.deferred import DeferredRunner
+from labbot.drain import Drain, TrackedExecutor
+from labbot.home_tab import HomeTabPublisher
+from labbot.log_shipper import LogShipper
+from labbot.metrics import CONTENT_TYPE, MetricsRegistry, slack_listener_labels
+from labbot.registry import ModuleRegistry
+from labbot.scheduler import TimerScheduler
+from labbot.slack_client import RateLimitedWebClient, SlackRateLimiter
+from labbot.storage import Storage
+from labbot.store import Store
+from labbot.tracing import Tracer
+from labbot.workers import WorkerPool
 
 # argv changed in Python 3.10. Create orig_argv if it doesn't exist
 try:
@@ -32,6 +44,10 @@ should_shutdown = threading.Condition()
 
 def shutdown_func(restart=False):
     global restart_flag
+    if worker_pool.is_worker:
+        # Let the supervising process stop (and maybe restart) every worker
+        worker_pool.control_queue.put(('shutdown', restart))
+        return
     should_shutdown.acquire()
     restart_flag = restart
     should_shutdown.notify()
@@ -40,26 +56,172 @@ def shutdown_func(restart=False):
 with open('labbot.secret') as json_secrets:
     secrets = json.load(json_secrets)
 
-# Create slack credentials
-bolt_client = slack_bolt.App(
-        signing_secret=secrets['slack']['signing_secret'],
-        token=secrets['slack']['api_token']
-)
-bolt_handler = SlackRequestHandler(bolt_client)
-
-api = fastapi.FastAPI()
+worker_pool = WorkerPool(secrets['global'].get('workers', 1))
+metrics = MetricsRegistry()
+# Pooled SQLite connections, shared by the core and modules
+storage = Storage(
+        cached_statements=secrets['global'].get('sqlite_cached_statements', 256),
+        busy_timeout_ms=secrets['global'].get('sqlite_busy_timeout_ms', 30000),
+        slow_query_sec=secrets['global'].get('sqlite_slow_query_sec', 1.0),
+        metrics=metrics)
+store = Store(secrets['global'].get('state_db', 'labbot_state.db'), storage)
+# Before shutting down or restarting, in-flight work gets this long to finish
+drain = Drain(secrets['global'].get('drain_timeout_sec', 30))
+
+# Create slack credentials. The synchronous WebClient is shared by the core,
+# timers and synchronous listeners; it is safe to use from multiple threads.
+# Every client shares one rate limiter, so that calls from all modules are
+# queued by priority instead of running into Slack's rate limits.
+slack_rate_limiter = SlackRateLimiter(
+        max_retries=secrets['global'].get('slack_max_retries', 3),
+        metrics=metrics)
+# The Slack Web API can be pointed elsewhere, e.g. at tests/fake_slack.py
+slack_api_url = secrets['slack'].get('api_url', RateLimitedWebClient.BASE_URL)
+slack_client = RateLimitedWebClient(
+        token=secrets['slack']['api_token'],
+        base_url=slack_api_url,
+        rate_limiter=slack_rate_limiter)
+async_slack = secrets['global'].get('async_slack', False)
+if async_slack:
+    # Only imported in async mode, as these need aiohttp
+    from slack_bolt.async_app import AsyncApp
+    from slack_bolt.adapter.fastapi.async_handler import AsyncSlackRequestHandler
+    from labbot.slack_client import AsyncRateLimitedWebClient
+    bolt_client = AsyncApp(
+            signing_secret=secrets['slack']['signing_secret'],
+            client=AsyncRateLimitedWebClient(
+                token=secrets['slack']['api_token'],
+                base_url=slack_api_url,
+                rate_limiter=slack_rate_limiter)
+    )
+    async_slack_client = bolt_client.client
+    bolt_handler = AsyncSlackRequestHandler(bolt_client)
+else:
+    # Listeners keep running after their request is acknowledged; the
+    # tracked executor lets the drain wait for them too
+    bolt_client = slack_bolt.App(
+            signing_secret=secrets['slack']['signing_secret'],
+            client=slack_client,
+            listener_executor=TrackedExecutor(drain, max_workers=10)
+    )
+    async_slack_client = None
+    bolt_handler = SlackRequestHandler(bolt_client)
+
+def core_listener(func):
+    """
+    Adapts a synchronous core listener to the bolt app in use.
+    """
+    return to_async_listener(func, slack_client) if async_slack else func
+
+# Responses are encoded with orjson when it is installed
+api = fastapi.FastAPI(default_response_class=fastjson.FastJSONResponse)
+
+# Slack retries deliveries that were not answered within three seconds;
+# deliveries already seen are acknowledged without being dispatched again.
+# A retry usually reaches another worker, so workers share keys in the store.
+slack_deliveries = DeliveryCache(
+        ttl=secrets['global'].get('slack_dedup_ttl_sec', 600),
+        max_entries=secrets['global'].get('slack_dedup_max_entries', 10000),
+        metrics=metrics,
+        store=store if worker_pool.is_multiprocess else None)
+slack_signature = SignatureVerifier(secrets['slack']['signing_secret'])
+
+async def slack_deliveries_call(func, *args, **kwargs):
+    """
+    Calls a slack_deliveries method, off the event loop if it queries the store.
+    """
+    if slack_deliveries.store is None:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
 
 @api.post("/slack/events")
 async def slack_endpoint(req: fastapi.Request):
-    return await bolt_handler.handle(req)
+    body = await req.body()
+    key = None
+    # Only signed requests are remembered, so forged ones cannot suppress real deliveries
+    if slack_signature.is_valid_request(body, dict(req.headers)):
+        key = delivery_key(body, req.headers.get('content-type', ''))
+    if key is not None and not await slack_deliveries_call(
+            slack_deliveries.check_and_add, key, retry='x-slack-retry-num' in req.headers):
+        return fastapi.Response(status_code=200, headers={'X-Slack-No-Retry': '1'})
+    try:
+        response = await bolt_handler.handle(req)
+    except BaseException:
+        if key is not None:
+            await slack_deliveries_call(slack_deliveries.discard, key)
+        raise
+    if key is not None and response.status_code >= 500:
+        # Let Slack's retry run it again
+        await slack_deliveries_call(slack_deliveries.discard, key)
+    return response
+
+@api.get("/metrics")
+def metrics_endpoint():
+    return fastapi.Response(metrics.render(), media_type=CONTENT_TYPE)
+
+http_latency = metrics.histogram(
+        'labbot_http_request_seconds', 'Duration of HTTP requests by route.', ('method', 'route', 'status'))
+
+@api.middleware("http")
+async def measure_http_latency(request: fastapi.Request, call_next):
+    start = time.monotonic()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    http_latency.observe(time.monotonic() - start,
+            method=request.method,
+            route=route.path if route is not None else 'unmatched',
+            status=response.status_code)
+    return response
+
+@api.middleware("http")
+async def reject_while_draining(request: fastapi.Request, call_next):
+    # Slack retries refused events, so they are handled after the restart
+    if drain.is_draining():
+        return fastapi.Response('LabBot is restarting', status_code=503, headers={'Retry-After': '30'})
+    with drain.track():
+        return await call_next(request)
+
+# Time from receiving a Slack request until it is acknowledged
+listener_latency = metrics.histogram(
+        'labbot_slack_listener_seconds', 'Time until Slack requests are acknowledged.', ('type', 'id'))
+
+if async_slack:
+    @bolt_client.middleware
+    async def measure_listener_latency(body, next):
+        start = time.monotonic()
+        try:
+            return await next()
+        finally:
+            kind, listener_id = slack_listener_labels(body)
+            listener_latency.observe(time.monotonic() - start, type=kind, id=listener_id)
+else:
+    @bolt_client.middleware
+    def measure_listener_latency(body, next):
+        start = time.monotonic()
+        try:
+            return next()
+        finally:
+            kind, listener_id = slack_listener_labels(body)
+            listener_latency.observe(time.monotonic() - start, type=kind, id=listener_id)
 
 
 
 # Define logging function
+log_shipper = LogShipper(
+        slack_client,
+        window=secrets['global'].get('log_window_sec', 2.0),
+        max_queued=secrets['global'].get('log_max_queued', 500))
+metrics.gauge('labbot_log_queued', 'Log messages waiting to be posted to Slack.',
+              callback=log_shipper.queue_depth)
+
 def slack_log(message, header):
     """
     Logs a message to the #labbot_debug channel.
 
+    This only queues the message; it is posted from a background thread,
+    merged with other messages from the same header that arrive within
+    a short window.
+
     Parameters
     ----------
     message : str
@@ -68,16 +230,13 @@ def slack_log(message, header):
         A string message to place within the header to inform the user what module/source generate the message.
     """
     print(message)
-    if len(message) > 2000:
-        message = message[:2000]
-    result = bolt_client.client.chat_postMessage(
-            channel='#labbot_debug',
-            text='Labbot log:{}'.format(header),
-            blocks=json.dumps([{'type':'section', 'text':
-                {'type': 'mrkdwn', 'text':
-                    '`{}`:\n{}'.format(header, message)}}]))
+    log_shipper.log(message, header)
+
+slack_rate_limiter.logger = functools.partial(slack_log, header='slack_client')
+storage.logger = functools.partial(slack_log, header='storage')
 
 @bolt_client.error
+@core_listener
 def labbot_debug_error(error, body, logger):
     try:
         slack_log('Error: {}\nStacktrace:\n```{}```\nCall body: ```{}```'.format(
@@ -90,25 +249,35 @@ def labbot_debug_error(error, body, logger):
     except Exception as e:
         print(e)
 
-home_tab_users = set()
-home_tab_functions = []
-home_tab_lock = threading.Lock()
-should_update_home_tab = False
+home_tab = HomeTabPublisher(
+        slack_client,
+        debounce=secrets['global'].get('home_tab_debounce_sec', 0.5),
+        max_workers=secrets['global'].get('home_tab_workers', 4),
+        logger=functools.partial(slack_log, header='home_tab'),
+        store=store,
+        metrics=metrics)
 
 @bolt_client.event("app_home_opened")
+@core_listener
 def register_home_tab_open(client, event):
-    home_tab_users.add(event['user'])
+    home_tab.add_user(event['user'])
     update_home_tab()
 
-def update_home_tab():
+def update_home_tab(key=None):
     """
-    Schedules an update to the home tab, to occur in the next asyncio
-    update
+    Schedules an update to the home tab. Requests made within the
+    debounce window are merged into a single render pass.
+
+    Parameters
+    ----------
+    key : str, optional
+        The invalidation key whose data changed, e.g. 'sensors'. Home tab
+        functions declared with this key are recomputed.
     """
-    global should_update_home_tab
-    home_tab_lock.acquire()
-    should_update_home_tab = True
-    home_tab_lock.release()
+    if worker_pool.is_primary:
+        home_tab.request_update(key)
+    else:
+        worker_pool.home_tab_queue.put(key)
 
 
 
@@ -119,28 +288,141 @@ def update_home_tab():
 
 
 
+def log_timer_error(name, e):
+    slack_log('Timer error in `{}`:\nError:\n```{}```\nStacktrace:\n```{}```'.format(
+        name,
+        e,
+        '\n'.join(traceback.TracebackException.from_exception(e).format())), 'timer_runner')
+
+timer_scheduler = TimerScheduler(
+        on_error=log_timer_error,
+        metrics=metrics,
+        startup_stagger=secrets['global'].get('timer_startup_stagger_sec', 10))
+
+def log_deferred_error(name, e):
+    slack_log('Error in deferred listener `{}`:\nError:\n```{}```\nStacktrace:\n```{}```'.format(
+        name,
+        e,
+        '\n'.join(traceback.TracebackException.from_exception(e).format())), 'deferred')
+
+# Slow listeners marked with @loader.deferred run here after acking. Their
+# work counts as in flight, so a drain waits for it.
+deferred_runner = DeferredRunner(
+        TrackedExecutor(drain, max_workers=secrets['global'].get('deferred_workers', 4),
+                        thread_name_prefix='deferred'),
+        on_error=log_deferred_error,
+        metrics=metrics)
+
+# Optionally trace every module handler, posting a periodic slowest-handlers digest
+tracer = Tracer(metrics) if secrets['global'].get('trace_handlers', False) else None
+
+def post_handler_digest(_):
+    digest = tracer.digest()
+    if digest is not None:
+        slack_log(digest, 'tracing')
+    return secrets['global'].get('trace_digest_sec', 60 * 60)
+
+if tracer is not None:
+    timer_scheduler.add(post_handler_digest, delay=secrets['global'].get('trace_digest_sec', 60 * 60))
+
+def status_report():
+    """
+    Returns a human-readable summary of timer lateness, home tab caching,
+    deferred listeners, Slack API rate limiting, duplicate Slack deliveries
+    and SQLite query times.
+    """
+    return '\n'.join([timer_scheduler.report(), home_tab.report(), deferred_runner.report(),
+                      slack_rate_limiter.report(), slack_deliveries.report(), storage.report(),
+                      'JSON encoder: {}'.format(fastjson.ENCODER)])
+
 # Load modules
-timer_tasks = []
-for module_name in secrets['global']['modules']:
-    try:
-        module = importlib.import_module('modules.{}'.format(module_name))
-        if module_name in secrets:
-            config = secrets[module_name]
-        else:
-            config = {}
-        config['slack_client'] = bolt_client.client
-        config['logger'] = functools.partial(slack_log, header=module_name)
-        config['shutdown_func'] = shutdown_func
-        config['hometab_update'] = update_home_tab
-        module_hooks = module.register_module(config)
-        module_hooks.register(bolt_client, api)
-        home_tab_functions.extend(module_hooks.home_accumulator)
-        timer_tasks.extend(module_hooks.timer_accumulator)
-    except Exception as e:
-        slack_log('Could not load module `{}`\nError:\n```{}```\nStacktrace:\n```{}```'.format(
-            module_name,
-            e,
-            '\n'.join(traceback.TracebackException.from_exception(e).format())), 'module_loader')
+def build_module_config(module_name):
+    """
+    Builds the config dictionary handed to a module's register_module.
+    """
+    if module_name in secrets:
+        config = secrets[module_name]
+    else:
+        config = {}
+    config['slack_client'] = slack_client
+    config['async_slack_client'] = async_slack_client
+    config['store'] = store
+    config['storage'] = storage
+    config['logger'] = functools.partial(slack_log, header=module_name)
+    config['shutdown_func'] = shutdown_func
+    config['draining'] = drain.is_draining
+    config['hometab_update'] = update_home_tab
+    config['status_report'] = status_report
+    config['reload_module'] = reload_module_everywhere
+    config['loaded_modules'] = lambda: list(module_registry.modules)
+    return config
+
+def install_module_hooks(module_name, module_hooks):
+    """
+    Registers a module's decorated functions with LabBot, returning a
+    function that unregisters them again.
+    """
+    registration = module_hooks.register(bolt_client, api, slack_client, tracer, module_name, deferred_runner)
+    home_tab.functions.extend(module_hooks.home_accumulator)
+    for timer_func, timer_policy in module_hooks.timer_accumulator:
+        timer_scheduler.add(timer_func, timer_policy)
+    for metric in module_hooks.metric_accumulator:
+        metrics.register(metric)
+
+    def uninstall():
+        registration.unregister()
+        for metric in module_hooks.metric_accumulator:
+            metrics.unregister(metric)
+        home_tab.functions[:] = [f for f in home_tab.functions if f not in module_hooks.home_accumulator]
+        for home_func, _ in module_hooks.home_accumulator:
+            home_tab.fragments.forget(home_func)
+        for timer_func, _ in module_hooks.timer_accumulator:
+            timer_scheduler.remove(timer_func)
+    return uninstall
+
+def reload_module(module_name):
+    """
+    Hot-reloads a single module in this process, without restarting.
+
+    Returns
+    -------
+    A human-readable summary of the reload.
+    """
+    loaded = module_registry.reload(module_name)
+    update_home_tab()
+    return 'Reloaded `{}` in {:.3f}s (import {:.3f}s, register {:.3f}s, hook {:.3f}s)'.format(
+        module_name, loaded.total_sec, loaded.import_sec, loaded.register_sec, loaded.hook_sec)
+
+def reload_module_everywhere(module_name):
+    """
+    Hot-reloads a single module in every worker process.
+    """
+    if worker_pool.is_multiprocess:
+        worker_pool.broadcast(('reload', module_name))
+        return 'Reload of `{}` sent to {} workers'.format(module_name, worker_pool.n_workers)
+    return reload_module(module_name)
+
+def handle_worker_message(message):
+    """
+    Handles a message broadcast to this worker process.
+    """
+    if message[0] == 'reload':
+        try:
+            slack_log(reload_module(message[1]), 'module_loader')
+        except Exception:
+            # Already logged by the registry
+            pass
+    elif message[0] == 'drain':
+        drain_server(server)
+
+module_registry = ModuleRegistry(
+        build_module_config,
+        install_module_hooks,
+        functools.partial(slack_log, header='module_loader'))
+module_registry.load_all(
+        secrets['global']['modules'],
+        max_workers=secrets['global'].get('module_load_workers', 4))
+slack_log(module_registry.report(), 'module_loader')
 
 
 # Start the server
@@ -149,116 +431,21 @@ class WebServer(uvicorn.Server):
     def install_signal_handlers(self):
         pass # Use default signal handlers
     
-    def run_threaded(self):
+    def run_threaded(self, sockets=None):
         self.config.setup_event_loop()
         loop = asyncio.new_event_loop()
-        loop.create_task(self.timer_coroutine(timer_tasks))
-        loop.create_task(self.home_tab_coroutine())
-        loop.run_until_complete(self.serve())
-
-    async def home_tab_coroutine(self):
-        """
-        Checks if the home tab should be updated, then sends updated
-        views.
+        if worker_pool.is_primary:
+            loop.create_task(self.timer_coroutine())
+            loop.create_task(home_tab.run())
+        loop.run_until_complete(self.serve(sockets=sockets))
+        timer_scheduler.stop()
+        home_tab.stop()
+
+    async def timer_coroutine(self):
         """
-        global should_update_home_tab
-
-        while not self.should_exit:
-            await asyncio.sleep(0.1)
-            if home_tab_lock.acquire(blocking=False):
-                try:
-                    hour = datetime.now(ETC).hour
-                    if hour < 5:
-                        time_summary = 'night'
-                    elif hour < 12:
-                        time_summary = 'morning'
-                    elif hour < 17:
-                        time_summary = 'afternoon'
-                    else:
-                        time_summary = 'evening'
-
-                    if should_update_home_tab:
-                        should_update_home_tab = False
-                        for user in home_tab_users:
-                            accum_blocks = []
-                            for f in home_tab_functions:
-                                accum_blocks.append(f(user))
-
-
-                            blocks = [{
-                                "type": "header",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Good {}!".format(time_summary),
-                                }}]
-                            for mod_blocks in accum_blocks:
-                                if len(mod_blocks) > 0:
-                                    blocks.append({ "type": "divider" })
-                                    blocks.extend(mod_blocks)
-
-                            built_view = {
-                                    "type": "home",
-                                    "blocks": blocks
-                                    }
-                            print(built_view)
-                            bolt_client.client.views_publish(
-                                    user_id=user,
-                                    view=built_view)
-                except Exception as e:
-                    slack_log('Timer error:\nError:\n```{}```\nStacktrace:\n```{}```'.format(
-                        e,
-                        '\n'.join(traceback.TracebackException.from_exception(e).format())), 'timer_runner')
-                                # If delay is not none, the task wants to be rescheduled
-
-                finally:
-                    home_tab_lock.release()
-
-    async def timer_coroutine(self, tasks):
+        Runs the timer scheduler until the webserver is asked to close.
         """
-        Runs a series of tasks that should be scheduled on a timer.
-
-        Parameters
-        ----------
-        tasks
-            A list of functions with the signature def f(slack_client) that
-            returns either None, if this task should not be repeated, or a
-            number (integer or float) of how many seconds should elapse before
-            the next check.
-        """
-        # Spawn a new client for thread safety
-        threaded_client = slack_bolt.App(
-                signing_secret=secrets['slack']['signing_secret'],
-                token=secrets['slack']['api_token']
-        )
-        loop = asyncio.get_event_loop()
-
-        last_time = time.time()
-        # Init the tuple list with the starting time
-        tasks_to_complete = [(f, last_time) for f in tasks]
-
-        while not self.should_exit and len(tasks_to_complete) > 0:
-            # Wait one second
-            await asyncio.sleep(1)
-            last_time = time.time()
-
-            rescheduled_tasks = []
-            for func, trigger_time in tasks_to_complete:
-                # If a function hasn't reached the trigger time, just reschedule
-                if trigger_time > last_time:
-                    rescheduled_tasks.append((func, trigger_time))
-                else:
-                    # Otherwise, run the task, handing it the Slack client if needed.
-                    try:
-                        delay = await loop.run_in_executor(None, func, threaded_client.client)
-                        if delay is not None:
-                            rescheduled_tasks.append((func, last_time + delay))
-                    except Exception as e:
-                        slack_log('Timer error:\nError:\n```{}```\nStacktrace:\n```{}```'.format(
-                            e,
-                            '\n'.join(traceback.TracebackException.from_exception(e).format())), 'timer_runner')
-                                    # If delay is not none, the task wants to be rescheduled
-            tasks_to_complete = rescheduled_tasks
-        # THis will exit when the rest of the webserver is asked to close.
+        await timer_scheduler.run(slack_client, async_slack_client)
 
     @contextlib.contextmanager
     def run_in_thread(self):
@@ -272,23 +459,65 @@ class WebServer(uvicorn.Server):
             self.should_exit = True
             thread.join()
 
+def drain_server(server):
+    """
+    Drains this process before a shutdown or restart: stops dispatching
+    timers, refuses new requests and waits (until the drain deadline) for
+    in-flight timers, requests and listeners, then flushes the log and asks
+    the webserver to exit.
+    """
+    drain.begin()
+    if worker_pool.is_primary:
+        drain.stage('timers', timer_scheduler.drain)
+    drain.stage('requests', drain.wait_idle)
+    if worker_pool.is_worker:
+        # The main process posts its own report in its goodbye message
+        slack_log('Worker {}: {}'.format(worker_pool.index, drain.report()), 'shutdown')
+    drain.stage('logs', log_shipper.flush)
+    # Only cut connections short if something missed the deadline
+    server.force_exit = not drain.completed
+    server.should_exit = True
+
+def run_worker(sockets):
+    """
+    Entry point of each forked worker process.
+    """
+    global server
+    server = WebServer(webserver_config)
+    if worker_pool.is_primary:
+        worker_pool.forward(worker_pool.home_tab_queue, home_tab.request_update)
+    worker_pool.forward(worker_pool.worker_queues[worker_pool.index], handle_worker_message)
+    server.run_threaded(sockets)
+
 webserver_config = uvicorn.Config(
         api,
         host='localhost',
         port=secrets['global']['port'],
-        workers=4,
         loop='uvloop')
 
-server = WebServer(webserver_config)
-server.force_exit = True
-
-with server.run_in_thread():
+if worker_pool.is_multiprocess:
+    worker_pool.forward(worker_pool.control_queue, lambda message: shutdown_func(restart=message[1]))
+    worker_pool.start(run_worker, [webserver_config.bind_socket()])
     should_shutdown.acquire()
     should_shutdown.wait()
-
-bolt_client.client.chat_postMessage(
+    should_shutdown.release()
+    drain.begin()
+    worker_pool.broadcast(('drain',))
+    # Workers drain against the same deadline; allow a little slack before terminating them
+    drain.stage('workers', lambda timeout: worker_pool.stop(grace=timeout + 2) == 0)
+    drain.stage('logs', log_shipper.flush)
+else:
+    server = WebServer(webserver_config)
+
+    with server.run_in_thread():
+        should_shutdown.acquire()
+        should_shutdown.wait()
+        should_shutdown.release()
+        drain_server(server)
+
+slack_client.chat_postMessage(
         channel='#labbot_debug',
-        text='LabBot shutting down. Bye!')
+        text='LabBot shutting down. Bye!\n{}'.format(drain.report()))
 
 if restart_flag:
     launch_argv = [sys.executable] + sys.orig_argv[1:]
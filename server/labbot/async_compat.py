@@ -0,0 +1,72 @@
+"""
+Helpers for running LabBot on slack_bolt's AsyncApp.
+
+In async mode, Slack listeners and timers declared with `async def` are
+awaited directly on the event loop, with an AsyncWebClient. Existing
+synchronous listeners keep working: they are wrapped into coroutines that
+run the original function in a worker thread, with the async arguments
+(ack, say, respond, client, ...) replaced by blocking equivalents.
+"""
+import asyncio
+import functools
+import inspect
+
+
+def is_async_app(slack_bolt_instance):
+    """
+    Returns True if the given bolt instance is a slack_bolt.async_app.AsyncApp.
+
+    Checked by duck-typing so that slack_bolt.async_app (which needs aiohttp)
+    does not need to be importable in synchronous mode.
+    """
+    return hasattr(slack_bolt_instance, 'async_dispatch')
+
+
+def _is_async_callable(value):
+    return callable(value) and (inspect.iscoroutinefunction(value)
+            or inspect.iscoroutinefunction(getattr(value, '__call__', None)))
+
+
+def _blocking_proxy(loop, async_callable):
+    """
+    Returns a function that can be called from a worker thread, which runs
+    `async_callable` on `loop` and waits for the result.
+    """
+    def call(*args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(async_callable(*args, **kwargs), loop).result()
+    return call
+
+
+def to_async_listener(func, sync_slack_client):
+    """
+    Wraps a synchronous bolt listener (or middleware/error handler) so that
+    it can be registered on an AsyncApp.
+
+    Parameters
+    ----------
+    func : function
+        The synchronous listener.
+    sync_slack_client
+        A slack_sdk.WebClient handed to the listener in place of the
+        AsyncWebClient that bolt would otherwise inject as `client`.
+
+    Returns
+    -------
+    A coroutine function with the same argument names as `func`.
+    """
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        loop = asyncio.get_running_loop()
+        sync_kwargs = {}
+        for name, value in kwargs.items():
+            if name == 'client':
+                sync_kwargs[name] = sync_slack_client
+            elif _is_async_callable(value):
+                sync_kwargs[name] = _blocking_proxy(loop, value)
+            else:
+                sync_kwargs[name] = value
+        return await loop.run_in_executor(None, functools.partial(func, **sync_kwargs))
+
+    # bolt decides which arguments to inject from the listener's signature
+    wrapper.__signature__ = inspect.signature(func)
+    return wrapper
@@ -0,0 +1,180 @@
+"""
+Suppression of duplicate Slack deliveries.
+
+Slack retries an event when LabBot does not answer it within three seconds
+(sending X-Slack-Retry-Num), and a retry of a slow listener would run it a
+second time: sending reminders twice, queueing the same labels twice, or
+running another `git fetch`.
+
+Each delivery is identified by a key: the event_id of Events API
+callbacks, or the trigger_id (plus the action_ts, if any) of interactive
+payloads and slash commands. /slack/events checks the key against a
+bounded cache of recently seen keys before handing the request to bolt,
+and answers repeated deliveries straight away with a 200 and
+X-Slack-No-Retry, without dispatching them.
+
+In a single process, keys are kept in memory. With several worker
+processes, a retry usually reaches a different worker than the original
+delivery, so keys are instead claimed in the shared labbot.store.Store.
+"""
+import collections
+import json
+import threading
+import time
+import urllib.parse
+
+
+def delivery_key(body, content_type):
+    """
+    Returns a key identifying the Slack delivery with the raw request body
+    `body`, or None if it cannot be identified (e.g. url_verification or
+    options requests, which must always be answered).
+
+    Returns
+    -------
+    A (kind, id) pair, e.g. ('event', 'Ev0123ABC').
+    """
+    try:
+        if content_type.startswith('application/json'):
+            payload = json.loads(body)
+        else:
+            form = urllib.parse.parse_qs(body.decode('utf-8'))
+            if 'payload' in form:
+                payload = json.loads(form['payload'][0])
+            else:
+                # Slash commands are sent as plain form fields
+                payload = {key: values[0] for key, values in form.items()}
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+
+    if payload.get('type') == 'event_callback':
+        event_id = payload.get('event_id')
+        return ('event', event_id) if event_id else None
+    trigger_id = payload.get('trigger_id')
+    if not trigger_id:
+        return None
+    if 'command' in payload:
+        return 'command', trigger_id
+    action_ts = payload.get('action_ts')
+    actions = payload.get('actions')
+    if action_ts is None and isinstance(actions, list) and len(actions) > 0 and isinstance(actions[0], dict):
+        action_ts = actions[0].get('action_ts')
+    return payload.get('type', 'interactive'), '{}:{}'.format(trigger_id, action_ts or '')
+
+
+class DeliveryCache:
+    """
+    A bounded cache of recently seen delivery keys, which expire after a
+    fixed time.
+    """
+
+    STORE_NAMESPACE = 'slack_deliveries'
+
+    def __init__(self, ttl=600.0, max_entries=10000, metrics=None, store=None):
+        """
+        Parameters
+        ----------
+        ttl : float
+            Seconds a key is remembered. Slack retries an event three
+            times within about five minutes.
+        max_entries : int
+            The most keys remembered in memory; beyond this, the oldest are
+            dropped. Keys in the store are only bounded by the TTL.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, suppressed duplicates are counted there.
+        store : labbot.store.Store, optional
+            If given, keys are claimed in the store, so that duplicates are
+            caught across worker processes; otherwise they are kept in
+            memory.
+        """
+        self.ttl = ttl
+        self.store = store
+        self.max_entries = max_entries
+        self.duplicates = 0
+        self._expiry = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counter = None
+        if metrics is not None:
+            self._counter = metrics.counter(
+                    'labbot_slack_duplicates_total', 'Repeated Slack deliveries that were not dispatched.',
+                    ('type', 'retry'))
+            metrics.gauge('labbot_slack_delivery_keys', 'Slack delivery keys remembered for deduplication.',
+                          callback=lambda: len(self))
+
+    def _expire(self, now):
+        while len(self._expiry) > 0:
+            key, expiry = next(iter(self._expiry.items()))
+            if expiry > now:
+                break
+            del self._expiry[key]
+
+    def check_and_add(self, key, retry=False):
+        """
+        Records `key`, returning True if it is new and False (counting a
+        duplicate) if it was already seen within the TTL.
+
+        Parameters
+        ----------
+        key : tuple
+            A key returned by delivery_key.
+        retry : bool
+            Whether Slack marked the delivery as a retry; only used to
+            label the duplicate count.
+        """
+        if self.store is not None:
+            duplicate = not self.store.claim(self.STORE_NAMESPACE, self._store_key(key), self.ttl)
+            if duplicate:
+                with self._lock:
+                    self.duplicates += 1
+        else:
+            duplicate = self._check_and_add_local(key)
+        if duplicate and self._counter is not None:
+            self._counter.inc(type=key[0], retry='true' if retry else 'false')
+        return not duplicate
+
+    @staticmethod
+    def _store_key(key):
+        return '{}:{}'.format(*key)
+
+    def _check_and_add_local(self, key):
+        """
+        Records `key` in memory, returning True if it was a duplicate.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._expiry:
+                self.duplicates += 1
+                duplicate = True
+            else:
+                self._expiry[key] = now + self.ttl
+                if len(self._expiry) > self.max_entries:
+                    self._expiry.popitem(last=False)
+                duplicate = False
+        return duplicate
+
+    def discard(self, key):
+        """
+        Forgets `key`, so that a later delivery of it is dispatched again,
+        e.g. because handling it failed.
+        """
+        if self.store is not None:
+            self.store.release(self.STORE_NAMESPACE, self._store_key(key))
+            return
+        with self._lock:
+            self._expiry.pop(key, None)
+
+    def __len__(self):
+        if self.store is not None:
+            return self.store.claim_count(self.STORE_NAMESPACE)
+        with self._lock:
+            return len(self._expiry)
+
+    def report(self):
+        """
+        Returns a one-line summary for the status report.
+        """
+        return 'Slack deliveries: {} keys remembered ({}), {} duplicates suppressed'.format(
+                len(self), 'shared store' if self.store is not None else 'in memory', self.duplicates)
@@ -0,0 +1,176 @@
+"""
+Ack-first execution of slow Slack listeners.
+
+Slack expects every interaction to be acknowledged within three seconds,
+and retries events that are not. Listeners share bolt's small listener
+executor, so a listener that runs `git fetch` or updates dozens of
+messages delays the acks of everything queued behind it.
+
+A listener marked with @loader.deferred is instead registered as a short
+wrapper that calls ack() straight away and hands the rest of the work to
+a separate background pool. The time each deferred call spends queued and
+running is recorded, and failures are reported like timer failures.
+"""
+import functools
+import inspect
+import threading
+import time
+import traceback
+
+
+def deferred_signature(func):
+    """
+    Returns the signature bolt should see for the deferred version of
+    `func`: its own arguments (which must not include `ack`), plus `ack`.
+    """
+    signature = inspect.signature(func)
+    ack = inspect.Parameter('ack', inspect.Parameter.POSITIONAL_OR_KEYWORD)
+    return signature.replace(parameters=[ack] + list(signature.parameters.values()))
+
+
+def ack_then(func, submit):
+    """
+    Returns a bolt listener that acks, then calls submit(call) with a
+    function running `func` with the remaining injected arguments.
+    """
+    @functools.wraps(func)
+    def wrapper(**kwargs):
+        kwargs.pop('ack')()
+        return submit(functools.partial(func, **kwargs))
+
+    # bolt reads argument names through __wrapped__, which would hide ack
+    del wrapper.__wrapped__
+    wrapper.__signature__ = deferred_signature(func)
+    return wrapper
+
+
+class DeferredStats:
+    """
+    Queueing and execution times of a single deferred listener.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.total_queue_sec = 0.0
+        self.max_queue_sec = 0.0
+        self.total_run_sec = 0.0
+        self.max_run_sec = 0.0
+
+    @property
+    def mean_queue_sec(self):
+        return self.total_queue_sec / self.calls if self.calls > 0 else 0.0
+
+    @property
+    def mean_run_sec(self):
+        return self.total_run_sec / self.calls if self.calls > 0 else 0.0
+
+
+class DeferredRunner:
+    """
+    Runs the deferred part of listeners in a background thread pool.
+    """
+
+    def __init__(self, executor, on_error=None, metrics=None):
+        """
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor
+            The pool deferred work runs in.
+        on_error : function, optional
+            Called as on_error(name, exception) when deferred work raises.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, queueing and execution times are recorded there.
+        """
+        self.executor = executor
+        self._on_error = on_error
+        self._stats = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._metrics = None
+        if metrics is not None:
+            labels = ('module', 'id')
+            self._metrics = {
+                'queue': metrics.histogram(
+                    'labbot_deferred_queue_seconds', 'Time deferred listener work waited for a worker.', labels),
+                'run': metrics.histogram(
+                    'labbot_deferred_run_seconds', 'Duration of deferred listener work.', labels),
+            }
+            metrics.gauge('labbot_deferred_pending', 'Deferred listener calls queued or running.',
+                          callback=lambda: self._pending)
+
+    def wrap(self, func, module, name, tracer=None):
+        """
+        Returns a bolt listener that acks and runs `func` in the pool.
+
+        Parameters
+        ----------
+        func : function
+            The deferred listener, without its ack-first wrapper.
+        module : str
+            The name of the module the listener belongs to.
+        name : str
+            The listener id, e.g. an action_id.
+        tracer : labbot.tracing.Tracer, optional
+            If given, each deferred run is also recorded as a span.
+        """
+        def submit(call):
+            with self._lock:
+                self._pending += 1
+            try:
+                self.executor.submit(self._run, call, module, name, tracer, time.monotonic())
+            except Exception:
+                with self._lock:
+                    self._pending -= 1
+                raise
+        return ack_then(func, submit)
+
+    def _run(self, call, module, name, tracer, queued):
+        start = time.monotonic()
+        failed = True
+        try:
+            call()
+            failed = False
+        except Exception as e:
+            if self._on_error is not None:
+                self._on_error('{} {}'.format(module, name), e)
+            else:
+                traceback.print_exc()
+        finally:
+            end = time.monotonic()
+            self._record(module, name, start - queued, end - start, failed)
+            if tracer is not None:
+                tracer.record(module, 'deferred', name, end - start, failed=failed)
+
+    def _record(self, module, name, queue_sec, run_sec, failed):
+        with self._lock:
+            self._pending -= 1
+            stats = self._stats.setdefault((module, name), DeferredStats())
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.total_queue_sec += queue_sec
+            stats.max_queue_sec = max(stats.max_queue_sec, queue_sec)
+            stats.total_run_sec += run_sec
+            stats.max_run_sec = max(stats.max_run_sec, run_sec)
+        if self._metrics is not None:
+            self._metrics['queue'].observe(queue_sec, module=module, id=name)
+            self._metrics['run'].observe(run_sec, module=module, id=name)
+
+    def stats(self):
+        """
+        Returns a dictionary mapping (module, listener id) to DeferredStats.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def report(self):
+        """
+        Returns a short, human-readable summary of deferred listener timings.
+        """
+        lines = ['Deferred listeners: {} pending'.format(self._pending)]
+        for (module, name), s in sorted(self.stats().items()):
+            lines.append('{} `{}`: {} calls ({} failed), queued mean {:.3f}s / max {:.3f}s, '
+                         'ran mean {:.3f}s / max {:.3f}s'.format(
+                module, name, s.calls, s.failures, s.mean_queue_sec, s.max_queue_sec,
+                s.mean_run_sec, s.max_run_sec))
+        return '\n'.join(lines)
@@ -0,0 +1,173 @@
+"""
+Graceful draining before a shutdown or restart.
+
+Instead of killing the webserver in the middle of a timer or a handler,
+LabBot drains each process first: new HTTP requests are refused with a
+503 (Slack retries them once LabBot is back), in-flight requests, Slack
+listeners and timers are given until a deadline to finish, and queued
+log messages are flushed. Only then does the process exit (or exec
+itself on restart).
+
+Long-running handlers and timers can check Drain.is_draining (passed to
+modules as config['draining']) to return early or checkpoint their
+progress.
+"""
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+
+class DrainStage:
+    """
+    The outcome of a single drain stage.
+    """
+
+    def __init__(self, name, duration, completed):
+        self.name = name
+        self.duration = duration
+        self.completed = completed
+
+    def __str__(self):
+        return '{} {:.2f}s{}'.format(self.name, self.duration, '' if self.completed else ' (timed out)')
+
+
+class Drain:
+    """
+    Tracks in-flight work and runs the timed stages of a drain.
+    """
+
+    def __init__(self, timeout=30.0):
+        """
+        Parameters
+        ----------
+        timeout : float
+            Seconds the whole drain may take. Stages that are still waiting
+            at the deadline give up.
+        """
+        self.timeout = timeout
+        self.stages = []
+        self._draining = threading.Event()
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._started = None
+
+    def is_draining(self):
+        """
+        True once a drain has begun. Thread-safe.
+        """
+        return self._draining.is_set()
+
+    def begin(self):
+        """
+        Starts draining: new work is refused from now on, and the drain
+        deadline starts counting down.
+        """
+        if not self._draining.is_set():
+            self._started = time.monotonic()
+            self._draining.set()
+
+    def remaining(self):
+        """
+        Returns the number of seconds left until the drain deadline.
+        """
+        if self._started is None:
+            return self.timeout
+        return max(0.0, self._started + self.timeout - time.monotonic())
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @contextlib.contextmanager
+    def track(self):
+        """
+        Context manager counting its body as in-flight work.
+        """
+        with self._idle:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """
+        Waits until no work is in flight.
+
+        Returns
+        -------
+        True if all work finished, False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def stage(self, name, func):
+        """
+        Runs a single drain stage, timing it.
+
+        Parameters
+        ----------
+        name : str
+            The stage name used in the report, e.g. 'timers'.
+        func : function
+            Called as func(timeout) with the seconds left until the
+            deadline. Returns True if the stage completed, False if it
+            timed out.
+
+        Returns
+        -------
+        True if the stage completed.
+        """
+        start = time.monotonic()
+        try:
+            completed = bool(func(self.remaining()))
+        except Exception:
+            completed = False
+        self.stages.append(DrainStage(name, time.monotonic() - start, completed))
+        return completed
+
+    @property
+    def completed(self):
+        """
+        True if every stage run so far completed before the deadline.
+        """
+        return all(stage.completed for stage in self.stages)
+
+    def report(self):
+        """
+        Returns a one-line, human-readable summary of the drain stages.
+        """
+        total = time.monotonic() - self._started if self._started is not None else 0.0
+        return 'Drained in {:.2f}s{}: {}'.format(
+            total,
+            '' if self.completed else ' (deadline of {:g}s hit)'.format(self.timeout),
+            ', '.join(str(stage) for stage in self.stages))
+
+
+class TrackedExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    A thread pool whose tasks count as in-flight work of a Drain.
+
+    bolt runs listeners in its listener executor after the HTTP request
+    that delivered them was acknowledged, so they would not otherwise be
+    waited for.
+    """
+
+    def __init__(self, drain, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain = drain
+
+    def submit(self, fn, *args, **kwargs):
+        tracker = self.drain.track()
+        tracker.__enter__()
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            tracker.__exit__(None, None, None)
+            raise
+        future.add_done_callback(lambda _: tracker.__exit__(None, None, None))
+        return future
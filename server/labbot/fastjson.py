@@ -0,0 +1,76 @@
+"""
+Fast JSON encoding of Slack payloads and HTTP responses.
+
+Block Kit views are large nested structures, and the standard library's
+encoder spends a noticeable part of a handler's time serializing them. If
+orjson is installed (pip install -e .[fast]) it is used instead; otherwise
+everything falls back to the json module, producing equivalent JSON.
+
+- dumps(obj) returns a compact JSON string, for Slack API arguments.
+- dumps_bytes(obj) returns UTF-8 JSON bytes, for HTTP bodies.
+- FastJSONResponse is a FastAPI response class using dumps_bytes; LabBot's
+  webserver uses it as the default response class.
+"""
+import json
+
+import fastapi
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = 'orjson' if orjson is not None else 'json'
+
+
+def _dumps_stdlib(obj, sort_keys=False):
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps_bytes(obj, sort_keys=False):
+    """
+    Returns `obj` encoded as compact UTF-8 JSON bytes.
+
+    Parameters
+    ----------
+    obj
+        A JSON-serializable value.
+    sort_keys : bool
+        If True, dictionary keys are sorted, so equal values always give
+        equal output.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the json module still encodes
+            pass
+    return _dumps_stdlib(obj, sort_keys).encode('utf-8')
+
+
+def dumps(obj, sort_keys=False):
+    """
+    Returns `obj` encoded as a compact JSON string. See dumps_bytes.
+    """
+    if orjson is not None:
+        return dumps_bytes(obj, sort_keys).decode('utf-8')
+    return _dumps_stdlib(obj, sort_keys)
+
+
+def loads(data):
+    """
+    Decodes JSON from a string or bytes.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(fastapi.responses.JSONResponse):
+    """
+    A JSON response encoded with dumps_bytes.
+    """
+
+    def render(self, content):
+        return dumps_bytes(content)
@@ -0,0 +1,448 @@
+"""
+Event-driven publisher for the Slack home tab.
+
+Modules request a refresh by calling update_home_tab(). Requests only set
+an asyncio event; the publisher waits for that event, then waits a short
+debounce window so that a burst of requests (e.g. several iMonnit webhooks
+arriving together) collapses into a single render pass.
+
+The home tab shows the same content to every user. Each refresh renders
+it once, on a single render thread, so that module home tab functions never
+run concurrently with each other or themselves; only the views.publish
+calls for each user are fanned out on a bounded thread pool, rate limited
+to the views.publish tier. The event loop is never blocked by rendering,
+store queries or Slack calls.
+
+Home tab functions declared with invalidation keys are memoized: their
+block lists are reused until update_home_tab is called with one of their
+keys, so a refresh only recomputes the fragments that are stale.
+"""
+import asyncio
+import collections
+import concurrent.futures
+from datetime import datetime
+import hashlib
+import threading
+import time
+import traceback
+
+import pytz
+
+from labbot import fastjson
+from labbot.ratelimit import TokenBucket
+from labbot.slack_client import RateLimitedWebClient
+
+ETC = pytz.timezone('America/New_York')
+
+
+def greeting_header():
+    """
+    Returns the header block greeting the user for the current time of day.
+    """
+    hour = datetime.now(ETC).hour
+    if hour < 5:
+        time_summary = 'night'
+    elif hour < 12:
+        time_summary = 'morning'
+    elif hour < 17:
+        time_summary = 'afternoon'
+    else:
+        time_summary = 'evening'
+    return {
+        "type": "header",
+        "text": {
+            "type": "plain_text",
+            "text": "Good {}!".format(time_summary),
+        }}
+
+
+class ViewCache:
+    """
+    Remembers a hash of the view last published to each user, so that
+    unchanged views do not need to be re-sent to Slack.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def view_hash(view):
+        """
+        Returns a stable hash of a view dictionary.
+        """
+        return hashlib.sha256(fastjson.dumps_bytes(view, sort_keys=True)).hexdigest()
+
+    def is_unchanged(self, user, view_hash):
+        """
+        Returns True (and counts a hit) if `view_hash` is what was last
+        published to `user`, otherwise counts a miss.
+        """
+        with self._lock:
+            if self._hashes.get(user) == view_hash:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def store(self, user, view_hash):
+        with self._lock:
+            self._hashes[user] = view_hash
+
+    def invalidate(self, user=None):
+        """
+        Forgets the published view for `user`, or for everyone if user is None.
+        """
+        with self._lock:
+            if user is None:
+                self._hashes.clear()
+            else:
+                self._hashes.pop(user, None)
+
+
+class FragmentCache:
+    """
+    Memoizes the blocks returned by keyed home tab functions.
+
+    Each invalidation key has a generation counter. A cached fragment is
+    reused while the generations of all its keys are unchanged since it
+    was computed, so a fragment rendered concurrently with an invalidation
+    is never mistaken for a fresh one.
+    """
+
+    def __init__(self):
+        self._generations = collections.Counter()
+        self._fragments = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, key):
+        """
+        Marks every fragment depending on `key` as stale.
+        """
+        with self._lock:
+            self._generations[key] += 1
+
+    def forget(self, func):
+        """
+        Drops every cached fragment of `func` (e.g. when its module is unloaded).
+        """
+        with self._lock:
+            self._fragments.pop(func, None)
+
+    def render(self, func, keys):
+        """
+        Returns func(None), reusing the cached result if none of `keys`
+        were invalidated since it was computed. Functions without keys
+        are always called.
+        """
+        if not keys:
+            return func(None)
+        with self._lock:
+            generations = tuple(self._generations[key] for key in keys)
+            cached = self._fragments.get(func)
+            if cached is not None and cached[0] == generations:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        blocks = func(None)
+        with self._lock:
+            self._fragments[func] = (generations, blocks)
+        return blocks
+
+
+class RefreshTiming:
+    """
+    Timing breakdown of a single home tab refresh.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.published = 0
+        self.skipped = 0
+        self.failed = 0
+        self.render_sec = 0.0
+        self.users_sec = 0.0
+        self.rate_limit_wait_sec = 0.0
+        self.publish_sec = 0.0
+        self.slowest_user_sec = 0.0
+        self.total_sec = 0.0
+
+    def __str__(self):
+        return ('{} users ({} published, {} unchanged, {} failed) in {:.3f}s: '
+                'render {:.3f}s, user lookup {:.3f}s, rate limit wait {:.3f}s, publish {:.3f}s, '
+                'slowest user {:.3f}s').format(
+                self.users, self.published, self.skipped, self.failed, self.total_sec,
+                self.render_sec, self.users_sec, self.rate_limit_wait_sec, self.publish_sec,
+                self.slowest_user_sec)
+
+
+class HomeTabPublisher:
+    """
+    Renders and publishes the home tab whenever an update is requested.
+    """
+
+    def __init__(self, slack_client, debounce=0.5, logger=None, max_workers=4, rate_limiter=None, store=None,
+                 metrics=None):
+        """
+        Parameters
+        ----------
+        slack_client
+            The Slack WebClient used to call views_publish.
+        debounce : float
+            Seconds to wait after the first update request before rendering,
+            so that further requests in that window are merged into one pass.
+        logger : function, optional
+            Called as logger(message) when rendering or publishing fails.
+        max_workers : int
+            The number of users the home tab is published to concurrently.
+        rate_limiter : TokenBucket, optional
+            Limits the rate of views_publish calls. Defaults to a bucket
+            matching Slack's tier 4 limit for views.publish, unless
+            slack_client is a labbot.slack_client.RateLimitedWebClient,
+            which already limits them.
+        store : labbot.store.Store, optional
+            If given, the set of home tab users is kept in the store, so that
+            it is shared between worker processes and survives restarts.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, render and refresh durations and publish outcomes are
+            recorded there.
+        """
+        self.slack_client = slack_client
+        self.debounce = debounce
+        self.logger = logger
+        self.store = store
+        self._users = set()
+        # (function, invalidation keys) pairs, in display order
+        self.functions = []
+        self.cache = ViewCache()
+        self.fragments = FragmentCache()
+        if rate_limiter is None and not isinstance(slack_client, RateLimitedWebClient):
+            rate_limiter = TokenBucket.for_tier(4)
+        self.rate_limiter = rate_limiter
+        self.last_refresh = None
+        # Module home tab functions only ever run on this one thread
+        self._render_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='home-tab-render')
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='home-tab')
+        self._lock = threading.Lock()
+        self._pending = False
+        self._loop = None
+        self._event = None
+        self._stopping = False
+        self._metrics = None
+        if metrics is not None:
+            self._metrics = {
+                'render': metrics.histogram(
+                    'labbot_home_tab_render_seconds', 'Time to render the home tab.'),
+                'refresh': metrics.histogram(
+                    'labbot_home_tab_refresh_seconds', 'Time to render and publish the home tab for every user.'),
+                'publishes': metrics.counter(
+                    'labbot_home_tab_publishes_total', 'Per-user home tab publishes by outcome.', ('outcome',)),
+            }
+
+    def add_user(self, user):
+        """
+        Registers a user that has opened the home tab.
+        """
+        if user in self._users:
+            return
+        self._users.add(user)
+        if self.store is not None:
+            self.store.set_add('home_tab_users', user)
+
+    def users(self):
+        """
+        Returns the set of users that have opened the home tab.
+        """
+        if self.store is not None:
+            return self.store.set_members('home_tab_users')
+        return set(self._users)
+
+    def report(self):
+        """
+        Returns a short, human-readable summary of home tab cache usage.
+        """
+        summary = ('Home tab: {} publishes skipped (cache hits), {} published (cache misses), '
+                   '{} fragments reused, {} recomputed').format(
+            self.cache.hits, self.cache.misses,
+            self.fragments.hits, self.fragments.misses)
+        if self.last_refresh is not None:
+            summary += '\nLast home tab refresh: {}'.format(self.last_refresh)
+        return summary
+
+    def request_update(self, key=None):
+        """
+        Schedules an update of the home tab. Thread-safe and non-blocking.
+
+        Parameters
+        ----------
+        key : str, optional
+            The invalidation key whose data changed. Fragments declared with
+            this key are recomputed; other keyed fragments are reused.
+        """
+        if key is not None:
+            self.fragments.invalidate(key)
+        with self._lock:
+            self._pending = True
+            loop, event = self._loop, self._event
+        if loop is not None:
+            loop.call_soon_threadsafe(event.set)
+
+    def stop(self):
+        """
+        Stops the publisher loop. Thread-safe.
+        """
+        self._stopping = True
+        with self._lock:
+            loop, event = self._loop, self._event
+        if loop is not None:
+            loop.call_soon_threadsafe(event.set)
+        self._render_executor.shutdown(wait=False)
+        self._executor.shutdown(wait=False)
+
+    def render(self):
+        """
+        Renders the home tab view, which is shared by every user.
+
+        Module home tab functions are called with None as their user.
+        """
+        blocks = [greeting_header()]
+        for f, keys in self.functions:
+            mod_blocks = self.fragments.render(f, keys)
+            if len(mod_blocks) > 0:
+                blocks.append({ "type": "divider" })
+                blocks.extend(mod_blocks)
+        return {
+                "type": "home",
+                "blocks": blocks
+                }
+
+    def _render_view(self):
+        """
+        Returns (view, view hash, render_sec). Runs on the render thread.
+        """
+        start = time.monotonic()
+        view = self.render()
+        view_hash = self.cache.view_hash(view)
+        render_sec = time.monotonic() - start
+        if self._metrics is not None:
+            self._metrics['render'].observe(render_sec)
+        return view, view_hash, render_sec
+
+    def _list_users(self):
+        start = time.monotonic()
+        return list(self.users()), time.monotonic() - start
+
+    async def publish_all(self):
+        """
+        Renders the home tab once, then publishes it to every registered
+        user concurrently on the worker pool.
+
+        Returns
+        -------
+        A RefreshTiming describing the refresh.
+        """
+        loop = asyncio.get_running_loop()
+        timing = RefreshTiming()
+        start = time.monotonic()
+        (view, view_hash, timing.render_sec), (users, timing.users_sec) = await asyncio.gather(
+                loop.run_in_executor(self._render_executor, self._render_view),
+                loop.run_in_executor(self._executor, self._list_users))
+        results = await asyncio.gather(
+                *[loop.run_in_executor(self._executor, self.publish, user, view, view_hash) for user in users],
+                return_exceptions=True)
+
+        timing.users = len(users)
+        for result in results:
+            if isinstance(result, BaseException):
+                timing.failed += 1
+                self._log_error(result)
+                continue
+            published, wait_sec, publish_sec = result
+            if published:
+                timing.published += 1
+            else:
+                timing.skipped += 1
+            timing.rate_limit_wait_sec += wait_sec
+            timing.publish_sec += publish_sec
+            timing.slowest_user_sec = max(timing.slowest_user_sec, wait_sec + publish_sec)
+        timing.total_sec = time.monotonic() - start
+        self.last_refresh = timing
+        if self._metrics is not None:
+            self._metrics['refresh'].observe(timing.total_sec)
+            for outcome, count in (('published', timing.published), ('unchanged', timing.skipped),
+                                   ('failed', timing.failed)):
+                if count > 0:
+                    self._metrics['publishes'].inc(count, outcome=outcome)
+        return timing
+
+    def publish(self, user, view, view_hash):
+        """
+        Publishes the rendered home tab `view` to `user`, calling
+        views_publish only if it differs from the one last published to them.
+
+        Returns
+        -------
+        A tuple (published, rate_limit_wait_sec, publish_sec), where
+        published is False if the cached view was reused.
+        """
+        if self.cache.is_unchanged(user, view_hash):
+            return (False, 0.0, 0.0)
+
+        wait_sec = self.rate_limiter.acquire() if self.rate_limiter is not None else 0.0
+        publish_start = time.monotonic()
+        try:
+            self.slack_client.views_publish(
+                    user_id=user,
+                    view=view)
+        except Exception:
+            self.cache.invalidate(user)
+            raise
+        self.cache.store(user, view_hash)
+        publish_sec = time.monotonic() - publish_start
+        if isinstance(self.slack_client, RateLimitedWebClient):
+            client_wait_sec = self.slack_client.rate_limiter.last_wait_sec()
+            wait_sec += client_wait_sec
+            publish_sec -= client_wait_sec
+        return (True, wait_sec, publish_sec)
+
+    def _log_error(self, e):
+        if self.logger is not None:
+            self.logger('Home tab error:\nError:\n```{}```\nStacktrace:\n```{}```'.format(
+                e,
+                '\n'.join(traceback.TracebackException.from_exception(e).format())))
+        else:
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    async def run(self):
+        """
+        Waits for update requests and publishes the home tab, until stop()
+        is called.
+        """
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+            if self._pending:
+                self._event.set()
+
+        while not self._stopping:
+            await self._event.wait()
+            if self._stopping:
+                break
+            # Let further requests accumulate during the debounce window
+            await asyncio.sleep(self.debounce)
+            with self._lock:
+                self._event.clear()
+                self._pending = False
+            try:
+                # Recorded in last_refresh (status report) and on /metrics
+                await self.publish_all()
+            except Exception as e:
+                self._log_error(e)
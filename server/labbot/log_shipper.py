@@ -0,0 +1,177 @@
+"""
+Background shipper for messages logged to the #labbot_debug channel.
+
+Logging only puts the message on a bounded queue, so callers (FastAPI
+handlers, Slack listeners and timers) never block on a Slack round-trip.
+A background thread drains the queue, merges messages with the same header
+that arrive within a short window into a single Slack message, and
+summarizes messages that had to be dropped because the queue was full.
+"""
+import collections
+import os
+import queue
+import threading
+import time
+
+# Slack section blocks are limited to 3000 characters
+MAX_MESSAGE_CHARS = 2000
+MAX_BLOCK_CHARS = 2900
+
+
+class LogShipper:
+    """
+    Ships log messages to a Slack channel from a background thread.
+    """
+
+    def __init__(self, slack_client, channel='#labbot_debug', window=2.0, max_queued=500):
+        """
+        Parameters
+        ----------
+        slack_client
+            The Slack WebClient used to post messages.
+        channel : str
+            The channel to post to.
+        window : float
+            Messages with the same header arriving within this many seconds
+            of each other are merged into one Slack message.
+        max_queued : int
+            The maximum number of pending messages. Further messages are
+            dropped and reported as a count.
+        """
+        self.slack_client = slack_client
+        self.channel = channel
+        self.window = window
+        self.sent = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._dropped_by_header = collections.Counter()
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._thread = None
+        # Threads and locks do not survive a fork, so start afresh in children
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._dropped_by_header = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def log(self, message, header):
+        """
+        Queues a message for logging. Never blocks.
+
+        Parameters
+        ----------
+        message : str
+            A string message to log.
+        header : str
+            The module/source that generated the message.
+        """
+        self._ensure_started()
+        if len(message) > MAX_MESSAGE_CHARS:
+            message = message[:MAX_MESSAGE_CHARS]
+        try:
+            self._queue.put_nowait((header, message))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._dropped_by_header[header] += 1
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message has been posted.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait.
+
+        Returns
+        -------
+        True if the queue was fully flushed, False on timeout.
+        """
+        self._flushing = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks > 0:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._queue.all_tasks_done.wait(remaining)
+            return True
+        finally:
+            self._flushing = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._worker, name='log-shipper', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """
+        Blocks for a message, then collects further messages until the
+        window closes.
+
+        Returns
+        -------
+        A tuple (batch, taken) of an ordered mapping of header -> messages,
+        and the number of messages taken off the queue.
+        """
+        batch = collections.OrderedDict()
+        header, message = self._queue.get()
+        batch.setdefault(header, []).append(message)
+        taken = 1
+        deadline = time.monotonic() + self.window
+        while not self._flushing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                header, message = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.setdefault(header, []).append(message)
+            taken += 1
+        return batch, taken
+
+    def _worker(self):
+        while True:
+            batch, taken = self._collect()
+            with self._lock:
+                dropped = self._dropped_by_header
+                self._dropped_by_header = collections.Counter()
+            for header, count in dropped.items():
+                batch.setdefault(header, []).append(
+                        '_{} further message{} dropped: log queue full_'.format(count, '' if count == 1 else 's'))
+
+            for header, messages in batch.items():
+                try:
+                    self._post(header, messages)
+                except Exception as e:
+                    print('Unable to post log message: {}'.format(e))
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def _post(self, header, messages):
+        if len(messages) == 1:
+            text = '`{}`:\n{}'.format(header, messages[0])
+        else:
+            text = '`{}` ({} messages):'.format(header, len(messages))
+            for i, message in enumerate(messages):
+                if len(text) + len(message) + 1 > MAX_BLOCK_CHARS:
+                    text += '\n_...and {} more_'.format(len(messages) - i)
+                    break
+                text += '\n' + message
+        self.slack_client.chat_postMessage(
+                channel=self.channel,
+                text='Labbot log:{}'.format(header),
+                blocks=[{'type':'section', 'text':
+                    {'type': 'mrkdwn', 'text': text[:MAX_BLOCK_CHARS]}}])
+        self.sent += 1
@@ -0,0 +1,243 @@
+"""
+In-process metrics, exported in the Prometheus text format on /metrics.
+
+The core instruments timers, Slack listeners, FastAPI routes, Slack API
+calls and the home tab; modules can add their own counters through
+ModuleLoader.counter. Everything is kept in memory, so in multi-worker
+mode each scrape reports the worker process that served it.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+# Latency buckets in seconds, from 5ms to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def slack_listener_labels(body):
+    """
+    Returns a (listener type, id) pair describing the Slack request `body`,
+    e.g. ('action', 'open_dev_tools') or ('event', 'app_home_opened').
+    """
+    if 'command' in body:
+        return 'command', body['command']
+    kind = body.get('type', 'unknown')
+    if kind == 'event_callback':
+        return 'event', body.get('event', {}).get('type', '')
+    if kind == 'block_actions':
+        actions = body.get('actions') or [{}]
+        return 'action', actions[0].get('action_id', '')
+    if kind in ('view_submission', 'view_closed'):
+        return 'view', body.get('view', {}).get('callback_id', '')
+    if kind in ('shortcut', 'message_action'):
+        return 'shortcut', body.get('callback_id', '')
+    if kind == 'block_suggestion':
+        return 'options', body.get('action_id', '')
+    return kind, ''
+
+
+class Metric:
+    """
+    Base class of a named metric with an optional set of label names.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Parameters
+        ----------
+        name : str
+            The metric name, e.g. 'labbot_timer_runs_total'.
+        documentation : str
+            A one-line description, shown as the metric's HELP text.
+        labels : tuple of str
+            The label names. Every update must give a value for each.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('{} expects labels {}, got {}'.format(self.name, self.labels, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Returns a list of (suffix, label value tuple, extra labels, value).
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation.replace('\n', ' ')),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(self.labels, values, extra), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. a number of calls.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, e.g. a queue depth.
+
+    Instead of being set, a gauge can be given a callback that is called
+    on every scrape. The callback returns either a number, or (for gauges
+    with labels) a dictionary mapping label value tuples to numbers.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [('', tuple(str(v) for v in key), (), value) for key, value in values.items()]
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """
+    Counts observations (e.g. durations) into cumulative buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the duration of its body.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        results = []
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                results.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+            results.append(('_sum', key, (), total))
+            results.append(('_count', key, (), cumulative))
+        return results
+
+
+class MetricsRegistry:
+    """
+    The set of metrics exported on /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric. Raises ValueError if its name is already taken.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('Metric {} is already registered!'.format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, metric):
+        with self._lock:
+            if self._metrics.get(metric.name) is metric:
+                del self._metrics[metric.name]
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
@@ -5,102 +5,149 @@ This allows FastAPI and python-bolt style decorators to be used almost
 directly, even though each module will not be creating its own instances
 of these runners.
 """
+import collections
 import functools
+import inspect
 
 import slack_bolt
 import fastapi
 
-class SlackPassthrough:
+from labbot.async_compat import is_async_app, to_async_listener
+from labbot.deferred import ack_then
+from labbot.metrics import Counter
+from labbot.schedules import CronSchedule, IntervalSchedule
+from labbot.scheduler import TimerPolicy
+from labbot.tracing import UNTRACED_SLACK_DECORATORS, handler_id
+
+Decoration = collections.namedtuple('Decoration', ['method', 'func', 'args', 'kwargs'])
+Decoration.__doc__ = """
+A deferred decorator call, recorded as method(*args, **kwargs)(func).
+"""
+
+Manifest = collections.namedtuple('Manifest', ['slack', 'fastapi'])
+Manifest.__doc__ = """
+The validated, immutable set of Slack and FastAPI decorations of a module.
+"""
+
+@functools.lru_cache(maxsize=None)
+def public_methods(cls):
+    """
+    Returns the set of non-dunder method names of a class. Cached, so that
+    each class is only inspected once however many modules are loaded.
     """
-    Helper class that creates helper functions for every
-    non-protected method that slack_bolt.App exports, saving
-    the decorator arguments for calling later.
+    return frozenset(f for f in dir(cls)
+                     if callable(getattr(cls, f))
+                     and not f.startswith("__"))
+
+class DeferredPassthrough:
+    """
+    Helper class that records calls to any non-protected method of
+    `target_class` used as a decorator, saving the decorator arguments
+    for calling later.
+
+    Method names are resolved lazily on attribute access, against a
+    method set cached per target class.
     """
-    
+
+    target_class = None
+
     def __init__(self):
-        """
-        Looks at the module export for async_app and copies these functions.
-        """
         self.accumulator = []
 
-        slack_methods = [f for f in dir(slack_bolt.App)
-                            if callable(getattr(slack_bolt.App, f))
-                            and not f.startswith("__")]
-        for method in slack_methods:
-            setattr(self, method, functools.partial(self._defer_slack, method))
-    
-    def _defer_slack(self, method_name, *args, **kwargs):
+    def __getattr__(self, method_name):
+        if method_name.startswith('__') or method_name not in public_methods(self.target_class):
+            raise AttributeError("{} has no decorator '{}'".format(self.target_class.__name__, method_name))
+        return functools.partial(self._defer, method_name)
+
+    def _defer(self, method_name, *args, **kwargs):
         """
-        Function to be specalized to a specific Slack function.
+        Function to be specalized to a specific method name.
         Takes arbitrary args and kwargs that later get passed to the
-        named Slack function. 
+        named function.
 
         Parameters
         ----------
         method_name : str
             The name of the method decorator to later be called as:
-            slack_bolt.App.method_name(*args. **kwargs)(func)
+            target.method_name(*args. **kwargs)(func)
         *args
             Variable length argument list
         **kwargs
             Arbitrary keyword arguments
 
-        Returns:
+        Returns
         --------
         A function with the signature "f(decorated_func)" that returns
         the decorated func directly.
         """
 
         def decorator(func):
-            self.accumulator.append((method_name, func, args, kwargs))
+            self.accumulator.append(Decoration(method_name, func, args, kwargs))
             return func
         return decorator
 
-class FastAPIPassthrough:
+class SlackPassthrough(DeferredPassthrough):
     """
-    Helper class that creates helper functions for every
-    non-protected method that FastAPI.App exports, saving
-    the decorator arguments for calling later.
+    Records decorators of slack_bolt.App, e.g. @loader.slack.action(...).
     """
-    
-    def __init__(self):
-        """
-        Looks at the module export for async_app and copies these functions.
-        """
-        self.accumulator = []
+    target_class = slack_bolt.App
 
-        fastapi_methods = [f for f in dir(fastapi.FastAPI)
-                            if callable(getattr(fastapi.FastAPI, f))
-                            and not f.startswith("__")]
-        for method in fastapi_methods:
-            setattr(self, method, functools.partial(self._defer_fastapi, method))
-    
-    def _defer_fastapi(self, method_name, *args, **kwargs):
-        """
-        Function to be specalized to a specific FastAPI function.
-        Takes arbitrary args and kwargs that later get passed to the
-        named function. 
+class FastAPIPassthrough(DeferredPassthrough):
+    """
+    Records decorators of fastapi.FastAPI, e.g. @loader.fastapi.get(...).
+    """
+    target_class = fastapi.FastAPI
 
-        Parameters
-        ----------
-        method_name : str
-            The name of the method decorator to later be called as:
-            App.method_name(*args. **kwargs)(func)
-        *args
-            Variable length argument list
-        **kwargs
-            Arbitrary keyword arguments
+# Attributes of slack_bolt.App / AsyncApp holding registered listeners and middleware
+BOLT_REGISTRIES = ('_listeners', '_middleware_list', '_async_listeners', '_async_middleware_list')
 
-        Returns
-        --------
-        A function with the signature "f(decorated_func)" that returns
-        the decorated func directly.
+class Registration:
+    """
+    Records what a ModuleLoader added to the Slack and FastAPI apps, so that
+    it can later be removed again (e.g. to hot-reload a module).
+    """
+
+    def __init__(self, slack_bolt_instance, fastapi_instance):
+        self.slack_bolt_instance = slack_bolt_instance
+        self.fastapi_instance = fastapi_instance
+        self.slack_items = {}
+        self.fastapi_routes = []
+
+    def _snapshot(self):
+        slack_snapshot = {attr: list(getattr(self.slack_bolt_instance, attr))
+                          for attr in BOLT_REGISTRIES
+                          if isinstance(getattr(self.slack_bolt_instance, attr, None), list)}
+        return slack_snapshot, list(self.fastapi_instance.router.routes)
+
+    def record_difference(self, before):
         """
+        Records every listener and route added since the `before` snapshot.
+        """
+        slack_before, routes_before = before
+        slack_after, routes_after = self._snapshot()
+        for attr, items in slack_after.items():
+            old_ids = {id(item) for item in slack_before.get(attr, [])}
+            self.slack_items[attr] = [item for item in items if id(item) not in old_ids]
+        old_ids = {id(route) for route in routes_before}
+        self.fastapi_routes = [route for route in routes_after if id(route) not in old_ids]
 
-        def decorator(func):
-            self.accumulator.append((method_name, func, args, kwargs))
-            return func
-        return decorator
+    def unregister(self):
+        """
+        Removes the recorded listeners and routes. The lists are replaced
+        rather than mutated, so requests being dispatched concurrently keep
+        iterating over a consistent list.
+        """
+        for attr, items in self.slack_items.items():
+            ids = {id(item) for item in items}
+            setattr(self.slack_bolt_instance, attr,
+                    [item for item in getattr(self.slack_bolt_instance, attr) if id(item) not in ids])
+        ids = {id(route) for route in self.fastapi_routes}
+        self.fastapi_instance.router.routes = [
+            route for route in self.fastapi_instance.router.routes if id(route) not in ids]
+        # Force the OpenAPI schema to be regenerated
+        self.fastapi_instance.openapi_schema = None
+        self.slack_items = {}
+        self.fastapi_routes = []
 
 class ModuleLoader:
     """
@@ -115,6 +162,10 @@ class ModuleLoader:
     To integrate with the rest of LabBot, you should have a standalone
     function "register_module", which returns the ModuleLoader created.
     Surrounding code uses this to initalize all of the functions.
+
+    Slack listeners and timers may also be declared with `async def`. These
+    are only supported when LabBot runs in async mode (global.async_slack),
+    where they are awaited on the event loop and receive an AsyncWebClient.
     """
 
     def __init__(self):
@@ -122,37 +173,203 @@ class ModuleLoader:
         self.fastapi = FastAPIPassthrough()
         self.timer_accumulator = []
         self.home_accumulator = []
+        self.metric_accumulator = []
+        self._manifests = {}
 
-    def home_tab(self, func):
+    def home_tab(self, func=None, *, keys=None):
         """
         Decorator that records functions used to return
         home tab content. This function should NOT block.
 
+        The home tab shows the same content to every user: the function is
+        called once per refresh, with None as its user argument, and its
+        blocks are published to everyone.
+
+        Can be used either bare (@loader.home_tab) or with invalidation
+        keys, e.g. @loader.home_tab(keys=['sensors']). A function with keys
+        is only re-run once hometab_update is called with one of its keys;
+        otherwise its last result is reused. Functions without keys are
+        re-run on every home tab refresh.
+
         Parameters
         ----------
         func : function
-            This function is expected to return a list of dictionaries,
-            where each dictionary is a slack Block.
+            Called as func(user), with user None, and expected to return a
+            list of dictionaries, where each dictionary is a slack Block.
+        keys : list of str, optional
+            The invalidation keys this function's output depends on.
         """
-        self.home_accumulator.append(func)
-        return func
+        if isinstance(keys, str):
+            keys = [keys]
+        keys = tuple(sorted(keys)) if keys else ()
+        def decorator(func):
+            self.home_accumulator.append((func, keys))
+            return func
 
-    def timer(self, func):
+        if func is None:
+            return decorator
+        return decorator(func)
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Creates a counter exported on LabBot's /metrics endpoint.
+
+        The counter can be used as soon as it is created, e.g. at module
+        import time; it is exported once the module is registered.
+
+        Parameters
+        ----------
+        name : str
+            The metric name, which must be unique across LabBot. By
+            convention, this is 'labbot_<module>_<thing>_total'.
+        documentation : str
+            A one-line description of what is counted.
+        labels : tuple of str
+            The label names passed to each call of inc().
+
+        Returns
+        -------
+        A labbot.metrics.Counter. Call counter.inc(amount=1, **labels).
+        """
+        counter = Counter(name, documentation, labels)
+        self.metric_accumulator.append(counter)
+        return counter
+
+    def timer(self, func=None, *, max_instances=1, overlap='skip', catch_up=None, max_queued=10,
+              cron=None, every=None, jitter=0.0):
         """
         Decorator that calls the given function in a timer in the async loop.
 
+        Can be used either bare (@loader.timer) or with a policy, e.g.
+        @loader.timer(overlap='coalesce', catch_up='skip'). See
+        labbot.scheduler.TimerPolicy for the meaning of each option.
+
+        Timers can also run on a wall-clock schedule instead of after the
+        delay they return, e.g. @loader.timer(cron='0 9 * * mon-fri') or
+        @loader.timer(every=300), which runs on every fifth minute.
+
         Parameters
         ----------
         func : function
             A function that will be called without arguments on a timer loop.
             This function is expected to return a float or integer representing
             the number of seconds before it should be called again.
+        max_instances : int
+            The maximum number of concurrent runs of this timer.
+        overlap : str
+            One of 'skip', 'queue' or 'coalesce': what happens when the timer
+            is due while max_instances runs are still in progress.
+        catch_up : str, optional
+            One of 'coalesce' (the default), 'skip' or 'all': what happens to
+            ticks that were missed during a long stall. Not allowed with cron
+            or every, as scheduled timers always skip missed runs.
+        max_queued : int
+            The maximum number of pending ticks when overlap='queue'.
+        cron : str, optional
+            A cron expression (minute hour day month weekday, in local time)
+            giving the times to run at.
+        every : float, optional
+            Run every this many seconds, aligned to the wall clock.
+        jitter : float
+            Delay each run by a random amount of up to this many seconds.
         """
+        if cron is not None and every is not None:
+            raise ValueError('A timer can have a cron or an every schedule, not both!')
+        if cron is not None:
+            schedule = CronSchedule(cron)
+        elif every is not None:
+            schedule = IntervalSchedule(every)
+        else:
+            schedule = None
+        policy = TimerPolicy(max_instances=max_instances, overlap=overlap,
+                             catch_up=catch_up, max_queued=max_queued,
+                             schedule=schedule, jitter=jitter)
+        def decorator(func):
+            self.timer_accumulator.append((func, policy))
+            return func
 
-        self.timer_accumulator.append(func)
-        return func
+        if func is None:
+            return decorator
+        return decorator(func)
 
-    def register(self, slack_bolt_instance, fastapi_instance):
+    def deferred(self, func):
+        """
+        Decorator for slow Slack listeners, that acks the request straight
+        away and runs the listener itself in a background pool. Use it
+        below the Slack decorator:
+
+            @loader.slack.action('commit_validate')
+            @loader.deferred
+            def validate_commit(body, client):
+                ...
+
+        Parameters
+        ----------
+        func : function
+            A synchronous listener. It must not take `ack`, as the request
+            is acknowledged before it runs; listeners that ack with errors
+            or a response_action cannot be deferred.
+        """
+        if inspect.iscoroutinefunction(func):
+            raise ValueError('{} is async; it does not need to be deferred'.format(func.__qualname__))
+        if 'ack' in inspect.signature(func).parameters:
+            raise ValueError('Deferred listener {} must not take ack'.format(func.__qualname__))
+        # Until registered with a DeferredRunner, runs on the calling thread
+        wrapper = ack_then(func, lambda call: call())
+        wrapper.deferred = func
+        return wrapper
+
+    def validate(self, slack_bolt_class=slack_bolt.App, fastapi_class=fastapi.FastAPI):
+        """
+        Checks everything recorded by the decorators against the Slack
+        and FastAPI app classes, once per pair of classes.
+
+        Parameters
+        ----------
+        slack_bolt_class
+            slack_bolt.App or slack_bolt.async_app.AsyncApp
+        fastapi_class
+            fastapi.FastAPI
+
+        Returns
+        -------
+        The validated Manifest. Raises a RuntimeError listing every problem
+        found otherwise, before anything has been registered.
+        """
+        manifest = self._manifests.get((slack_bolt_class, fastapi_class))
+        if (manifest is not None and len(manifest.slack) == len(self.slack.accumulator)
+                and len(manifest.fastapi) == len(self.fastapi.accumulator)):
+            return manifest
+
+        problems = []
+        async_app = is_async_app(slack_bolt_class)
+        slack_methods = public_methods(slack_bolt_class)
+        fastapi_methods = public_methods(fastapi_class)
+        for decoration in self.slack.accumulator:
+            if decoration.method not in slack_methods:
+                problems.append('{} has no decorator {}'.format(slack_bolt_class.__name__, decoration.method))
+            if not callable(decoration.func):
+                problems.append('Slack listener {!r} is not callable!'.format(decoration.func))
+            elif inspect.iscoroutinefunction(decoration.func) and not async_app:
+                problems.append('Slack listener {} is async, but LabBot is not running in async mode!'.format(
+                    decoration.func.__qualname__))
+        for decoration in self.fastapi.accumulator:
+            if decoration.method not in fastapi_methods:
+                problems.append('{} has no decorator {}'.format(fastapi_class.__name__, decoration.method))
+            if not callable(decoration.func):
+                problems.append('FastAPI handler {!r} is not callable!'.format(decoration.func))
+        for func, _ in self.timer_accumulator + self.home_accumulator:
+            if not callable(func):
+                problems.append('{!r} is not callable!'.format(func))
+        if len(problems) > 0:
+            raise RuntimeError('\n'.join(problems))
+
+        manifest = Manifest(tuple(self.slack.accumulator), tuple(self.fastapi.accumulator))
+        self._manifests[(slack_bolt_class, fastapi_class)] = manifest
+        return manifest
+
+    def register(self, slack_bolt_instance, fastapi_instance, sync_slack_client=None, tracer=None, module_name='',
+                 deferred_runner=None):
         """
         Given the instances of slack and FastAPI, uses the information
         recorded by the decorators to register the functions properly.
@@ -160,14 +377,42 @@ class ModuleLoader:
         Parameters
         ----------
         slack_bolt_instance
-            Instance of slack_bolt.App
+            Instance of slack_bolt.App or slack_bolt.async_app.AsyncApp
         fastapi_instance
             Instance of fastapi.FastAPI
+        sync_slack_client
+            A slack_sdk.WebClient handed to synchronous listeners in place
+            of the AsyncWebClient when registering on an AsyncApp.
+        tracer : labbot.tracing.Tracer, optional
+            If given, every Slack listener and FastAPI route handler is
+            wrapped so that its duration (and ack time) is recorded.
+        module_name : str
+            The name of the module, used to label traced handlers.
+        deferred_runner : labbot.deferred.DeferredRunner, optional
+            Runs listeners marked with @loader.deferred in its pool.
+            Without one, they run on bolt's listener thread after acking.
+
+        Returns
+        -------
+        A Registration that can be used to unregister everything again.
         """
-        for decoration in self.slack.accumulator:
-            name, func, args, kwargs = decoration
+        manifest = self.validate(type(slack_bolt_instance), type(fastapi_instance))
+        registration = Registration(slack_bolt_instance, fastapi_instance)
+        before = registration._snapshot()
+        async_app = is_async_app(slack_bolt_instance)
+        for name, func, args, kwargs in manifest.slack:
+            if deferred_runner is not None and hasattr(func, 'deferred'):
+                func = deferred_runner.wrap(func.deferred, module_name, handler_id(args, kwargs), tracer)
+            if tracer is not None and name not in UNTRACED_SLACK_DECORATORS:
+                func = tracer.wrap_slack(func, module_name, name, handler_id(args, kwargs))
+            if async_app and not inspect.iscoroutinefunction(func):
+                func = to_async_listener(func, sync_slack_client)
             getattr(slack_bolt_instance, name)(*args, **kwargs)(func)
 
-        for decoration in self.fastapi.accumulator:
-            name, func, args, kwargs = decoration
+        for name, func, args, kwargs in manifest.fastapi:
+            if tracer is not None:
+                func = tracer.wrap_fastapi(func, module_name, '{} {}'.format(name, handler_id(args, kwargs)))
             getattr(fastapi_instance, name)(*args, **kwargs)(func)
+
+        registration.record_difference(before)
+        return registration
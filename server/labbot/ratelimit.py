@@ -0,0 +1,83 @@
+"""
+Rate limiting helpers for calls to the Slack Web API.
+
+Slack groups its Web API methods into rate limit tiers, see
+https://api.slack.com/docs/rate-limits
+"""
+import threading
+import time
+
+# Approximate per-minute limits for each Slack rate limit tier
+TIER_PER_MINUTE = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. Tokens refill continuously at `rate` per
+    second, up to `capacity`; acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second.
+        capacity : int
+            The maximum number of tokens that can be saved up for a burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_tier(cls, tier, capacity=None):
+        """
+        Creates a bucket matching the given Slack rate limit tier.
+        """
+        per_minute = TIER_PER_MINUTE[tier]
+        if capacity is None:
+            capacity = max(1, per_minute // 10)
+        return cls(per_minute / 60.0, capacity)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available.
+
+        Returns
+        -------
+        Zero if a token was taken, otherwise the number of seconds
+        until one will be available.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+
+        Returns
+        -------
+        The number of seconds spent waiting.
+        """
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return time.monotonic() - start
+            time.sleep(wait)
@@ -0,0 +1,175 @@
+"""
+Loads LabBot modules and keeps track of what they registered.
+
+Importing a module and calling its register_module function only touch
+that module's own state, so these steps run concurrently on a thread pool.
+Hooking each module's decorators into the shared Slack app, FastAPI app,
+timer scheduler and home tab is done afterwards on the calling thread,
+in the order the modules are configured, so that registration order stays
+deterministic.
+
+A single module can also be hot-reloaded: everything it registered is
+removed, the module is re-imported, and it is registered again, while the
+rest of LabBot keeps serving.
+"""
+import concurrent.futures
+import importlib
+import threading
+import time
+import traceback
+
+
+class LoadedModule:
+    """
+    Book-keeping for a single loaded module, including startup timings.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.config = None
+        self.hooks = None
+        self.uninstall = None
+        self.error = None
+        self.import_sec = 0.0
+        self.register_sec = 0.0
+        self.hook_sec = 0.0
+
+    @property
+    def total_sec(self):
+        return self.import_sec + self.register_sec + self.hook_sec
+
+
+class ModuleRegistry:
+    """
+    Loads modules from the `modules` package and hooks them into LabBot.
+    """
+
+    def __init__(self, build_config, install_hooks, logger):
+        """
+        Parameters
+        ----------
+        build_config : function
+            Called as build_config(module_name), returning the config
+            dictionary to pass to the module's register_module function.
+        install_hooks : function
+            Called as install_hooks(module_name, module_loader) to register
+            the ModuleLoader returned by register_module with LabBot. Returns
+            a function that undoes the registration.
+        logger : function
+            Called as logger(message) to report load failures.
+        """
+        self.build_config = build_config
+        self.install_hooks = install_hooks
+        self.logger = logger
+        self.modules = {}
+        self.load_sec = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _import_and_register(self, loaded):
+        """
+        Imports a module and calls its register_module function. Safe to
+        run concurrently for different modules.
+        """
+        start = time.monotonic()
+        loaded.module = importlib.import_module('modules.{}'.format(loaded.name))
+        loaded.import_sec = time.monotonic() - start
+
+        start = time.monotonic()
+        loaded.config = self.build_config(loaded.name)
+        loaded.hooks = loaded.module.register_module(loaded.config)
+        loaded.register_sec = time.monotonic() - start
+
+    def _log_failure(self, loaded, e):
+        loaded.error = e
+        self.logger('Could not load module `{}`\nError:\n```{}```\nStacktrace:\n```{}```'.format(
+            loaded.name,
+            e,
+            '\n'.join(traceback.TracebackException.from_exception(e).format())))
+
+    def load_all(self, module_names, max_workers=4):
+        """
+        Loads and registers every named module.
+
+        Parameters
+        ----------
+        module_names : list of str
+            Module names, relative to the `modules` package, in the order
+            their hooks should be registered.
+        max_workers : int
+            The number of modules imported concurrently.
+        """
+        start = time.monotonic()
+        pending = [LoadedModule(name) for name in module_names]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix='module-loader') as executor:
+            futures = [executor.submit(self._import_and_register, loaded) for loaded in pending]
+
+            # Hook modules in configuration order, as soon as each is ready
+            for loaded, future in zip(pending, futures):
+                try:
+                    future.result()
+                    self._install(loaded)
+                except Exception as e:
+                    self._log_failure(loaded, e)
+                self.modules[loaded.name] = loaded
+        self.load_sec = time.monotonic() - start
+
+    def _install(self, loaded):
+        start = time.monotonic()
+        loaded.uninstall = self.install_hooks(loaded.name, loaded.hooks)
+        loaded.hook_sec = time.monotonic() - start
+
+    def reload(self, module_name):
+        """
+        Hot-reloads a single module: unregisters its Slack listeners, FastAPI
+        routes, timers and home tab functions, re-imports it, and registers
+        it again.
+
+        Parameters
+        ----------
+        module_name : str
+            The module name, relative to the `modules` package.
+
+        Returns
+        -------
+        The new LoadedModule. Raises if the module could not be reloaded,
+        in which case the module stays unregistered.
+        """
+        with self._reload_lock:
+            old = self.modules.get(module_name)
+            if old is not None and old.uninstall is not None:
+                old.uninstall()
+                old.uninstall = None
+
+            loaded = LoadedModule(module_name)
+            self.modules[module_name] = loaded
+            try:
+                start = time.monotonic()
+                if old is not None and old.module is not None:
+                    loaded.module = importlib.reload(old.module)
+                else:
+                    loaded.module = importlib.import_module('modules.{}'.format(module_name))
+                loaded.import_sec = time.monotonic() - start
+
+                start = time.monotonic()
+                loaded.config = self.build_config(module_name)
+                loaded.hooks = loaded.module.register_module(loaded.config)
+                loaded.register_sec = time.monotonic() - start
+                self._install(loaded)
+            except Exception as e:
+                self._log_failure(loaded, e)
+                raise
+            return loaded
+
+    def report(self):
+        """
+        Returns a human-readable summary of per-module startup timings.
+        """
+        lines = ['Loaded {} modules in {:.2f}s:'.format(
+            sum(loaded.error is None for loaded in self.modules.values()), self.load_sec)]
+        for loaded in sorted(self.modules.values(), key=lambda m: m.total_sec, reverse=True):
+            lines.append('{}: import {:.3f}s, register {:.3f}s, hook {:.3f}s{}'.format(
+                loaded.name, loaded.import_sec, loaded.register_sec, loaded.hook_sec,
+                ' (FAILED)' if loaded.error is not None else ''))
+        return '\n'.join(lines)
@@ -0,0 +1,470 @@
+"""
+Event-driven scheduler for functions registered with @loader.timer.
+
+Timers are kept in a priority queue ordered by their next deadline. The
+scheduler sleeps exactly until the earliest deadline (or until it is woken
+up by a newly added timer or a stop request), then dispatches every due
+timer concurrently in an executor so that one slow timer cannot delay the
+others.
+
+A timer either decides its next run itself, by returning a delay, or
+follows a wall-clock schedule (see labbot.schedules). Deadlines can be
+spread out with random jitter, and the first runs of delay-driven timers
+are staggered so that they do not all fire at once after a (re)start.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import heapq
+import inspect
+import itertools
+import math
+import random
+import threading
+import time
+import traceback
+
+# Spreads the first runs of delay-driven timers evenly over the startup
+# stagger window, whatever the number of timers (a low-discrepancy sequence)
+_GOLDEN_RATIO_FRACTION = (math.sqrt(5) - 1) / 2
+
+
+def timer_name(func):
+    """
+    Returns a human-readable, unique-ish name for a timer function.
+    """
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+
+class TimerPolicy:
+    """
+    Describes how the scheduler treats a single timer.
+
+    Every timer runs in its own small thread pool, so a timer that hangs
+    (e.g. on an HTTP call) can only starve its own future runs.
+    """
+
+    OVERLAP_MODES = ('skip', 'queue', 'coalesce')
+    CATCH_UP_MODES = ('coalesce', 'skip', 'all')
+
+    def __init__(self, max_instances=1, overlap='skip', catch_up=None, max_queued=10,
+                 schedule=None, jitter=0.0):
+        """
+        Parameters
+        ----------
+        max_instances : int
+            The maximum number of runs of this timer that may execute at once.
+        overlap : str
+            What to do when the timer becomes due while max_instances runs
+            are still going:
+            'skip' drops the tick, 'queue' runs it once a previous run
+            finishes (keeping at most max_queued pending ticks), and
+            'coalesce' keeps at most one pending run.
+        catch_up : str
+            What to do when the next deadline is already in the past, e.g.
+            after a long stall or a run that took longer than its interval:
+            'coalesce' (the default) runs once immediately, 'skip' waits for
+            the next deadline on the original grid, and 'all' runs every
+            missed tick. Only applies to timers without a schedule; scheduled
+            timers always skip to their next time after a stall.
+        max_queued : int
+            The maximum number of pending ticks kept when overlap='queue'.
+        schedule : labbot.schedules.Schedule, optional
+            If given, the timer runs at the times of this wall-clock schedule.
+            Its return value is ignored, and it keeps to its schedule even
+            if a run raises.
+        jitter : float
+            Each run is delayed by a random amount of up to this many
+            seconds, so timers sharing a schedule do not fire together.
+        """
+        if max_instances < 1:
+            raise ValueError('max_instances must be at least one!')
+        if overlap not in self.OVERLAP_MODES:
+            raise ValueError('overlap must be one of {}'.format(self.OVERLAP_MODES))
+        if catch_up is not None and schedule is not None:
+            raise ValueError('catch_up does not apply to timers with a schedule, which skip missed runs!')
+        if catch_up is None:
+            catch_up = 'coalesce'
+        if catch_up not in self.CATCH_UP_MODES:
+            raise ValueError('catch_up must be one of {}'.format(self.CATCH_UP_MODES))
+        if jitter < 0:
+            raise ValueError('jitter must not be negative!')
+        self.max_instances = max_instances
+        self.overlap = overlap
+        self.catch_up = catch_up
+        self.max_queued = max_queued
+        self.schedule = schedule
+        self.jitter = jitter
+
+
+class TimerStats:
+    """
+    Running statistics for a single timer.
+
+    Lateness is the time between a timer's deadline and the moment it was
+    actually dispatched to the executor.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.last_duration = 0.0
+
+    def record_dispatch(self, lateness):
+        self.runs += 1
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+
+    @property
+    def mean_lateness(self):
+        return self.total_lateness / self.runs if self.runs > 0 else 0.0
+
+
+class _TimerEntry:
+    """
+    Book-keeping for a single registered timer.
+    """
+
+    def __init__(self, func, policy):
+        self.func = func
+        self.policy = policy
+        self.name = timer_name(func)
+        self.stats = TimerStats()
+        # The last interval returned by the timer; None until the first run completes
+        self.interval = None
+        # Bumped whenever pending heap entries for this timer become invalid
+        self.generation = 0
+        self.running = 0
+        self.backlog = collections.deque()
+        self.stopped = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=policy.max_instances,
+                thread_name_prefix='timer-{}'.format(func.__name__))
+
+
+class TimerScheduler:
+    """
+    Runs timer functions at their requested deadlines.
+
+    Timer functions have the signature f(slack_client) and return either
+    None, if they should not be repeated, or a number of seconds to wait
+    before they should be run again.
+
+    Timers declared with `async def` are awaited directly on the event loop
+    and are passed the AsyncWebClient instead.
+    """
+
+    def __init__(self, on_error=None, metrics=None, startup_stagger=0.0):
+        """
+        Parameters
+        ----------
+        on_error : function, optional
+            Called as on_error(timer_name, exception) when a timer raises.
+            The failing timer is not rescheduled, unless it has a schedule.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, timer durations, lateness, failures and backlogs
+            are recorded there.
+        startup_stagger : float
+            The first runs of timers added without a delay or schedule are
+            spread over this many seconds.
+        """
+        self._on_error = on_error
+        self._startup_stagger = startup_stagger
+        self._staggered = 0
+        self._metrics = None
+        if metrics is not None:
+            self._metrics = {
+                'duration': metrics.histogram(
+                    'labbot_timer_duration_seconds', 'Duration of timer runs.', ('timer',)),
+                'lateness': metrics.histogram(
+                    'labbot_timer_lateness_seconds', 'Delay between a timer deadline and its dispatch.', ('timer',)),
+                'failures': metrics.counter(
+                    'labbot_timer_failures_total', 'Timer runs that raised an exception.', ('timer',)),
+            }
+            metrics.gauge('labbot_timer_backlog', 'Pending ticks of timers that are still running.', ('timer',),
+                          callback=lambda: {(entry.name,): len(entry.backlog) for entry in self._entry_list()})
+        # Guards _heap, _entries and _staggered, which add() and remove()
+        # may change from other threads (e.g. hot reload) while run() pops
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+        self._entries = []
+        self._running = set()
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._client = None
+        self._async_client = None
+
+    def add(self, func, policy=None, delay=0):
+        """
+        Adds a timer function, to be first run after `delay` seconds, or at
+        the first time of its policy's schedule.
+
+        This is safe to call from any thread, before or after the scheduler
+        has started.
+
+        Parameters
+        ----------
+        func : function
+            The timer function.
+        policy : TimerPolicy, optional
+            The concurrency policy for this timer. Defaults to TimerPolicy().
+        delay : float
+            Seconds to wait before the first run. Timers added with no
+            delay before the scheduler starts are staggered over the
+            startup stagger window.
+        """
+        entry = _TimerEntry(func, policy if policy is not None else TimerPolicy())
+        with self._lock:
+            self._entries.append(entry)
+            if entry.policy.schedule is None and delay == 0 and self._startup_stagger > 0 and self._loop is None:
+                delay = (self._staggered * _GOLDEN_RATIO_FRACTION) % 1 * self._startup_stagger
+                self._staggered += 1
+        if entry.policy.schedule is not None:
+            self._push(entry, self._next_scheduled(entry, time.monotonic()))
+        else:
+            self._push(entry, time.monotonic() + delay)
+        return entry
+
+    def remove(self, func):
+        """
+        Removes every timer entry for `func`. Runs already in progress are
+        allowed to finish, but are not rescheduled. Thread-safe.
+        """
+        with self._lock:
+            removed = [entry for entry in self._entries if entry.func is func]
+            for entry in removed:
+                entry.stopped = True
+                entry.generation += 1
+                self._entries.remove(entry)
+            loop = self._loop
+        for entry in removed:
+            if loop is not None:
+                # The loop may be about to start a run on this executor; it
+                # checks entry.stopped first, so shut down from the loop too
+                loop.call_soon_threadsafe(functools.partial(self._stop_entry, entry))
+            else:
+                self._stop_entry(entry)
+
+    @staticmethod
+    def _stop_entry(entry):
+        entry.backlog.clear()
+        entry.executor.shutdown(wait=False)
+
+    def _entry_list(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        """
+        Returns a dictionary mapping timer names to their TimerStats.
+        """
+        return {entry.name: entry.stats for entry in self._entry_list()}
+
+    def report(self):
+        """
+        Returns a short, human-readable summary of timer lateness.
+        """
+        lines = []
+        for name, stats in self.stats().items():
+            lines.append('{}: {} runs, lateness mean {:.3f}s / max {:.3f}s, {} skipped, {} missed'.format(
+                name, stats.runs, stats.mean_lateness, stats.max_lateness,
+                stats.skipped, stats.missed))
+        return '\n'.join(lines)
+
+    def drain(self, timeout=None):
+        """
+        Stops dispatching timers and waits for the runs in progress to
+        finish. Thread-safe; the scheduler's event loop must keep running
+        for synchronous runs to complete.
+
+        Returns
+        -------
+        True if every run finished, False on timeout.
+        """
+        self._stopping = True
+        self._wake()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(entry.running > 0 for entry in self._entry_list()):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self):
+        """
+        Asks the scheduler to stop dispatching timers. Thread-safe.
+        """
+        self._stopping = True
+        self._wake()
+        for entry in self._entry_list():
+            entry.executor.shutdown(wait=False)
+
+    @staticmethod
+    def _next_scheduled(entry, after):
+        """
+        Returns the monotonic time of the first scheduled run after the
+        monotonic time `after`.
+        """
+        wall_offset = time.time() - time.monotonic()
+        return entry.policy.schedule.next_after(after + wall_offset) - wall_offset
+
+    def _push(self, entry, deadline):
+        # Heap entries are due at the jittered time; the deadline itself
+        # stays on the timer's grid
+        due = deadline + random.uniform(0, entry.policy.jitter) if entry.policy.jitter > 0 else deadline
+        with self._lock:
+            heapq.heappush(self._heap, (due, next(self._counter), entry.generation, entry, deadline))
+        self._wake()
+
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self, slack_client, async_slack_client=None):
+        """
+        Runs the scheduler until stop() is called.
+
+        Parameters
+        ----------
+        slack_client
+            The Slack WebClient handed to each synchronous timer function.
+        async_slack_client
+            The AsyncWebClient handed to each async timer function, if
+            running in async mode.
+        """
+        self._client = slack_client
+        self._async_client = async_slack_client
+        self._wakeup = asyncio.Event()
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+
+        while not self._stopping:
+            now = time.monotonic()
+            # Pop everything that is due before dispatching, as dispatching
+            # can push new (possibly also overdue) deadlines.
+            due = []
+            with self._lock:
+                while len(self._heap) > 0 and self._heap[0][0] <= now:
+                    due_time, _, generation, entry, deadline = heapq.heappop(self._heap)
+                    if generation == entry.generation and not entry.stopped:
+                        due.append((entry, deadline, due_time))
+                timeout = self._heap[0][0] - now if len(self._heap) > 0 else None
+            if len(due) > 0:
+                for entry, deadline, due_time in due:
+                    self._on_tick(entry, deadline, due_time, now)
+                await asyncio.sleep(0)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _schedule_next(self, entry, deadline, now, dispatching=False):
+        """
+        Pushes the next deadline for an entry, applying its catch-up rule
+        if that deadline has already passed.
+
+        If `dispatching` is True, a (late) tick of the entry is being
+        dispatched right now; with catch_up='coalesce', that run stands in
+        for every missed tick, and the next one is a full interval later.
+        """
+        if deadline <= now and entry.interval is not None and entry.interval > 0:
+            missed = (now - deadline) / entry.interval
+            if entry.policy.catch_up == 'skip':
+                deadline += math.ceil(missed) * entry.interval
+                entry.stats.missed += math.ceil(missed)
+            elif entry.policy.catch_up == 'coalesce':
+                if dispatching:
+                    entry.stats.missed += math.floor(missed) + 1
+                    deadline = now + entry.interval
+                else:
+                    entry.stats.missed += math.floor(missed)
+                    deadline = now
+        self._push(entry, deadline)
+
+    def _on_tick(self, entry, deadline, due_time, now):
+        if entry.policy.schedule is not None:
+            # Runs missed during a stall are skipped, as the schedule picks
+            # the next time after now
+            self._push(entry, self._next_scheduled(entry, max(deadline, now)))
+        elif entry.interval is not None:
+            self._schedule_next(entry, deadline + entry.interval, now, dispatching=True)
+
+        policy = entry.policy
+        if entry.running < policy.max_instances:
+            self._start(entry, deadline, now, due_time)
+        elif policy.overlap == 'queue' and len(entry.backlog) < policy.max_queued:
+            entry.backlog.append(deadline)
+        elif policy.overlap == 'coalesce' and len(entry.backlog) == 0:
+            entry.backlog.append(deadline)
+        else:
+            entry.stats.skipped += 1
+
+    def _start(self, entry, deadline, now, due_time=None):
+        # Lateness is measured from the (jittered) time the run was due
+        lateness = now - (due_time if due_time is not None else deadline)
+        entry.running += 1
+        entry.stats.record_dispatch(lateness)
+        if self._metrics is not None:
+            self._metrics['lateness'].observe(lateness, timer=entry.name)
+        task = self._loop.create_task(self._run_entry(entry, deadline))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_entry(self, entry, deadline):
+        start = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(entry.func):
+                if self._async_client is None:
+                    raise RuntimeError('Async timers are only supported in async mode!')
+                delay = await entry.func(self._async_client)
+            elif entry.stopped:
+                # Removed since it was dispatched; its executor is shut down
+                return
+            else:
+                delay = await self._loop.run_in_executor(entry.executor, entry.func, self._client)
+        except Exception as e:
+            entry.stats.failures += 1
+            if self._metrics is not None:
+                self._metrics['failures'].inc(timer=entry.name)
+            if self._on_error is not None:
+                self._on_error(entry.name, e)
+            else:
+                traceback.print_exc()
+            delay = None
+        finally:
+            entry.running -= 1
+            entry.stats.last_duration = time.monotonic() - start
+            if self._metrics is not None:
+                self._metrics['duration'].observe(entry.stats.last_duration, timer=entry.name)
+
+        now = time.monotonic()
+        if entry.stopped:
+            return
+        if entry.policy.schedule is not None:
+            # Scheduled timers were already rescheduled when they became due
+            pass
+        elif delay is None:
+            # Drop any pending ticks; this timer is finished.
+            entry.stopped = True
+            entry.generation += 1
+            entry.backlog.clear()
+            return
+        elif delay != entry.interval:
+            entry.interval = delay
+            entry.generation += 1
+            self._schedule_next(entry, deadline + delay, now)
+
+        if len(entry.backlog) > 0 and not self._stopping:
+            self._start(entry, entry.backlog.popleft(), now)
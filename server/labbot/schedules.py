@@ -0,0 +1,181 @@
+"""
+Wall-clock schedules for timers.
+
+By default a timer is run again a number of seconds after its last run, so
+its runs drift and depend on when LabBot was started. A schedule instead
+ties the runs to the wall clock:
+
+- CronSchedule runs at the times matching a cron expression, e.g.
+  '0 9 * * 1-5' (9am on weekdays).
+- IntervalSchedule runs every N seconds, aligned to multiples of N since
+  the epoch (plus an offset), e.g. every=300 runs on every fifth minute.
+
+Schedules are given to @loader.timer as cron='...' or every=N.
+"""
+import datetime
+import math
+
+
+class Schedule:
+    """
+    Base class of timer schedules.
+    """
+
+    def next_after(self, timestamp):
+        """
+        Returns the first run time strictly after `timestamp`, both as
+        seconds since the epoch.
+        """
+        raise NotImplementedError
+
+
+class IntervalSchedule(Schedule):
+    """
+    Runs every `every` seconds, on multiples of `every` since the epoch
+    shifted by `offset` seconds.
+    """
+
+    def __init__(self, every, offset=0.0):
+        """
+        Parameters
+        ----------
+        every : float
+            Seconds between runs.
+        offset : float
+            Shift of the grid, e.g. every=3600, offset=300 runs at five
+            past every hour (UTC).
+        """
+        if every <= 0:
+            raise ValueError('every must be positive!')
+        self.every = every
+        self.offset = offset
+
+    def next_after(self, timestamp):
+        return (math.floor((timestamp - self.offset) / self.every) + 1) * self.every + self.offset
+
+    def __repr__(self):
+        return 'IntervalSchedule({!r}, offset={!r})'.format(self.every, self.offset)
+
+
+class CronSchedule(Schedule):
+    """
+    Runs at the times matching a five-field cron expression:
+    minute, hour, day of month, month and day of week.
+
+    Each field is '*', a number, a range 'a-b', a step '*/n' or 'a-b/n',
+    or a comma-separated list of these. Days of week run from 0 (Sunday)
+    to 6; 7 is also accepted for Sunday. Months and days of week may be
+    given as three-letter English names. As in cron, if both the day of
+    month and the day of week are restricted, a day matching either runs.
+    """
+
+    FIELDS = (
+        ('minute', 0, 59),
+        ('hour', 0, 23),
+        ('day of month', 1, 31),
+        ('month', 1, 12),
+        ('day of week', 0, 7),
+    )
+    NAMES = {
+        'month': {name: i + 1 for i, name in enumerate(
+            ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])},
+        'day of week': {name: i for i, name in enumerate(
+            ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])},
+    }
+
+    def __init__(self, expression, tz=None):
+        """
+        Parameters
+        ----------
+        expression : str
+            The cron expression, e.g. '*/15 8-18 * * mon-fri'.
+        tz : datetime.tzinfo, optional
+            The time zone the expression is evaluated in. Defaults to the
+            system's local time.
+        """
+        self.expression = expression
+        self.tz = tz
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError('Cron expression {!r} should have {} fields'.format(expression, len(self.FIELDS)))
+        parsed = [self._parse_field(field, *spec) for field, spec in zip(fields, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @classmethod
+    def _parse_value(cls, value, name):
+        value = value.lower()
+        if value in cls.NAMES.get(name, {}):
+            return cls.NAMES[name][value]
+        return int(value)
+
+    @classmethod
+    def _parse_field(cls, field, name, low, high):
+        values = set()
+        for part in field.split(','):
+            try:
+                if '/' in part:
+                    part, step = part.split('/')
+                    step = int(step)
+                else:
+                    step = 1
+                if part == '*':
+                    start, end = low, high
+                elif '-' in part:
+                    start, end = (cls._parse_value(value, name) for value in part.split('-'))
+                else:
+                    start = cls._parse_value(part, name)
+                    # 'a/n' means from a to the end of the range
+                    end = high if step > 1 else start
+            except ValueError:
+                raise ValueError('Invalid {} field {!r}'.format(name, field)) from None
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError('Invalid {} field {!r}'.format(name, field))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, date):
+        day_ok = date.day in self.days
+        # isoweekday is 1 (Monday) to 7 (Sunday)
+        weekday_ok = date.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, timestamp):
+        # Start at the next whole minute
+        start = datetime.datetime.fromtimestamp(timestamp, self.tz).replace(tzinfo=None)
+        candidate = start.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Every valid expression matches within a few years (Feb 29 at worst)
+        limit = candidate + datetime.timedelta(days=366 * 8)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = datetime.datetime(year, month, 1)
+            elif not self._day_matches(candidate):
+                candidate = datetime.datetime.combine(candidate.date() + datetime.timedelta(days=1), datetime.time())
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + datetime.timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                result = self._timestamp(candidate)
+                # Local times repeated when clocks go back only run once
+                if result > timestamp:
+                    return result
+                candidate += datetime.timedelta(minutes=1)
+        raise ValueError('Cron expression {!r} never matches'.format(self.expression))
+
+    def _timestamp(self, local):
+        if self.tz is None:
+            return local.timestamp()
+        if hasattr(self.tz, 'localize'):
+            # pytz time zones must not be passed as tzinfo directly
+            return self.tz.localize(local).timestamp()
+        return local.replace(tzinfo=self.tz).timestamp()
+
+    def __repr__(self):
+        return 'CronSchedule({!r})'.format(self.expression)
@@ -0,0 +1,464 @@
+"""
+A Slack WebClient shared by every module, which coordinates calls to the
+Slack Web API so that bursts (e.g. a sensor alarm storm during a lab job
+reminder sweep) are queued rather than rejected.
+
+Every call goes through a token bucket for its Slack method, sized from
+the method's rate limit tier (chat.postMessage is instead limited per
+channel). Calls waiting on the same bucket are served in priority order.
+If Slack still answers with HTTP 429, the bucket is paused for the
+Retry-After period and the call is retried.
+
+See https://api.slack.com/docs/rate-limits
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+
+import slack_sdk
+from slack_sdk.errors import SlackApiError
+
+from labbot import fastjson
+from labbot.ratelimit import TokenBucket
+
+try:
+    from slack_sdk.web.async_client import AsyncWebClient
+except ImportError:
+    # The async client needs aiohttp, which is only required in async mode
+    AsyncWebClient = None
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Rate limit tiers of the methods LabBot uses. Other methods default to tier 3.
+METHOD_TIERS = {
+    'chat.update': 3,
+    'chat.delete': 3,
+    'chat.postEphemeral': 4,
+    'views.open': 4,
+    'views.push': 4,
+    'views.update': 4,
+    'views.publish': 4,
+    'files.upload': 2,
+    'files.getUploadURLExternal': 4,
+    'files.completeUploadExternal': 4,
+    'users.info': 4,
+    'users.list': 2,
+    'conversations.list': 2,
+    'conversations.history': 3,
+}
+DEFAULT_TIER = 3
+
+# chat.postMessage allows about one message per second to each channel
+POST_MESSAGE_PER_SEC = 1.0
+
+# Priorities used when the caller does not choose one. trigger_ids expire
+# after three seconds, so opening modals goes first; home tab publishes
+# are background work.
+DEFAULT_PRIORITIES = {
+    'views.open': PRIORITY_HIGH,
+    'views.push': PRIORITY_HIGH,
+    'views.publish': PRIORITY_LOW,
+}
+
+_priority = contextvars.ContextVar('slack_priority', default=None)
+
+# Arguments holding Block Kit structures. Slack accepts them as JSON-encoded
+# strings, so they are encoded with labbot.fastjson before slack_sdk encodes
+# the rest of the (then small) request body with the json module.
+BLOCK_KIT_ARGUMENTS = ('blocks', 'attachments', 'view')
+
+
+@contextlib.contextmanager
+def prioritized(priority):
+    """
+    Context manager setting the priority of Slack calls made inside it
+    (by this thread or asyncio task), e.g.::
+
+        with prioritized(PRIORITY_LOW):
+            client.chat_postMessage(...)
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def preserialize(kwargs):
+    """
+    Returns api_call keyword arguments with the Block Kit arguments of a
+    JSON request body encoded as JSON strings.
+    """
+    body = kwargs.get('json')
+    if not body or not any(isinstance(body.get(name), (dict, list)) for name in BLOCK_KIT_ARGUMENTS):
+        return kwargs
+    body = dict(body)
+    for name in BLOCK_KIT_ARGUMENTS:
+        if isinstance(body.get(name), (dict, list)):
+            body[name] = fastjson.dumps(body[name])
+    return dict(kwargs, json=body)
+
+
+def retry_after(error):
+    """
+    Returns the Retry-After delay in seconds of a rate limited SlackApiError,
+    or None if the error is not a rate limit error.
+    """
+    response = error.response
+    if response is None or response.status_code != 429:
+        return None
+    headers = response.headers or {}
+    value = headers.get('Retry-After', headers.get('retry-after', 1))
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class _Gate:
+    """
+    A token bucket with a priority queue of waiting calls.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.blocked_until = 0.0
+        self.calls = 0
+        self.rate_limited = 0
+        self.wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._waiters)
+
+    def _enqueue(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiters, ticket)
+            return ticket
+
+    def _poll(self, ticket):
+        """
+        Takes a token if `ticket` is first in line. Must hold the lock.
+
+        Returns
+        -------
+        Zero if the call may go ahead, the number of seconds until it may
+        if it is first in line, or None if other calls are ahead of it.
+        """
+        if self._waiters[0] != ticket:
+            return None
+        now = time.monotonic()
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        wait = self.bucket.try_acquire()
+        if wait == 0.0:
+            heapq.heappop(self._waiters)
+            self._cond.notify_all()
+        return wait
+
+    def _cancel(self, ticket):
+        with self._cond:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def _record_wait(self, wait_sec):
+        with self._cond:
+            self.calls += 1
+            self.wait_sec += wait_sec
+            self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+
+    def acquire(self, priority):
+        """
+        Blocks until the call may be made, returning the seconds waited.
+        """
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            with self._cond:
+                while True:
+                    wait = self._poll(ticket)
+                    if wait == 0.0:
+                        break
+                    self._cond.wait(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self, priority):
+        """
+        Waits without blocking the event loop until the call may be made,
+        returning the seconds waited.
+        """
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._poll(ticket)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(wait if wait is not None else 0.05)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+
+    def block_for(self, seconds):
+        """
+        Holds back every call on this gate for `seconds` (after a 429).
+        """
+        with self._cond:
+            self.rate_limited += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class SlackRateLimiter:
+    """
+    Coordinates Slack Web API calls from every client sharing it.
+    """
+
+    def __init__(self, max_retries=3, logger=None, metrics=None):
+        """
+        Parameters
+        ----------
+        max_retries : int
+            How many times a call answered with HTTP 429 is retried before
+            the error is raised to the caller.
+        logger : function, optional
+            Called as logger(message) when a call is given up on.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, call counts, latencies and rate limit waits per Slack
+            method are recorded there.
+        """
+        self.max_retries = max_retries
+        self.logger = logger
+        self.retries = 0
+        self.failures = 0
+        self._gates = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._metrics = None
+        if metrics is not None:
+            self._metrics = {
+                'calls': metrics.counter(
+                    'labbot_slack_api_calls_total', 'Slack Web API calls by outcome.', ('method', 'outcome')),
+                'latency': metrics.histogram(
+                    'labbot_slack_api_seconds', 'Duration of Slack Web API calls.', ('method',)),
+                'wait': metrics.histogram(
+                    'labbot_slack_api_wait_seconds', 'Time Slack Web API calls spent rate limited.', ('method',)),
+            }
+            metrics.gauge('labbot_slack_api_queued', 'Slack Web API calls waiting on the rate limiter.',
+                          callback=self.queue_depth)
+
+    def _observe(self, api_method, outcome, wait_sec, call_sec):
+        if self._metrics is not None:
+            self._metrics['calls'].inc(method=api_method, outcome=outcome)
+            self._metrics['latency'].observe(call_sec, method=api_method)
+            self._metrics['wait'].observe(wait_sec, method=api_method)
+
+    def gate(self, api_method, request_args):
+        """
+        Returns the gate limiting a call to `api_method`.
+        """
+        if api_method == 'chat.postMessage':
+            channel = None
+            for source in ('json', 'data', 'params'):
+                channel = (request_args.get(source) or {}).get('channel', channel)
+            key = '{}:{}'.format(api_method, channel)
+        else:
+            key = api_method
+        with self._lock:
+            if key not in self._gates:
+                if api_method == 'chat.postMessage':
+                    bucket = TokenBucket(POST_MESSAGE_PER_SEC)
+                else:
+                    bucket = TokenBucket.for_tier(METHOD_TIERS.get(api_method, DEFAULT_TIER))
+                self._gates[key] = _Gate(bucket)
+            return self._gates[key]
+
+    @staticmethod
+    def priority(api_method):
+        """
+        Returns the priority of a call to `api_method` made in this context.
+        """
+        priority = _priority.get()
+        if priority is not None:
+            return priority
+        return DEFAULT_PRIORITIES.get(api_method, PRIORITY_NORMAL)
+
+    def last_wait_sec(self):
+        """
+        Returns the seconds the last call made by this thread spent waiting
+        for the rate limiter (including Retry-After pauses).
+        """
+        return getattr(self._local, 'wait_sec', 0.0)
+
+    def _give_up(self, api_method, e):
+        with self._lock:
+            self.failures += 1
+        if self.logger is not None:
+            self.logger('Slack call `{}` still rate limited after {} retries: {}'.format(
+                api_method, self.max_retries, e))
+
+    def call(self, api_method, request_args, send):
+        """
+        Makes a rate limited call, retrying it on HTTP 429.
+
+        Parameters
+        ----------
+        api_method : str
+            The Slack method name, e.g. 'chat.postMessage'.
+        request_args : dict
+            The keyword arguments of WebClient.api_call.
+        send : function
+            Makes the actual call.
+        """
+        gate = self.gate(api_method, request_args)
+        priority = self.priority(api_method)
+        waited = 0.0
+        for attempt in itertools.count():
+            wait_sec = gate.acquire(priority)
+            waited += wait_sec
+            self._local.wait_sec = waited
+            start = time.monotonic()
+            try:
+                response = send()
+                self._observe(api_method, 'ok', wait_sec, time.monotonic() - start)
+                return response
+            except SlackApiError as e:
+                delay = retry_after(e)
+                self._observe(api_method, 'error' if delay is None else 'ratelimited',
+                              wait_sec, time.monotonic() - start)
+                if delay is None:
+                    raise
+                gate.block_for(delay)
+                if attempt >= self.max_retries:
+                    self._give_up(api_method, e)
+                    raise
+                with self._lock:
+                    self.retries += 1
+            except Exception:
+                self._observe(api_method, 'exception', wait_sec, time.monotonic() - start)
+                raise
+
+    async def call_async(self, api_method, request_args, send):
+        """
+        As call(), but for coroutine functions `send`.
+        """
+        gate = self.gate(api_method, request_args)
+        priority = self.priority(api_method)
+        for attempt in itertools.count():
+            wait_sec = await gate.acquire_async(priority)
+            start = time.monotonic()
+            try:
+                response = await send()
+                self._observe(api_method, 'ok', wait_sec, time.monotonic() - start)
+                return response
+            except SlackApiError as e:
+                delay = retry_after(e)
+                self._observe(api_method, 'error' if delay is None else 'ratelimited',
+                              wait_sec, time.monotonic() - start)
+                if delay is None:
+                    raise
+                gate.block_for(delay)
+                if attempt >= self.max_retries:
+                    self._give_up(api_method, e)
+                    raise
+                with self._lock:
+                    self.retries += 1
+            except Exception:
+                self._observe(api_method, 'exception', wait_sec, time.monotonic() - start)
+                raise
+
+    def queue_depth(self):
+        """
+        Returns the number of calls currently waiting on the rate limiter.
+        """
+        with self._lock:
+            gates = list(self._gates.values())
+        return sum(gate.queue_depth() for gate in gates)
+
+    def stats(self):
+        """
+        Returns a dictionary mapping each gate (Slack method, or
+        chat.postMessage:channel) to a dictionary of its metrics.
+        """
+        with self._lock:
+            gates = dict(self._gates)
+        return {key: {
+                    'calls': gate.calls,
+                    'queued': gate.queue_depth(),
+                    'rate_limited': gate.rate_limited,
+                    'wait_sec': gate.wait_sec,
+                    'max_wait_sec': gate.max_wait_sec,
+                } for key, gate in gates.items()}
+
+    def report(self):
+        """
+        Returns a short, human-readable summary of Slack API rate limiting.
+        """
+        stats = self.stats()
+        calls = sum(s['calls'] for s in stats.values())
+        wait_sec = sum(s['wait_sec'] for s in stats.values())
+        lines = ['Slack API: {} calls, {} queued, wait mean {:.3f}s, {} rate limited, {} retries, {} failed'.format(
+            calls, self.queue_depth(), wait_sec / calls if calls > 0 else 0.0,
+            sum(s['rate_limited'] for s in stats.values()), self.retries, self.failures)]
+        busiest = sorted(stats.items(), key=lambda item: item[1]['wait_sec'], reverse=True)[:5]
+        for key, s in busiest:
+            if s['wait_sec'] > 0 or s['rate_limited'] > 0:
+                lines.append('{}: {} calls, wait max {:.3f}s, {} rate limited'.format(
+                    key, s['calls'], s['max_wait_sec'], s['rate_limited']))
+        return '\n'.join(lines)
+
+
+class RateLimitedWebClient(slack_sdk.WebClient):
+    """
+    A slack_sdk.WebClient whose calls go through a SlackRateLimiter, and
+    whose Block Kit arguments are encoded with labbot.fastjson.
+    """
+
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else SlackRateLimiter()
+
+    def api_call(self, api_method, **kwargs):
+        kwargs = preserialize(kwargs)
+        return self.rate_limiter.call(
+                api_method, kwargs,
+                lambda: super(RateLimitedWebClient, self).api_call(api_method, **kwargs))
+
+
+if AsyncWebClient is not None:
+    class AsyncRateLimitedWebClient(AsyncWebClient):
+        """
+        A slack_sdk AsyncWebClient whose calls go through a SlackRateLimiter,
+        and whose Block Kit arguments are encoded with labbot.fastjson.
+        """
+
+        def __init__(self, *args, rate_limiter=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.rate_limiter = rate_limiter if rate_limiter is not None else SlackRateLimiter()
+
+        async def api_call(self, api_method, **kwargs):
+            kwargs = preserialize(kwargs)
+            return await self.rate_limiter.call_async(
+                    api_method, kwargs,
+                    lambda: super(AsyncRateLimitedWebClient, self).api_call(api_method, **kwargs))
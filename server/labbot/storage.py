@@ -0,0 +1,291 @@
+"""
+Pooled SQLite connections shared by the core and every module.
+
+Opening a SQLite connection for every handler call throws away the
+connection's page cache and prepared statements, and connections opened
+with default settings use the rollback journal, so readers and writers
+block each other. Storage instead keeps one connection per database file
+per thread, opened in WAL mode with a busy timeout and a statement cache,
+and records how long each query takes.
+
+Modules get the Storage instance as config['storage'] and use it in place
+of sqlite3.connect::
+
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
+    ...
+    db_con.close()
+
+close() hands the connection back to the pool, rolling back anything that
+was not committed, exactly as closing a fresh connection would.
+
+As connections are per thread, checking out a database again while the
+same thread still holds it (e.g. from a helper function) returns a handle
+to the same connection, which shares the caller's transaction. Checkouts
+are counted, and only closing the outermost one rolls back uncommitted
+changes. Each handle has its own row factory.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Pragmas applied to every new connection. WAL lets readers proceed while a
+# write is in progress; synchronous=NORMAL is safe with WAL and avoids an
+# fsync per transaction.
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+class QueryStats:
+    """
+    Timing statistics of a single SQL statement.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+
+    @property
+    def mean_sec(self):
+        return self.total_sec / self.calls if self.calls > 0 else 0.0
+
+
+class TimedCursor:
+    """
+    A sqlite3.Cursor whose execute calls are timed.
+    """
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def execute(self, sql, parameters=()):
+        with self._connection._timed(sql):
+            self._cursor.execute(sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        with self._connection._timed(sql):
+            self._cursor.executemany(sql, seq_of_parameters)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Timer:
+    def __init__(self, storage, path, sql):
+        self.storage = storage
+        self.path = path
+        self.sql = sql
+
+    def __enter__(self):
+        self.start = time.monotonic()
+
+    def __exit__(self, *exc_info):
+        self.storage._record(self.path, self.sql, time.monotonic() - self.start)
+
+
+class PooledConnection:
+    """
+    A pooled sqlite3.Connection. Supports the sqlite3.Connection interface;
+    execute calls are timed and close() returns the connection to the pool.
+    """
+
+    def __init__(self, storage, path, connection, checkouts, row_factory=None):
+        self._storage = storage
+        self._path = path
+        self._connection = connection
+        # This thread's checkout counts, shared by every handle it holds
+        self._checkouts = checkouts
+        self._row_factory = row_factory
+        self._closed = False
+
+    def _timed(self, sql):
+        return _Timer(self._storage, self._path, sql)
+
+    def _cursor(self):
+        cursor = self._connection.cursor()
+        cursor.row_factory = self._row_factory
+        return cursor
+
+    @property
+    def row_factory(self):
+        return self._row_factory
+
+    @row_factory.setter
+    def row_factory(self, value):
+        self._row_factory = value
+
+    def execute(self, sql, parameters=()):
+        with self._timed(sql):
+            return self._cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with self._timed(sql):
+            return self._cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with self._timed(sql_script):
+            return self._connection.executescript(sql_script)
+
+    def cursor(self):
+        return TimedCursor(self._cursor(), self)
+
+    def _release(self):
+        """
+        Ends this checkout, returning True if it was the thread's outermost.
+        """
+        if self._closed:
+            return False
+        self._closed = True
+        self._checkouts[self._path] -= 1
+        return self._checkouts[self._path] == 0
+
+    def close(self):
+        """
+        Returns the connection to the pool. Closing the outermost checkout
+        discards any uncommitted changes; closing a nested one leaves them
+        to its caller.
+        """
+        if self._release() and self._connection.in_transaction:
+            self._connection.rollback()
+
+    def __del__(self):
+        # A handle dropped without close() (e.g. by a caller that raised)
+        # still ends its checkout; the next outermost checkout rolls back
+        self._release()
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._connection.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class Storage:
+    """
+    Hands out pooled, per-thread SQLite connections.
+    """
+
+    def __init__(self, cached_statements=256, busy_timeout_ms=30000, slow_query_sec=1.0,
+                 logger=None, metrics=None):
+        """
+        Parameters
+        ----------
+        cached_statements : int
+            The number of prepared statements each connection keeps.
+        busy_timeout_ms : int
+            How long a query waits for a lock held by another connection
+            before failing with 'database is locked'.
+        slow_query_sec : float
+            Queries slower than this are logged.
+        logger : function, optional
+            Called as logger(message) for slow queries.
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, query durations per database are recorded there.
+        """
+        self.cached_statements = cached_statements
+        self.busy_timeout_ms = busy_timeout_ms
+        self.slow_query_sec = slow_query_sec
+        self.logger = logger
+        self._local = threading.local()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._query_seconds = None
+        if metrics is not None:
+            self._query_seconds = metrics.histogram(
+                    'labbot_sqlite_query_seconds', 'Duration of SQLite queries.', ('database',))
+
+    def _open(self, path):
+        connection = sqlite3.connect(
+                path,
+                timeout=self.busy_timeout_ms / 1000,
+                cached_statements=self.cached_statements)
+        connection.execute('PRAGMA busy_timeout={:d}'.format(self.busy_timeout_ms))
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def _pool(self):
+        # Connections must not be shared with forked worker processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.connections = {}
+            self._local.checkouts = {}
+        return self._local.connections
+
+    def connect(self, path, row_factory=None):
+        """
+        Returns a handle to this thread's connection to the database at
+        `path`, opening it if needed. If the thread already holds the
+        connection, the new handle shares its transaction.
+
+        Parameters
+        ----------
+        path : str
+            The SQLite database file.
+        row_factory : optional
+            The row factory to use, e.g. sqlite3.Row.
+        """
+        pool = self._pool()
+        checkouts = self._local.checkouts
+        connection = pool.get(path)
+        if connection is None:
+            connection = self._open(path)
+            pool[path] = connection
+        elif checkouts.get(path, 0) == 0 and connection.in_transaction:
+            # Left over by a caller that raised before closing
+            connection.rollback()
+        checkouts[path] = checkouts.get(path, 0) + 1
+        return PooledConnection(self, path, connection, checkouts, row_factory)
+
+    @staticmethod
+    def _normalize(sql):
+        return re.sub(r'\s+', ' ', sql).strip()
+
+    def _record(self, path, sql, duration):
+        key = (path, self._normalize(sql))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats()
+            stats.calls += 1
+            stats.total_sec += duration
+            stats.max_sec = max(stats.max_sec, duration)
+        if self._query_seconds is not None:
+            self._query_seconds.observe(duration, database=path)
+        if duration > self.slow_query_sec and self.logger is not None:
+            self.logger('Slow query on {} ({:.3f}s): `{}`'.format(path, duration, key[1][:200]))
+
+    def stats(self):
+        """
+        Returns a dictionary mapping (database, normalized SQL) to QueryStats.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def report(self, top=5):
+        """
+        Returns a short, human-readable summary of the queries that took the
+        most time in total.
+        """
+        stats = self.stats()
+        lines = ['SQLite: {} queries, {:.3f}s total'.format(
+            sum(s.calls for s in stats.values()), sum(s.total_sec for s in stats.values()))]
+        for (path, sql), s in sorted(stats.items(), key=lambda item: item[1].total_sec, reverse=True)[:top]:
+            lines.append('{} `{}`: {} calls, mean {:.4f}s, max {:.4f}s'.format(
+                path, sql[:80], s.calls, s.mean_sec, s.max_sec))
+        return '\n'.join(lines)
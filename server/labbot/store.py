@@ -0,0 +1,307 @@
+"""
+Process-shared state for LabBot, backed by SQLite.
+
+When LabBot serves requests from several worker processes, module state
+that used to live in Python globals (queues, sets of users, flags) has to
+be visible to every worker. The Store keeps this state in a single SQLite
+database, with values serialized as JSON, using pooled connections from
+labbot.storage.
+
+Besides key-value pairs, sets and queues, the Store keeps append-only
+tables of records with an optional index value, expiring claims that only
+one process can take, and can atomically import state from the JSON and
+CSV files that modules used to rewrite by hand.
+"""
+import contextlib
+import json
+import time
+
+from labbot.storage import Storage
+
+
+class Store:
+    """
+    A small key-value, set, queue and table store shared between processes.
+    """
+
+    def __init__(self, path='labbot_state.db', storage=None):
+        """
+        Parameters
+        ----------
+        path : str
+            The SQLite database file to store state in.
+        storage : labbot.storage.Storage, optional
+            The connection pool to use. Defaults to a private one.
+        """
+        self.path = path
+        self.storage = storage if storage is not None else Storage()
+        db_con = self._connect()
+        with db_con:
+            db_con.execute('''
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace text NOT NULL,
+                key text NOT NULL,
+                value text NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            ''')
+            db_con.execute('''
+            CREATE TABLE IF NOT EXISTS sets (
+                name text NOT NULL,
+                member text NOT NULL,
+                PRIMARY KEY (name, member)
+            );
+            ''')
+            db_con.execute('''
+            CREATE TABLE IF NOT EXISTS queues (
+                id integer PRIMARY KEY AUTOINCREMENT,
+                name text NOT NULL,
+                item text NOT NULL
+            );
+            ''')
+            db_con.execute('''CREATE INDEX IF NOT EXISTS queues_name_index ON queues (name, id)''')
+            db_con.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                id integer PRIMARY KEY AUTOINCREMENT,
+                name text NOT NULL,
+                idx text,
+                record text NOT NULL
+            );
+            ''')
+            db_con.execute('''CREATE INDEX IF NOT EXISTS records_index ON records (name, idx, id)''')
+            db_con.execute('''
+            CREATE TABLE IF NOT EXISTS claims (
+                namespace text NOT NULL,
+                key text NOT NULL,
+                expires real NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            ''')
+            db_con.execute('''CREATE INDEX IF NOT EXISTS claims_expiry_index ON claims (namespace, expires)''')
+        db_con.close()
+
+    def _connect(self):
+        return self.storage.connect(self.path)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Runs the body in a write transaction, taking the database write lock
+        up front so that read-modify-write sequences are atomic across
+        threads and processes. Commits on success and rolls back otherwise.
+        """
+        db_con = self._connect()
+        try:
+            db_con.execute("BEGIN IMMEDIATE")
+            yield db_con
+            db_con.commit()
+        finally:
+            db_con.close()
+
+    def get(self, namespace, key, default=None):
+        """
+        Returns the value stored under (namespace, key), or default.
+        """
+        db_con = self._connect()
+        row = db_con.execute("SELECT value FROM kv WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+        db_con.close()
+        return json.loads(row[0]) if row is not None else default
+
+    def set(self, namespace, key, value):
+        """
+        Stores a JSON-serializable value under (namespace, key).
+        """
+        db_con = self._connect()
+        with db_con:
+            db_con.execute("INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?,?,?)",
+                    (namespace, key, json.dumps(value)))
+        db_con.close()
+
+    def compare_and_set(self, namespace, key, expected, value, default=None):
+        """
+        Atomically stores `value` under (namespace, key), but only if the
+        current value equals `expected`.
+
+        Parameters
+        ----------
+        namespace, key : str
+            Where the value is stored.
+        expected
+            The value the key must currently hold.
+        value
+            The JSON-serializable value to store.
+        default
+            The current value assumed if the key is not set.
+
+        Returns
+        -------
+        True if the value was stored, False if the current value differed.
+        """
+        with self._transaction() as db_con:
+            row = db_con.execute("SELECT value FROM kv WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+            current = json.loads(row[0]) if row is not None else default
+            if current != expected:
+                return False
+            db_con.execute("INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?,?,?)",
+                    (namespace, key, json.dumps(value)))
+        return True
+
+    def set_add(self, name, member):
+        """
+        Adds a string member to the named set.
+        """
+        db_con = self._connect()
+        with db_con:
+            db_con.execute("INSERT OR IGNORE INTO sets (name, member) VALUES (?,?)", (name, member))
+        db_con.close()
+
+    def set_members(self, name):
+        """
+        Returns the members of the named set.
+        """
+        db_con = self._connect()
+        members = {row[0] for row in db_con.execute("SELECT member FROM sets WHERE name=?", (name,))}
+        db_con.close()
+        return members
+
+    def queue_push(self, name, item):
+        """
+        Appends a JSON-serializable item to the end of the named queue.
+        """
+        db_con = self._connect()
+        with db_con:
+            db_con.execute("INSERT INTO queues (name, item) VALUES (?,?)", (name, json.dumps(item)))
+        db_con.close()
+
+    def queue_pop(self, name):
+        """
+        Atomically removes and returns the first item of the named queue,
+        or None if it is empty.
+        """
+        # Pollers mostly find the queue empty; check with a plain read
+        # (which WAL lets run alongside writers) before taking the write lock
+        db_con = self._connect()
+        has_item = db_con.execute("SELECT 1 FROM queues WHERE name=? LIMIT 1", (name,)).fetchone() is not None
+        db_con.close()
+        if not has_item:
+            return None
+        # In a write transaction, so two workers can't pop the same item
+        with self._transaction() as db_con:
+            row = db_con.execute("SELECT id, item FROM queues WHERE name=? ORDER BY id LIMIT 1", (name,)).fetchone()
+            if row is not None:
+                db_con.execute("DELETE FROM queues WHERE id=?", (row[0],))
+        return json.loads(row[1]) if row is not None else None
+
+    def queue_length(self, name):
+        db_con = self._connect()
+        length = db_con.execute("SELECT COUNT(*) FROM queues WHERE name=?", (name,)).fetchone()[0]
+        db_con.close()
+        return length
+
+    def claim(self, namespace, key, ttl):
+        """
+        Atomically claims (namespace, key) for `ttl` seconds, unless another
+        claim on it, from any process, has not expired yet. Expired claims
+        in the namespace are pruned at the same time.
+
+        Returns
+        -------
+        True if the claim was taken now, False if it was already held.
+        """
+        now = time.time()
+        with self._transaction() as db_con:
+            db_con.execute("DELETE FROM claims WHERE namespace=? AND expires<=?", (namespace, now))
+            cursor = db_con.execute("INSERT OR IGNORE INTO claims (namespace, key, expires) VALUES (?,?,?)",
+                    (namespace, key, now + ttl))
+            claimed = cursor.rowcount == 1
+        return claimed
+
+    def release(self, namespace, key):
+        """
+        Drops the claim on (namespace, key), if any.
+        """
+        db_con = self._connect()
+        with db_con:
+            db_con.execute("DELETE FROM claims WHERE namespace=? AND key=?", (namespace, key))
+        db_con.close()
+
+    def claim_count(self, namespace):
+        """
+        Returns the number of unexpired claims in the namespace.
+        """
+        db_con = self._connect()
+        count = db_con.execute("SELECT COUNT(*) FROM claims WHERE namespace=? AND expires>?",
+                (namespace, time.time())).fetchone()[0]
+        db_con.close()
+        return count
+
+    def append(self, name, record, index=None):
+        """
+        Appends a JSON-serializable record to the named table.
+
+        Parameters
+        ----------
+        name : str
+            The table name.
+        record
+            The record, typically a dictionary.
+        index : str, optional
+            A value that the record can later be looked up by with
+            select(name, index), e.g. a week or a user id.
+        """
+        db_con = self._connect()
+        with db_con:
+            db_con.execute("INSERT INTO records (name, idx, record) VALUES (?,?,?)",
+                    (name, index, json.dumps(record)))
+        db_con.close()
+
+    def select(self, name, index=None):
+        """
+        Returns the records of the named table, in the order they were
+        appended. If `index` is given, only records appended with that
+        index are read, using the table's index.
+        """
+        db_con = self._connect()
+        if index is None:
+            rows = db_con.execute("SELECT record FROM records WHERE name=? ORDER BY id", (name,)).fetchall()
+        else:
+            rows = db_con.execute("SELECT record FROM records WHERE name=? AND idx=? ORDER BY id",
+                    (name, index)).fetchall()
+        db_con.close()
+        return [json.loads(row[0]) for row in rows]
+
+    def import_once(self, name, load):
+        """
+        Imports legacy state (e.g. a JSON or CSV file) unless an import
+        called `name` has already been done.
+
+        Parameters
+        ----------
+        name : str
+            A unique name for this import, e.g. the imported file name.
+        load : function
+            Called without arguments, only if the import has not been done
+            yet. Returns a pair (values, records): an iterable of
+            (namespace, key, value) triples to set, and an iterable of
+            (table name, record, index) triples to append.
+
+        Returns
+        -------
+        True if the import was done now. Everything load() returned is
+        written in a single transaction, together with the marker that
+        the import was done.
+        """
+        if self.get('imports', name, False):
+            return False
+        values, records = load()
+        with self._transaction() as db_con:
+            done = db_con.execute("SELECT value FROM kv WHERE namespace='imports' AND key=?", (name,)).fetchone()
+            if done is not None:
+                return False
+            db_con.executemany("INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?,?,?)",
+                    [(namespace, key, json.dumps(value)) for namespace, key, value in values])
+            db_con.executemany("INSERT INTO records (name, idx, record) VALUES (?,?,?)",
+                    [(table, index, json.dumps(record)) for table, record, index in records])
+            db_con.execute("INSERT INTO kv (namespace, key, value) VALUES ('imports',?,?)",
+                    (name, json.dumps(True)))
+        return True
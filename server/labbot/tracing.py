@@ -0,0 +1,226 @@
+"""
+Latency tracing for module handlers.
+
+When enabled, ModuleLoader.register wraps every Slack listener and FastAPI
+route handler it registers. Each call records a span with the module,
+listener type, action_id/callback_id (or route) and duration. For Slack
+listeners, the span also records how long after the handler started it
+called ack(), since Slack expects an ack within three seconds.
+
+Spans are aggregated per handler, and a digest of the slowest handlers is
+periodically posted to #labbot_debug.
+"""
+import functools
+import inspect
+import threading
+import time
+
+# Acks slower than this are reported as close to Slack's 3 second limit
+ACK_WARN_SEC = 2.0
+
+# bolt decorators that do not register listeners
+UNTRACED_SLACK_DECORATORS = ('middleware', 'use')
+
+
+def handler_id(args, kwargs):
+    """
+    Returns a readable identifier for a handler from the arguments of the
+    decorator that registered it, e.g. an action_id or a route path.
+    """
+    if len(args) > 0:
+        constraint = args[0]
+    elif len(kwargs) > 0:
+        constraint = next(iter(kwargs.values()))
+    else:
+        return ''
+    if isinstance(constraint, dict):
+        for key in ('action_id', 'callback_id', 'block_id', 'type'):
+            if key in constraint:
+                return str(getattr(constraint[key], 'pattern', constraint[key]))
+    return str(getattr(constraint, 'pattern', constraint))
+
+
+class HandlerStats:
+    """
+    Aggregated spans of a single handler since the last digest.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.max_ack_sec = 0.0
+        self.slow_acks = 0
+
+    @property
+    def mean_sec(self):
+        return self.total_sec / self.calls if self.calls > 0 else 0.0
+
+
+class Tracer:
+    """
+    Records handler spans and summarizes the slowest handlers.
+    """
+
+    def __init__(self, metrics=None):
+        """
+        Parameters
+        ----------
+        metrics : labbot.metrics.MetricsRegistry, optional
+            If given, handler and ack durations are also recorded there.
+        """
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._metrics = None
+        if metrics is not None:
+            labels = ('module', 'type', 'id')
+            self._metrics = {
+                'duration': metrics.histogram(
+                    'labbot_handler_seconds', 'Duration of module handlers.', labels),
+                'ack': metrics.histogram(
+                    'labbot_handler_ack_seconds', 'Time until module Slack handlers called ack().', labels),
+            }
+
+    def record(self, module, kind, name, duration, ack_sec=None, failed=False):
+        """
+        Records a single span.
+
+        Parameters
+        ----------
+        module : str
+            The name of the module the handler belongs to.
+        kind : str
+            The listener type, e.g. 'action', 'view' or 'http'.
+        name : str
+            The handler id, e.g. an action_id or route path.
+        duration : float
+            Seconds the handler ran for.
+        ack_sec : float, optional
+            Seconds from the handler starting until it called ack().
+        failed : bool
+            True if the handler raised.
+        """
+        key = (module, kind, name)
+        with self._lock:
+            stats = self._stats.setdefault(key, HandlerStats())
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.total_sec += duration
+            stats.max_sec = max(stats.max_sec, duration)
+            if ack_sec is not None:
+                stats.max_ack_sec = max(stats.max_ack_sec, ack_sec)
+                stats.slow_acks += int(ack_sec > ACK_WARN_SEC)
+        if self._metrics is not None:
+            self._metrics['duration'].observe(duration, module=module, type=kind, id=name)
+            if ack_sec is not None:
+                self._metrics['ack'].observe(ack_sec, module=module, type=kind, id=name)
+
+    def digest(self, top=10):
+        """
+        Returns a summary of the slowest handlers since the last digest, or
+        None if no handler ran, and starts a new window.
+        """
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            window_sec = time.monotonic() - self._window_start
+            self._window_start = time.monotonic()
+        if len(stats) == 0:
+            return None
+
+        lines = ['Slowest handlers over the last {:.0f} minutes ({} calls):'.format(
+            window_sec / 60, sum(s.calls for s in stats.values()))]
+        slowest = sorted(stats.items(), key=lambda item: item[1].max_sec, reverse=True)[:top]
+        for (module, kind, name), s in slowest:
+            lines.append('{} {} `{}`: {} calls ({} failed), mean {:.3f}s, max {:.3f}s, ack max {:.3f}s'.format(
+                module, kind, name, s.calls, s.failures, s.mean_sec, s.max_sec, s.max_ack_sec))
+        slow_acks = [(key, s) for key, s in stats.items() if s.slow_acks > 0]
+        if len(slow_acks) > 0:
+            lines.append('Acks slower than {:.1f}s (Slack allows 3s):'.format(ACK_WARN_SEC))
+            for (module, kind, name), s in slow_acks:
+                lines.append('{} {} `{}`: {} of {} calls'.format(module, kind, name, s.slow_acks, s.calls))
+        return '\n'.join(lines)
+
+    def wrap_slack(self, func, module, kind, name):
+        """
+        Wraps a bolt listener so that each call records a span. The wrapper
+        has the same signature as `func` (bolt injects arguments by name)
+        and is a coroutine function if and only if `func` is one.
+        """
+        tracer = self
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(**kwargs):
+                start = time.monotonic()
+                ack_time = []
+                if 'ack' in kwargs:
+                    ack = kwargs['ack']
+                    async def timed_ack(*args, **ack_kwargs):
+                        if len(ack_time) == 0:
+                            ack_time.append(time.monotonic() - start)
+                        return await ack(*args, **ack_kwargs)
+                    kwargs['ack'] = timed_ack
+                failed = True
+                try:
+                    result = await func(**kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tracer.record(module, kind, name, time.monotonic() - start,
+                                  ack_time[0] if ack_time else None, failed)
+        else:
+            @functools.wraps(func)
+            def wrapper(**kwargs):
+                start = time.monotonic()
+                ack_time = []
+                if 'ack' in kwargs:
+                    ack = kwargs['ack']
+                    def timed_ack(*args, **ack_kwargs):
+                        if len(ack_time) == 0:
+                            ack_time.append(time.monotonic() - start)
+                        return ack(*args, **ack_kwargs)
+                    kwargs['ack'] = timed_ack
+                failed = True
+                try:
+                    result = func(**kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tracer.record(module, kind, name, time.monotonic() - start,
+                                  ack_time[0] if ack_time else None, failed)
+
+        wrapper.__signature__ = inspect.signature(func)
+        return wrapper
+
+    def wrap_fastapi(self, func, module, name):
+        """
+        Wraps a FastAPI route handler so that each call records a span.
+        FastAPI reads the signature through __wrapped__, and runs the
+        wrapper on the event loop or in its thread pool exactly as it
+        would the original handler.
+        """
+        tracer = self
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.monotonic()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tracer.record(module, 'http', name, time.monotonic() - start, failed=failed)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.monotonic()
+                failed = True
+                try:
+                    result = func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    tracer.record(module, 'http', name, time.monotonic() - start, failed=failed)
+        return wrapper
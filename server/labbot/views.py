@@ -0,0 +1,235 @@
+"""
+Precompiled Block Kit view templates.
+
+Messages, modals and home tabs are large nested structures of which only a
+few values change from one use to the next. Deep-copying a template and
+then assigning into it by index is slow, breaks silently when a block is
+added to the template, and mutating a shared template without copying it
+leaks one user's view into another's.
+
+A ViewTemplate is instead compiled once, when its module is loaded, into a
+tree of builder functions that make a fresh structure from named slots::
+
+    REMINDER = ViewTemplate([
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": Format("Lab job: {job_name}")},
+            "accessory": {"type": "users_select", "action_id": "assign",
+                          "initial_user": Slot('assignee', optional=True)}
+        },
+        Splice('extra_blocks')
+    ])
+    blocks = REMINDER.render(job_name='Autoclave', assignee=None, extra_blocks=[])
+
+In a template:
+
+- Plain strings are copied as they are, braces included.
+- Format(string) is a str.format template, filled in from the render
+  arguments. Literal braces in it are written as {{ and }}.
+- Slot(name) is replaced by the argument `name`, as is.
+- Slot(name, optional=True), as a dictionary value, may be left out or
+  None, in which case its key is left out of the dictionary.
+- Splice(name), as a list item, is replaced by the items of the argument
+  `name`.
+
+Every render builds new dictionaries and lists, so the result can be
+modified freely and templates can be rendered from any number of threads.
+"""
+import math
+import string
+
+
+class Slot:
+    """
+    A value of a view template that is given when rendering.
+    """
+
+    def __init__(self, name, optional=False):
+        """
+        Parameters
+        ----------
+        name : str
+            The render argument that replaces this slot.
+        optional : bool
+            If True, the argument may be left out or None, in which case
+            the dictionary key holding the slot is left out.
+        """
+        self.name = name
+        self.optional = optional
+
+    def __repr__(self):
+        return 'Slot({!r}, optional={!r})'.format(self.name, self.optional)
+
+
+class Splice:
+    """
+    A list item of a view template that is replaced by any number of
+    items given when rendering.
+    """
+
+    def __init__(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            The render argument, a sequence, whose items replace this one.
+        """
+        self.name = name
+
+    def __repr__(self):
+        return 'Splice({!r})'.format(self.name)
+
+
+class Format:
+    """
+    A string of a view template that is filled in with str.format when
+    rendering.
+    """
+
+    def __init__(self, template):
+        """
+        Parameters
+        ----------
+        template : str
+            A format string using named fields, e.g. 'Lab job: {job_name}'.
+
+        Raises
+        ------
+        ValueError
+            If the format string is invalid or uses positional fields.
+        """
+        try:
+            fields = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+        except ValueError as e:
+            raise ValueError('Invalid format string {!r} in view template: {}'.format(template, e)) from None
+        names = set()
+        for field in fields:
+            name = field.split('.')[0].split('[')[0]
+            if name == '' or name.isdigit():
+                raise ValueError('Format string {!r} in view template must use named fields'.format(template))
+            names.add(name)
+        self.template = template
+        self.fields = frozenset(names)
+
+    def __repr__(self):
+        return 'Format({!r})'.format(self.template)
+
+
+def _is_constant(value):
+    return (value is None or isinstance(value, (str, bool, int))
+            or (isinstance(value, float) and math.isfinite(value)))
+
+
+class ViewTemplate:
+    """
+    A Block Kit structure with named slots, compiled into a builder.
+    """
+
+    def __init__(self, template):
+        """
+        Parameters
+        ----------
+        template : dict or list
+            The structure to build: dictionaries, lists, strings, numbers,
+            booleans and None, plus Slot, Splice and Format placeholders.
+
+        Raises
+        ------
+        ValueError
+            If a placeholder is used where it cannot be, or a format string
+            is invalid.
+        TypeError
+            If the template contains any other type of value.
+        """
+        self._required = set()
+        self._optional = set()
+        self._build = self._compile(template)
+        self.slots = frozenset(self._required | self._optional)
+
+    def render(self, **values):
+        """
+        Returns a new structure with the slots filled in from `values`.
+
+        Raises
+        ------
+        TypeError
+            If a required slot has no value.
+        """
+        missing = self._required.difference(values)
+        if len(missing) > 0:
+            raise TypeError('Missing values for view template slots: {}'.format(', '.join(sorted(missing))))
+        return self._build(values)
+
+    def _compile(self, node, in_dict=False):
+        """
+        Returns a function building `node` from the dictionary of render
+        arguments.
+        """
+        if isinstance(node, dict):
+            return self._compile_dict(node)
+        if isinstance(node, list):
+            return self._compile_list(node)
+        if isinstance(node, Slot):
+            name = node.name
+            if node.optional:
+                if not in_dict:
+                    raise ValueError('Optional slot {!r} must be a dictionary value'.format(name))
+                self._optional.add(name)
+                return lambda values: values.get(name)
+            self._required.add(name)
+            return lambda values: values[name]
+        if isinstance(node, Splice):
+            raise ValueError('Splice {!r} must be a list item'.format(node.name))
+        if isinstance(node, Format):
+            self._required.update(node.fields)
+            return node.template.format_map
+        if _is_constant(node):
+            return lambda values: node
+        raise TypeError('Unsupported value in view template: {!r}'.format(node))
+
+    def _compile_dict(self, node):
+        # (key, is a builder, builder or constant value) triples, in order
+        entries = []
+        optional = []
+        for key, value in node.items():
+            if not isinstance(key, str):
+                raise TypeError('View template keys must be strings, not {!r}'.format(key))
+            if isinstance(value, Slot) and value.optional:
+                optional.append(key)
+            if _is_constant(value):
+                entries.append((key, False, value))
+            else:
+                entries.append((key, True, self._compile(value, in_dict=True)))
+
+        def build(values):
+            result = {}
+            for key, is_builder, item in entries:
+                result[key] = item(values) if is_builder else item
+            for key in optional:
+                if result[key] is None:
+                    del result[key]
+            return result
+        return build
+
+    def _compile_list(self, node):
+        # (is a splice, builder or splice name) pairs
+        items = []
+        for item in node:
+            if isinstance(item, Splice):
+                self._required.add(item.name)
+                items.append((True, item.name))
+            else:
+                items.append((False, self._compile(item)))
+
+        def build(values):
+            result = []
+            for splice, item in items:
+                if splice:
+                    result.extend(values[item])
+                else:
+                    result.append(item(values))
+            return result
+        return build
+
+    def __repr__(self):
+        return 'ViewTemplate(slots={})'.format(sorted(self.slots))
@@ -0,0 +1,117 @@
+"""
+Support for serving LabBot from several worker processes.
+
+uvicorn ignores its `workers` setting when a Server is run by hand, so
+LabBot forks its own workers after all modules are loaded. The workers
+share one listening socket. Worker 0 is the primary: it is the only one
+that runs timers and publishes the home tab. The other workers forward
+home tab update requests to it, and every worker forwards shutdown and
+restart requests to the supervising parent process. Messages that every
+worker must act on, such as hot-reloading a module or draining before a
+shutdown, are broadcast.
+"""
+import multiprocessing
+import threading
+import time
+
+
+class WorkerPool:
+    """
+    Forks and supervises webserver worker processes.
+    """
+
+    def __init__(self, n_workers=1):
+        """
+        Parameters
+        ----------
+        n_workers : int
+            The number of worker processes. With a single worker, nothing
+            is forked and the current process serves requests directly.
+        """
+        self.n_workers = n_workers
+        # The worker index inside a forked worker; None in the parent process
+        self.index = None
+        self._processes = []
+        if n_workers > 1:
+            context = multiprocessing.get_context('fork')
+            self._context = context
+            self.control_queue = context.Queue()
+            self.home_tab_queue = context.Queue()
+            # One queue per worker, for messages that every worker must handle
+            self.worker_queues = [context.Queue() for _ in range(n_workers)]
+
+    @property
+    def is_multiprocess(self):
+        return self.n_workers > 1
+
+    @property
+    def is_worker(self):
+        """
+        True inside a forked worker process.
+        """
+        return self.index is not None
+
+    @property
+    def is_primary(self):
+        """
+        True in the process that should run timers and the home tab publisher.
+        """
+        return not self.is_multiprocess or self.index == 0
+
+    def start(self, target, *args):
+        """
+        Forks the worker processes, each calling target(*args).
+        """
+        for i in range(self.n_workers):
+            process = self._context.Process(
+                    target=self._run_worker,
+                    args=(i, target) + args,
+                    name='labbot-worker-{}'.format(i))
+            process.start()
+            self._processes.append(process)
+
+    def _run_worker(self, index, target, *args):
+        self.index = index
+        target(*args)
+
+    def stop(self, timeout=10, grace=0):
+        """
+        Waits up to `grace` seconds for the worker processes to exit on
+        their own (e.g. after being asked to drain), then terminates the
+        rest and waits for them to exit.
+
+        Returns
+        -------
+        The number of workers that had to be terminated.
+        """
+        deadline = time.monotonic() + grace
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+        terminated = 0
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+                terminated += 1
+        for process in self._processes:
+            process.join(timeout)
+        self._processes = []
+        return terminated
+
+    def broadcast(self, message):
+        """
+        Sends a message to every worker process (including this one).
+        """
+        for worker_queue in self.worker_queues:
+            worker_queue.put(message)
+
+    def forward(self, source_queue, handler):
+        """
+        Starts a daemon thread that calls handler(message) for every
+        message put on source_queue (e.g. by another process).
+        """
+        def loop():
+            while True:
+                handler(source_queue.get())
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
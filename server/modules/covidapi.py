@@ -1,10 +1,12 @@
 from datetime import datetime, timedelta
 from labbot.module_loader import ModuleLoader
+from labbot.views import ViewTemplate, Slot
 import json
 from collections import namedtuple
 import pytz
 import re
 import csv
+import io
 import pathlib
 
 ETC = pytz.timezone('America/New_York')
@@ -20,10 +22,13 @@ def register_module(config):
     # Override defaults if present 
     module_config.update(config)
 
+    # Hours used to be appended to a CSV file; import it into the store
+    module_config['store'].import_once('covid_hours.csv', load_legacy_csv)
+
     # Return
     return loader
 
-main_model = {
+main_model = ViewTemplate({
   "type": "modal",
   "title": {
     "type": "plain_text",
@@ -45,7 +50,7 @@ main_model = {
             "type": "section",
             "text": {
                 "type": "mrkdwn",
-                "text": ""
+                "text": Slot('summary')
             },
             "accessory": {
                 "type": "button",
@@ -70,7 +75,7 @@ main_model = {
             "element": {
                 "type": "datepicker",
                 "action_id": "submit_date",
-                "initial_date": "2020-01-01"
+                "initial_date": Slot('initial_date')
             },
             "optional": False,
             "block_id": "submit_date_input"
@@ -122,9 +127,9 @@ main_model = {
   },
   "private_metadata": "Shhhhhhhh",
   "callback_id": "covid_hour_track_submission"
-}
+})
 
-submissions_model = {
+submissions_model = ViewTemplate({
         "type": "modal",
         "title": {
                 "type": "plain_text",
@@ -139,7 +144,7 @@ submissions_model = {
                         "type": "section",
                         "text": {
                                 "type": "mrkdwn",
-                                "text": " "
+                                "text": Slot('summary')
                         }
                 },
                 {
@@ -149,11 +154,11 @@ submissions_model = {
                         "type": "section",
                         "text": {
                                 "type": "mrkdwn",
-                                "text": " "
+                                "text": Slot('submissions')
                         }
                 }
         ]
-}
+})
 
 # -- Slack functions --
 
@@ -164,26 +169,23 @@ def main_tracker(ack, shortcut, client):
     """
     ack()
 
-    # Check the existing covid CSV file
-    check_covid_file_existence('covid_hours.csv')
-    hour_results = parse_csv('covid_hours.csv')
+    # Only this week's hours are read
     now_dt = datetime.now(ETC)
     current_week = now_dt + timedelta(days=-now_dt.weekday())
+    hour_results = load_week(current_week)
 
 
-    # Update the main model
-    now_dt = datetime.now(ETC)
-    main_model["blocks"][4]["element"]["initial_date"] = now_dt.strftime('%Y-%m-%d')
-
     hour_summary = summarize_hour_results(hour_results, current_week, shortcut['user']['username'])
-    main_model["blocks"][2]["text"]["text"] = "This week you have used *{:.1f}* out of *{:.1f}* hours.\nAll lab members have used *{:.1f}* out of *{:.1f}* hours.".format(
+    view = main_model.render(
+        initial_date=datetime.now(ETC).strftime('%Y-%m-%d'),
+        summary="This week you have used *{:.1f}* out of *{:.1f}* hours.\nAll lab members have used *{:.1f}* out of *{:.1f}* hours.".format(
             hour_summary[0],
             module_config['hours_per_week'],
             hour_summary[1],
-            module_config['hours_per_week'] * module_config['lab_members'])
+            module_config['hours_per_week'] * module_config['lab_members']))
     client.views_open(
         trigger_id = shortcut['trigger_id'],
-        view = main_model)
+        view = view)
 
 @loader.slack.action("view_covid_submissions")
 def show_detailed_hours(ack, body, client):
@@ -192,28 +194,28 @@ def show_detailed_hours(ack, body, client):
     """
     ack()
 
-    # Check the existing covid CSV file
-    check_covid_file_existence('covid_hours.csv')
-    hour_results = parse_csv('covid_hours.csv')
+    # Only this week's hours are read
     now_dt = datetime.now(ETC)
     current_week = now_dt + timedelta(days=-now_dt.weekday())
+    hour_results = load_week(current_week)
 
     hour_summary = summarize_hour_results(hour_results, current_week, body['user']['username'])
-    submissions_model["blocks"][0]["text"]["text"] = "For the week of *{}* to *{}*, you have submitted *{:.1f}* hours:".format(
+    view = submissions_model.render(
+        summary="For the week of *{}* to *{}*, you have submitted *{:.1f}* hours:".format(
             current_week.strftime("%B %d"),
             (current_week + timedelta(days=6)).strftime("%B %d"),
-            hour_summary[0])
-    submissions_model["blocks"][2]["text"]["text"] = ' \n' + '\n'.join([
+            hour_summary[0]),
+        submissions=' \n' + '\n'.join([
             "*{}*: {} to {}".format(
                 val[0].strftime("%B %d"),
                 val[1].strftime("%k:%M"),
                 val[2].strftime("%k:%M")) for val in 
-            hour_summary[2]])
+            hour_summary[2]]))
 
     print(hour_summary)
     client.views_push(
         trigger_id = body['trigger_id'],
-        view = submissions_model)
+        view = view)
 
 @loader.slack.view('covid_hour_track_submission')
 def handle_form_submission(ack, body, client, view):
@@ -252,8 +254,7 @@ def handle_form_submission(ack, body, client, view):
     day = form_state['submit_date_input']['submit_date']['selected_date']
     arrival = form_state['arrival_time_input']['arrival_time']['value']
     departure = form_state['departure_time_input']['departure_time']['value']
-    add_row('covid_hours.csv',
-            body['user']['username'],
+    add_row(body['user']['username'],
             day,
             arrival,
             departure)
@@ -274,31 +275,35 @@ def csv_export(ack, shortcut, client):
     result = client.files_upload(
         channels=shortcut['user']['id'],
         initial_comment='Hours CSV:',
-        file='covid_hours.csv')
+        filename='covid_hours.csv',
+        content=export_csv())
 
 # -- Helper functions --
 
-def parse_csv(filename):
+CSV_FIELDS = ['user', 'week', 'day', 'arrival_time', 'departure_time']
+
+def load_week(week):
+    """
+    Returns the hours submitted for the week starting on the Monday `week`,
+    as results[user][week_str] = {'total_time', 'instances'}
+    """
     results = {}
-    # The Monday date is the current week
-    with open(filename) as covid_file:
-        reader = csv.DictReader(covid_file)
-        for row in reader:
-            week = datetime.strptime(row['week'], '%Y-%m-%d')
-            day = datetime.strptime(row['day'], '%Y-%m-%d')
-            arrival_time = datetime.strptime(row['arrival_time'], '%H:%M')
-            departure_time = datetime.strptime(row['departure_time'], '%H:%M')
-
-            if row['user'] not in results:
-                results[row['user']] = {}
-
-            week_str = week.strftime('%Y-%m-%d')
-            if week_str not in results[row['user']]:
-                results[row['user']][week_str] = {'total_time': 0.0, 'instances': []}
-
-            results[row['user']][week_str]['instances'].append(
-                    [day, arrival_time, departure_time])
-            results[row['user']][week_str]['total_time'] += (departure_time - arrival_time).total_seconds()
+    week_str = week.strftime('%Y-%m-%d')
+    # Records are indexed by week, so this does not read older weeks
+    for row in module_config['store'].select('covid_hours', week_str):
+        day = datetime.strptime(row['day'], '%Y-%m-%d')
+        arrival_time = datetime.strptime(row['arrival_time'], '%H:%M')
+        departure_time = datetime.strptime(row['departure_time'], '%H:%M')
+
+        if row['user'] not in results:
+            results[row['user']] = {}
+
+        if week_str not in results[row['user']]:
+            results[row['user']][week_str] = {'total_time': 0.0, 'instances': []}
+
+        results[row['user']][week_str]['instances'].append(
+                [day, arrival_time, departure_time])
+        results[row['user']][week_str]['total_time'] += (departure_time - arrival_time).total_seconds()
     return results
 
 def summarize_hour_results(results, week, username):
@@ -320,18 +325,32 @@ def summarize_hour_results(results, week, username):
     all_results /= 3600
     return (user_results, all_results, instances)
 
-def check_covid_file_existence(filename):
-    if not pathlib.Path(filename).exists():
-        with open(filename, 'w') as covid_file:
-            covid_file.write('user,week,day,arrival_time,departure_time\n')
+def load_legacy_csv():
+    """
+    Reads the CSV file written by older versions, for Store.import_once
+    """
+    if not pathlib.Path('covid_hours.csv').exists():
+        return [], []
+    with open('covid_hours.csv') as covid_file:
+        rows = [{field: row[field] for field in CSV_FIELDS} for row in csv.DictReader(covid_file)]
+    return [], [('covid_hours', row, row['week']) for row in rows]
+
+def export_csv():
+    """
+    Returns every submission in the original CSV format
+    """
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(module_config['store'].select('covid_hours'))
+    return output.getvalue()
 
-def add_row(filename, user, day, arrival, departure):
+def add_row(user, day, arrival, departure):
     day_dt = datetime.strptime(day, '%Y-%m-%d')
-    week = day_dt + timedelta(days=-day_dt.weekday())
-    with open(filename, 'a') as covid_file:
-        covid_file.write('{},{},{},{},{}\n'.format(
-            user,
-            week.strftime('%Y-%m-%d'),
-            day,
-            arrival,
-            departure))
+    week_str = (day_dt + timedelta(days=-day_dt.weekday())).strftime('%Y-%m-%d')
+    module_config['store'].append('covid_hours', {
+            'user': user,
+            'week': week_str,
+            'day': day,
+            'arrival_time': arrival,
+            'departure_time': departure}, week_str)
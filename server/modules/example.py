@@ -3,6 +3,7 @@ Example module demonstrating both the Slack integration
 basics and timer basics, plus module loading
 """
 from labbot.module_loader import ModuleLoader
+from labbot.views import ViewTemplate, Slot, Format
 
 # Create a module_config dictionary to store necessary
 # configuration information, loaded from `labbot.secret`
@@ -25,6 +26,27 @@ loader = ModuleLoader()
 #
 # logger: A function you can call to report log information back to the
 #   #labbot_debug channel
+#
+# store: A labbot.store.Store for state that must be shared between worker
+#   processes (key-value pairs, sets, queues and append-only tables). Don't
+#   keep such state in module globals, as each worker process has its own
+#   copy. Use store.compare_and_set for read-modify-write updates, and
+#   store.import_once to move state over from files written by older versions.
+#
+# storage: A labbot.storage.Storage handing out pooled SQLite connections
+#   (WAL mode, busy timeout, statement cache, query timing). Use
+#   storage.connect('my_module.db') in place of sqlite3.connect; calling
+#   close() on the connection returns it to the pool.
+#
+# draining: A function returning True once LabBot is draining before a
+#   shutdown or restart. Long-running timers and handlers should check it
+#   between units of work, and return early or save their progress, as
+#   they are cut off once the drain deadline passes.
+#
+# async_slack_client: An AsyncWebClient if LabBot runs in async mode
+#   (global.async_slack), otherwise None. In async mode, Slack listeners and
+#   timers may be declared with `async def`; they are then awaited on the event
+#   loop and receive async ack/say/client arguments.
 def register_module(config):
     # Override defaults if present 
     module_config.update(config)
@@ -62,6 +84,32 @@ def hello_world_timer(slack_client):
     # Reschedule us to run again in one minute
     return 60
 
+# Timers can also be given a concurrency policy. Each timer runs in its own
+# thread pool, so a timer that hangs cannot starve other modules' timers.
+#
+# max_instances: how many runs of this timer may execute at once
+# overlap: what to do if the timer is due while it is still running:
+#   'skip' (default), 'queue', or 'coalesce' (keep at most one pending run)
+# catch_up: what to do with ticks missed during a long stall:
+#   'coalesce' (default, run once), 'skip' (wait for the next tick), or 'all'
+@loader.timer(max_instances=1, overlap='coalesce', catch_up='skip')
+def hello_world_policy_timer(slack_client):
+    return None
+
+# Timers can also run on the wall clock rather than after the delay they
+# return: cron='...' takes a cron expression (in local time) and every=N runs
+# on every multiple of N seconds. jitter=N delays each run by up to N random
+# seconds, so that timers on the same schedule don't all hit Slack at once.
+# With a schedule, the return value is ignored.
+@loader.timer(cron='0 9 * * mon-fri', jitter=30)
+def hello_world_cron_timer(slack_client):
+    return None
+
+# Modules can export their own counters on LabBot's /metrics endpoint.
+# Counters can be used straight away; call .inc() with a value for each label.
+mention_counter = loader.counter(
+        'labbot_example_mentions_total', 'Mentions answered by the example module.')
+
 # Any decorator in the slack_bolt documentation:
 #
 # https://slack.dev/bolt-python/
@@ -84,3 +132,43 @@ def handle_mention(body, say):
     # user is actually your user ID string (something like W08A1734),
     # so <@W08A1734> gets formatted as whatever your display name is.
     say('Hi <@{}>!'.format(user))
+    mention_counter.inc()
+
+# Messages and modals are built from ViewTemplates, compiled once when the
+# module loads. Format(string) is filled in with str.format, other strings
+# are kept as they are, and Slot(name) inserts a value as is; render()
+# returns a fresh structure every time, so never modify a shared template
+# dictionary in place.
+GREETING_MESSAGE = ViewTemplate([
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": Format("Hi <@{user}>!")
+        },
+        "accessory": {
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "Do something slow"
+            },
+            "action_id": "example_slow_button",
+            "value": Slot('value')
+        }
+    }
+])
+
+@loader.slack.command('/example_greeting')
+def handle_greeting(ack, body, say):
+    ack()
+    say(blocks=GREETING_MESSAGE.render(user=body['user_id'], value='slow'), text='Hi!')
+
+# Listeners that do slow work (subprocesses, many Slack API calls) should
+# acknowledge Slack first; otherwise Slack retries the request after three
+# seconds. Put @loader.deferred below the Slack decorator and leave out the
+# ack argument: LabBot acks immediately and runs the listener in a
+# background pool, reporting how long it was queued and how long it ran.
+@loader.slack.action('example_slow_button')
+@loader.deferred
+def handle_slow_button(body, client):
+    client.chat_postMessage(channel=body['user']['id'], text='Done!')
@@ -11,22 +11,19 @@ module_config = {}
 loader = ModuleLoader()
 
 def is_checked_out():
+    # The flag lives in the shared store so every worker process sees it
+    return module_config['store'].get('flowjo', 'in_use', False)
+
+def load_legacy_status():
+    """
+    Reads the status file written by older versions, for Store.import_once
+    """
     try:
         with open('flowjo_checkout.json') as f:
-
-            status = json.load(f)
-            return status['in_use']
+            in_use = json.load(f)['in_use']
     except FileNotFoundError:
-        # Create the JSON file, with it not in use
-        write_status(False)
-        return False
-
-def write_status(checked_out: bool):
-    with open('flowjo_checkout.json', 'w') as f:
-        json.dump({
-            'in_use': checked_out
-        }, f)
-
+        return [], []
+    return [('flowjo', 'in_use', in_use)], []
 
 
 def register_module(config):
@@ -36,6 +33,8 @@ def register_module(config):
     # Check for token secret
     if 'token' not in module_config:
         raise RuntimeError("Expected a secret token for authentication! We weren't passed a 'token' key")
+
+    module_config['store'].import_once('flowjo_checkout.json', load_legacy_status)
     return loader
 
 @loader.fastapi.get("/flowjo/state")
@@ -51,23 +50,22 @@ def checkin_license(token: str):
     if (token != module_config['token']):
         raise HTTPException(status_code=401, detail="Invalid auth token")
 
-    # Can only check-in if we are checked out
-    if not is_checked_out():
+    # Can only check-in if we are checked out. Checked and set atomically,
+    # as concurrent requests may be served by different workers.
+    if not module_config['store'].compare_and_set('flowjo', 'in_use', True, False, default=False):
         raise HTTPException(status_code=409, detail="License already checked in")
-    write_status(False)
-    module_config['hometab_update']()
+    module_config['hometab_update']('flowjo')
 
 @loader.fastapi.post("/flowjo/checkout")
 def checkout_license(token: str):
     if (token != module_config['token']):
         raise HTTPException(status_code=403, detail="Invalid auth token")
     # Can only check out if we are not in use
-    if is_checked_out():
+    if not module_config['store'].compare_and_set('flowjo', 'in_use', False, True, default=False):
         raise HTTPException(status_code=409, detail="License already checked out!")
-    write_status(True)
-    module_config['hometab_update']()
+    module_config['hometab_update']('flowjo')
 
-@loader.home_tab
+@loader.home_tab(keys=['flowjo'])
 def flowjo_checkout_home(user):
     # Ignores the user, displaying the same thing
     # for everyone
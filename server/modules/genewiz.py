@@ -24,10 +24,26 @@ def register_module(config):
     if 'password' not in module_config:
         raise RuntimeError("Genewize password not specified in the config file!")
 
+    module_config['store'].import_once('pending_genewiz.json', load_legacy_pending)
+
     # Return
     return loader
 
-@loader.timer
+def load_legacy_pending():
+    """
+    Reads the pending order list written by older versions, for Store.import_once
+    """
+    if not os.path.isfile('pending_genewiz.json'):
+        return [], []
+    with open('pending_genewiz.json') as pending:
+        pending_json = pending.read()
+    if len(pending_json) == 0:
+        return [], []
+    return [('genewiz', 'pending_orders', json.loads(pending_json))], []
+
+# A slow Genewiz login should not pile up polls behind it. Polls run every
+# five minutes on the clock, jittered so they don't coincide with other timers.
+@loader.timer(overlap='skip', every=5 * 60, jitter=60)
 def poll(slack_client):
     """
     Given Genewiz login credentials, checks for newly completed
@@ -49,7 +65,7 @@ def poll(slack_client):
         pubkey = re.search(r"encrypt.setPublicKey\('([^']*)'\);", r.text)
         if token is None or pubkey is None:
             module_config['logger']('Unable to load CSRF token and password pubkey')
-            return 5 * 60
+            return
 
         pubkey_bytes = rsa.PublicKey.load_pkcs1_openssl_der(base64.b64decode(pubkey.group(1)))
 
@@ -72,25 +88,22 @@ def poll(slack_client):
         except AttributeError as e:
             # Ignore Genewiz page load errors from time to time
             module_config['logger'](f'Failed to extract orders :(\nError: {str(e)}')
-            return 5 * 60
+            return
 
         # Extracted saved non-extracted orders
-
-        if not os.path.isfile('pending_genewiz.json'):
-            pending_orders = {}
-        else:
-            with open('pending_genewiz.json') as pending:
-                pending_json = pending.read()
-                if len(pending_json) == 0:
-                    pending_orders = {}
-                else:
-                    pending_orders = set(json.loads(pending_json))
+        pending_orders = set(module_config['store'].get('genewiz', 'pending_orders', []))
 
         # Find orders that used to be pending:
         updated_sequences = [seq for seq in sanger_sequencing if
                 seq['orderStatus'] == 'Completed' and seq['id'] in pending_orders]
 
         for sequence in updated_sequences:
+            if module_config['draining']():
+                # LabBot is restarting; the remaining orders stay pending
+                # and are posted after the restart
+                module_config['logger']('Draining, leaving {} orders for the next poll'.format(
+                    len([seq for seq in updated_sequences if seq['id'] in pending_orders])))
+                return
 
             (text_out, zip_filename) = _extract_seq_results(sequence, session)
             try:
@@ -98,8 +111,8 @@ def poll(slack_client):
                 slack_response = slack_client.chat_postMessage(
                     channel='#sequencing',
                     text='Sequencing results:',
-                    blocks=json.dumps([{'type':'section', 'text':
-                        {'type': 'mrkdwn', 'text': text_out}}]))
+                    blocks=[{'type':'section', 'text':
+                        {'type': 'mrkdwn', 'text': text_out}}])
 
                 slack_response = slack_client.files_upload_v2(
                         channel="CSRQNRXHQ",
@@ -110,6 +123,10 @@ def poll(slack_client):
                 os.remove(zip_filename)
                 os.rmdir(os.path.dirname(zip_filename)) # Safe because we created this tempdir
 
+            # Checkpoint after every order, so that a restart does not post it again
+            pending_orders.discard(sequence['id'])
+            module_config['store'].set('genewiz', 'pending_orders', list(pending_orders))
+
         # Update the pending orders list
         new_pending_orders = [order['id'] for order in (sanger_sequencing + oligos)
                 if order['orderStatus'] != 'Completed']
@@ -117,14 +134,10 @@ def poll(slack_client):
         if set(new_pending_orders) != pending_orders:
             module_config['logger']('New order detected. New pending queue:{}'.format(new_pending_orders))
 
-        with open('pending_genewiz.json', 'w') as pending:
-            json.dump(new_pending_orders, pending)
+        module_config['store'].set('genewiz', 'pending_orders', new_pending_orders)
 
     except Exception as e:
         module_config['logger'](str(e))
-    finally:
-        # Reschedule in 5 minutes
-        return 5 * 60
 
 
 def _extract_seq_results(order, session):
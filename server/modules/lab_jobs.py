@@ -3,6 +3,8 @@ Module that tracks lab jobs.
 """
 import traceback
 from labbot.module_loader import ModuleLoader
+from labbot.slack_client import prioritized, PRIORITY_LOW
+from labbot.views import ViewTemplate, Slot, Splice, Format
 import fastapi 
 from pydantic import BaseModel
 import typing
@@ -10,7 +12,6 @@ import sqlite3
 import secrets
 import datetime
 import collections
-import copy
 from pytz import timezone
 from dateutil import rrule
 from durations import Duration
@@ -21,12 +22,12 @@ from typing import Callable, Dict, List
 
 ET = timezone('US/Eastern')
 
-REMINDER_MESSAGE = [
+REMINDER_MESSAGE = ViewTemplate([
     {
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": "Lab job: {job_name}\n<!date^{due_ts}^Due {{date_long_pretty}}|{fallback_ts}>\n_If you are unable to do your job this time, reassign it to someone who can after confirming with them_"
+            "text": Format("{intro}Lab job: {job_name}\n<!date^{due_ts}^Due {{date_long_pretty}}|{fallback_ts}>\n_If you are unable to do your job this time, reassign it to someone who can after confirming with them_")
         }
     },
     {
@@ -39,7 +40,7 @@ REMINDER_MESSAGE = [
                     "text": ":white_check_mark: I did this job",
                     "emoji": True
                 },
-                "value": "{job_id}",
+                "value": Format("{job_id}"),
                 "action_id": "labjob-complete"
             },
             {
@@ -49,61 +50,52 @@ REMINDER_MESSAGE = [
                     "text": ":recycle: Reassign this instance",
                     "emoji": True
                 },
-                "value": "{job_id}",
+                "value": Format("{job_id}"),
                 "action_id": "labjob-reassign"
             }
         ]
     }
-]
+])
 
-REMINDER_COMPLETE_MESSAGE = [
+REMINDER_COMPLETE_MESSAGE = ViewTemplate([
     {
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": "Lab job: {job_name} complete!"
+            "text": Format("Lab job: {job_name} complete!")
         }
     }
-]
+])
 
-REMINDER_REASSIGNED_MESSAGE = [
+REMINDER_REASSIGNED_MESSAGE = ViewTemplate([
     {
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": "Lab job: {job_name} reassigned to <@{assignee}>"
+            "text": Format("Lab job: {job_name} reassigned to <@{assignee}>")
         }
     }
-]
+])
 
-def build_reminder_message(job_id: int, job_name: str, due: datetime.datetime):
-    message = copy.deepcopy(REMINDER_MESSAGE)
-    message[0]['text']['text'] = message[0]['text']['text'].format(
+def build_reminder_message(job_id: int, job_name: str, due: datetime.datetime, intro: str = ''):
+    return REMINDER_MESSAGE.render(
+        intro=intro,
         job_name=job_name,
         due_ts=int(due.timestamp()),
-        fallback_ts=f'Due {due.isoformat()}'
+        fallback_ts=f'Due {due.isoformat()}',
+        job_id=job_id
     )
-    message[1]['elements'][0]['value'] = str(job_id)
-    message[1]['elements'][1]['value'] = str(job_id)
-    return message
 
 def build_completed_message(job_name: str, due: datetime.datetime):
-    message = copy.deepcopy(REMINDER_COMPLETE_MESSAGE)
-    message[0]['text']['text'] = message[0]['text']['text'].format(
-        job_name=job_name, due_ts=int(due.timestamp()), fallback_ts=f'Due {due.isoformat()}'
-    )
-    return message
+    return REMINDER_COMPLETE_MESSAGE.render(job_name=job_name)
 
 def build_reassigned_message(job_name: str, assignee: str):
-    message = copy.deepcopy(REMINDER_REASSIGNED_MESSAGE)
-    message[0]['text']['text'] = message[0]['text']['text'].format(
-        job_name=job_name, assignee=assignee
-    )
-    return message
+    return REMINDER_REASSIGNED_MESSAGE.render(job_name=job_name, assignee=assignee)
 
-REASSIGN_MODAL = {
+REASSIGN_MODAL = ViewTemplate({
     "type": "modal",
     "callback_id": "labjob-reassign-modal",
+    "private_metadata": Format("{job_id}"),
     "title": {
         "type": "plain_text",
         "text": "Reassign lab job",
@@ -124,7 +116,7 @@ REASSIGN_MODAL = {
             "type": "section",
             "text": {
                 "type": "mrkdwn",
-                "text": "{lab_job}\n<!date^{due_ts}^Due {{date_long_pretty}}|{fallback_ts}>"
+                "text": Format("{lab_job}\n<!date^{due_ts}^Due {{date_long_pretty}}|{fallback_ts}>")
             }
         },
         {
@@ -152,19 +144,36 @@ REASSIGN_MODAL = {
             }
         }
     ]
-}
+})
 
 def build_reassign_modal(job_id: int, job_name: str, due: datetime.datetime):
-    modal = copy.deepcopy(REASSIGN_MODAL)
-    modal['blocks'][0]['text']['text'] = modal['blocks'][0]['text']['text'].format(
+    return REASSIGN_MODAL.render(
+        job_id=job_id,
         lab_job=job_name,
         due_ts=int(due.timestamp()),
         fallback_ts=f'Due {due.isoformat()}'
     )
-    modal['private_metadata'] = str(job_id)
-    return modal
 
-VIEW_REMINDER_SCHEDULE_MODAL = {
+# A section with an "Edit" button, listing a reminder schedule or a job
+EDIT_ITEM_SECTION = ViewTemplate({
+    "type": "section",
+    "text": {
+        "type": "mrkdwn",
+        "text": Slot('text')
+    },
+    "accessory": {
+        "type": "button",
+        "text": {
+            "type": "plain_text",
+            "text": "Edit",
+            "emoji": True
+        },
+        "value": Format("{item_id}"),
+        "action_id": Slot('action_id')
+    }
+})
+
+VIEW_REMINDER_SCHEDULE_MODAL = ViewTemplate({
     "type": "modal",
     "title": {
         "type": "plain_text",
@@ -178,6 +187,7 @@ VIEW_REMINDER_SCHEDULE_MODAL = {
     },
     "clear_on_close": True,
     "blocks": [
+        Splice('schedule_blocks'),
         {
             "type": "actions",
             "elements": [
@@ -192,35 +202,21 @@ VIEW_REMINDER_SCHEDULE_MODAL = {
             ]
         }
     ]
-}
+})
 
 def build_reminder_schedule_modal(db_con: sqlite3.Connection):
     """Returns the list of reminder schedules"""
 
-    view_modal = copy.deepcopy(VIEW_REMINDER_SCHEDULE_MODAL)
     schedules = db_con.execute("SELECT id, name FROM reminder_schedules").fetchall()
-    view_modal['blocks'] = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": schedule['name']
-            },
-            "accessory": {
-                "type": "button",
-                "text": {
-                    "type": "plain_text",
-                    "text": "Edit",
-                    "emoji": True
-                },
-                "value": f"{schedule['id']}",
-                "action_id": "reminder_schedule-edit"
-            }
-        } for schedule in schedules
-    ] + view_modal['blocks']
-    return view_modal
-
-VIEW_JOBS_MODAL = {
+    return VIEW_REMINDER_SCHEDULE_MODAL.render(schedule_blocks=[
+        EDIT_ITEM_SECTION.render(
+            text=schedule['name'],
+            item_id=schedule['id'],
+            action_id="reminder_schedule-edit"
+        ) for schedule in schedules
+    ])
+
+VIEW_JOBS_MODAL = ViewTemplate({
     "type": "modal",
     "title": {
         "type": "plain_text",
@@ -234,6 +230,7 @@ VIEW_JOBS_MODAL = {
     },
     "clear_on_close": True,
     "blocks": [
+        Splice('job_blocks'),
         {
             "type": "actions",
             "elements": [
@@ -249,42 +246,28 @@ VIEW_JOBS_MODAL = {
             ]
         }
     ]
-}
+})
 
 def build_view_jobs_modal(db_con: sqlite3.Connection):
     """Returns the list of jobs with edit links"""
 
-    view_modal = copy.deepcopy(VIEW_JOBS_MODAL)
-
     jobs = db_con.execute("""
         SELECT template_jobs.id, template_jobs.sort_priority, template_jobs.name, template_jobs.assignee, reminder_schedules.name AS reminder_name
         FROM template_jobs LEFT JOIN reminder_schedules ON template_jobs.reminder_schedule=reminder_schedules.id
         ORDER BY template_jobs.sort_priority DESC
         """
     ).fetchall()
-    view_modal['blocks'] = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f"{job['name']} ({job['reminder_name']} by <@{job['assignee']}>)"
-            },
-            "accessory": {
-                "type": "button",
-                "text": {
-                    "type": "plain_text",
-                    "text": "Edit",
-                    "emoji": True
-                },
-                "value": f"{job['id']}",
-                "action_id": "labjob-edit"
-            }
-        } for job in jobs
-    ] + view_modal['blocks']
-    return view_modal
-
-EDIT_JOB_MODAL = {
+    return VIEW_JOBS_MODAL.render(job_blocks=[
+        EDIT_ITEM_SECTION.render(
+            text=f"{job['name']} ({job['reminder_name']} by <@{job['assignee']}>)",
+            item_id=job['id'],
+            action_id="labjob-edit"
+        ) for job in jobs
+    ])
+
+EDIT_JOB_MODAL = ViewTemplate({
     "callback_id": "labjob-edit-modal",
+    "private_metadata": Format("{job_id};{prev_view}"),
     "title": {
         "type": "plain_text",
         "text": "Edit job"
@@ -305,6 +288,7 @@ EDIT_JOB_MODAL = {
             "element": {
                 "type": "plain_text_input",
                 "action_id": "labjob-nameval",
+                "initial_value": Slot('name'),
                 "placeholder": {
                     "type": "plain_text",
                     "text": "Enter something. Markdown allowed."
@@ -328,7 +312,8 @@ EDIT_JOB_MODAL = {
                     "type": "plain_text",
                     "text": "Select a user"
                 },
-                "action_id": "labjob-assigneeval"
+                "action_id": "labjob-assigneeval",
+                "initial_user": Slot('assignee', optional=True)
             }
         },
         {
@@ -337,7 +322,8 @@ EDIT_JOB_MODAL = {
             "element": {
                 "type": "number_input",
                 "is_decimal_allowed": True,
-                "action_id": "labjob-sort_priorityval"
+                "action_id": "labjob-sort_priorityval",
+                "initial_value": Format("{sort_priority}")
             },
             "label": {
                 "type": "plain_text",
@@ -357,7 +343,8 @@ EDIT_JOB_MODAL = {
                     "type": "plain_text",
                     "text": "Select a reminder schedule"
                 },
-                "options": [],
+                "options": Slot('schedule_options'),
+                "initial_option": Slot('schedule_option', optional=True),
                 "action_id": "labjob-reminder_scheduleval"
             }
         },
@@ -377,7 +364,7 @@ EDIT_JOB_MODAL = {
             "element": {
                 "type": "plain_text_input",
                 "action_id": "labjob-recurrenceval",
-                "initial_value": "FREQ=WEEKLY;INTERVAL=1;BYDAY=MO"
+                "initial_value": Slot('recurrence')
             },
             "label": {
                 "type": "plain_text",
@@ -394,7 +381,7 @@ EDIT_JOB_MODAL = {
                         "text": "Delete lab job",
                     },
                     "style": "danger",
-                    "value": "",
+                    "value": Format("{job_id}"),
                     "action_id": "labjob-delete",
                     "confirm": {
                         "title": {
@@ -418,13 +405,11 @@ EDIT_JOB_MODAL = {
             ]
         }
     ]
-}
+})
 
 def build_edit_job_modal(db_con: sqlite3.Connection, job_id: int, prev_view: str):
     """Returns the edit job modal"""
 
-    edit_modal = copy.deepcopy(EDIT_JOB_MODAL)
-
     job = db_con.execute("SELECT name, sort_priority, reminder_schedule, recurrence, assignee FROM template_jobs WHERE id=? ORDER BY sort_priority", (job_id,)).fetchone()
     schedules = db_con.execute("SELECT id, name FROM reminder_schedules").fetchall()
     schedule_option_map = {schedule['id']: {
@@ -435,24 +420,22 @@ def build_edit_job_modal(db_con: sqlite3.Connection, job_id: int, prev_view: str
         "value": f"{schedule['id']}"
         } for schedule in schedules
     }
-    
-    edit_modal['blocks'][0]['element']['initial_value'] = job['name']
-    if job['assignee'] is not None:
-        edit_modal['blocks'][1]['accessory']['initial_user'] = job['assignee']
-    edit_modal['blocks'][2]['element']['initial_value'] = str(job['sort_priority'])
-    # Fill in reminder schedule options
-    edit_modal['blocks'][3]['accessory']['options'] = list(schedule_option_map.values())
-    if job['reminder_schedule'] is not None:
-        edit_modal['blocks'][3]['accessory']['initial_option'] = schedule_option_map[job['reminder_schedule']]
-    
-    edit_modal['blocks'][6]['element']['initial_value'] = job['recurrence']
-    edit_modal['blocks'][7]['elements'][0]['value'] = str(job_id)
 
-    edit_modal['private_metadata'] = f'{job_id};{prev_view}'
-    return edit_modal
+    return EDIT_JOB_MODAL.render(
+        job_id=job_id,
+        prev_view=prev_view,
+        name=job['name'],
+        assignee=job['assignee'],
+        sort_priority=job['sort_priority'],
+        # Fill in reminder schedule options
+        schedule_options=list(schedule_option_map.values()),
+        schedule_option=schedule_option_map.get(job['reminder_schedule']),
+        recurrence=job['recurrence']
+    )
 
-EDIT_REMINDER_SCHEDULE_MODAL = {
+EDIT_REMINDER_SCHEDULE_MODAL = ViewTemplate({
     "callback_id": "reminder_schedule-edit-modal",
+    "private_metadata": Format("{schedule_id};{source_view}"),
     "title": {
         "type": "plain_text",
         "text": "Edit reminder schedule",
@@ -473,6 +456,7 @@ EDIT_REMINDER_SCHEDULE_MODAL = {
             "element": {
                 "type": "plain_text_input",
                 "action_id": "reminder_schedule-nameval",
+                "initial_value": Slot('name'),
                 "placeholder": {
                     "type": "plain_text",
                     "text": "Enter a short description"
@@ -498,7 +482,8 @@ EDIT_REMINDER_SCHEDULE_MODAL = {
             "block_id": "reminder_schedule-schedule",
             "element": {
                 "type": "plain_text_input",
-                "action_id": "reminder_schedule-scheduleval"
+                "action_id": "reminder_schedule-scheduleval",
+                "initial_value": Slot('reminders')
             },
             "label": {
                 "type": "plain_text",
@@ -515,7 +500,7 @@ EDIT_REMINDER_SCHEDULE_MODAL = {
                         "text": "Delete reminder schedule",
                     },
                     "style": "danger",
-                    "value": "",
+                    "value": Format("{schedule_id}"),
                     "action_id": "reminder_schedule-delete",
                     "confirm": {
                         "title": {
@@ -539,22 +524,20 @@ EDIT_REMINDER_SCHEDULE_MODAL = {
             ]
         }
     ]
-}
+})
 
 def build_edit_reminder_schedule_modal(db_con: sqlite3.Connection, reminder_schedule_id: int, source_view: str):
     """Returns the edit job modal"""
 
-    edit_modal = copy.deepcopy(EDIT_REMINDER_SCHEDULE_MODAL)
-
     schedule = db_con.execute("SELECT id, name, reminders FROM reminder_schedules WHERE id=?", (reminder_schedule_id,)).fetchone()
-    
-    edit_modal['blocks'][0]['element']['initial_value'] = schedule['name']
-    edit_modal['blocks'][3]['element']['initial_value'] = schedule['reminders']
-    edit_modal['blocks'][4]['elements'][0]['value'] = str(reminder_schedule_id)
-    edit_modal['private_metadata'] = f'{reminder_schedule_id};{source_view}'
-    return edit_modal
+    return EDIT_REMINDER_SCHEDULE_MODAL.render(
+        schedule_id=reminder_schedule_id,
+        source_view=source_view,
+        name=schedule['name'],
+        reminders=schedule['reminders']
+    )
 
-JOB_HOME = [
+JOB_HOME = ViewTemplate([
     {
         "type": "header",
         "text": {
@@ -566,7 +549,7 @@ JOB_HOME = [
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": "There are currently {num_jobs} lab jobs defined."
+            "text": Format("There are currently {num_jobs} lab jobs defined.")
         }
     },
     {
@@ -592,14 +575,16 @@ JOB_HOME = [
             }
         ]
     },
-    {
-        "type": "section",
-        "text": {
-            "type": "mrkdwn",
-            "text": "No pending lab jobs"
-        }
+    Splice('pending_blocks')
+])
+
+MRKDWN_SECTION = ViewTemplate({
+    "type": "section",
+    "text": {
+        "type": "mrkdwn",
+        "text": Slot('text')
     }
-]
+})
 
 
 module_config = {}
@@ -611,7 +596,7 @@ def register_module(config):
     module_config.update(config)
 
     # Init database connection
-    db_con = sqlite3.connect('labjobs.db')
+    db_con = module_config['storage'].connect('labjobs.db')
     with db_con:
         db_con.execute('''
         CREATE TABLE IF NOT EXISTS reminder_schedules (
@@ -723,14 +708,15 @@ def send_reminders(db_con:sqlite3.Connection, new_jobs: List[int]):
 
         if reminder_time_delta > current_reminder_delay:
             to_remind_ids.append(job['id'])
-    # Send messages
+    # Send messages. Reminders can wait behind more urgent Slack calls.
     for job_id in to_remind_ids:
         job = db_con.execute("SELECT name, due_ts, assignee FROM jobs WHERE id=?", (job_id,)).fetchone()
-        new_message = module_config['slack_client'].chat_postMessage(
-            channel=job['assignee'],
-            blocks=build_reminder_message(job_id, job['name'], datetime.datetime.fromisoformat(job['due_ts'])),
-            text=f"Reminder: {job['name']}"
-        )
+        with prioritized(PRIORITY_LOW):
+            new_message = module_config['slack_client'].chat_postMessage(
+                channel=job['assignee'],
+                blocks=build_reminder_message(job_id, job['name'], datetime.datetime.fromisoformat(job['due_ts'])),
+                text=f"Reminder: {job['name']}"
+            )
 
         # Track the new message and set the last reminder timestamp properly
         db_con.execute(
@@ -740,66 +726,60 @@ def send_reminders(db_con:sqlite3.Connection, new_jobs: List[int]):
         db_con.execute("UPDATE jobs SET last_reminder_ts=? WHERE id=?", (now.isoformat(),job_id))
     db_con.commit()
 
-@loader.timer
+# Never run two reminder sweeps at once, as this would send duplicate reminders
+# Runs on every fifth minute, so reminders go out at predictable times
+@loader.timer(max_instances=1, overlap='skip', every=5 * 60)
 def check_jobs_reminders(_):
     try:
-        db_con = sqlite3.connect('labjobs.db')
-        db_con.row_factory = sqlite3.Row
+        db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
         new_jobs = add_new_jobs(db_con)
+        if len(new_jobs) > 0:
+            module_config['hometab_update']('labjobs')
         send_reminders(db_con, new_jobs)
         db_con.close()
     except (Exception, OSError) as e:
         stacktrace = '\n'.join(traceback.TracebackException.from_exception(e).format())
         module_config['logger'](f'Got exception while running reminders: {e}\nStacktrace: {stacktrace}')
-    return 60 * 5
 
-@loader.home_tab
+@loader.home_tab(keys=['labjobs'])
 def lab_job_home_tab(_user):
     # Ignores the user, displaying the same thing
     # for everyone
-    home_tab_blocks = copy.deepcopy(JOB_HOME)
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     n_jobs = len(db_con.execute("SELECT id FROM template_jobs").fetchall())
 
     due_jobs = db_con.execute("SELECT name, assignee FROM jobs WHERE done=0").fetchall()
 
-    home_tab_blocks[1]['text']['text'] = home_tab_blocks[1]['text']['text'].format(num_jobs=n_jobs)
-    block_idx = 3
-    accumulated_text = '*Pending jobs*:\n'
+    # Split the pending jobs over several sections, as section text is limited
+    pending_texts = ['No pending lab jobs']
     if len(due_jobs) > 0:
+        pending_texts = []
+        accumulated_text = '*Pending jobs*:\n'
         for job in due_jobs:
             accumulated_text += f'{job["name"]} (<@{job["assignee"]}>)\n'
 
             if len(accumulated_text) > 2500:
-                home_tab_blocks[block_idx]['text']['text'] = accumulated_text
+                pending_texts.append(accumulated_text)
                 accumulated_text = ' '
-                block_idx += 1
-                home_tab_blocks.append(
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": "."
-                        }
-                    }
-                )
-        home_tab_blocks[block_idx]['text']['text'] = accumulated_text
+        pending_texts.append(accumulated_text)
 
     db_con.close()
-    return home_tab_blocks
+    return JOB_HOME.render(
+        num_jobs=n_jobs,
+        pending_blocks=[MRKDWN_SECTION.render(text=text) for text in pending_texts]
+    )
 
 @loader.slack.action({"action_id": "labjob-complete"})
-def complete_labjob(ack, body, client):
-    """Completes the given lab job, updating all messages."""
-    ack()
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+@loader.deferred
+def complete_labjob(body, client):
+    """Completes the given lab job, updating all messages (after acking)."""
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     job_id = int(body['actions'][0]['value'])
     db_con.execute("UPDATE jobs SET done=1 WHERE id=?", (job_id,))
     db_con.commit()
+    module_config['hometab_update']('labjobs')
     job = db_con.execute("SELECT name, due_ts FROM jobs WHERE id=?", (job_id,)).fetchone()
     reminders = db_con.execute("SELECT channel, slack_message_ts FROM reminder_messages WHERE job_id=?", (job_id,)).fetchall()
     for reminder in reminders:
@@ -815,8 +795,7 @@ def complete_labjob(ack, body, client):
 def show_reassign_modal(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     job_id = int(body['actions'][0]['value'])
     job = db_con.execute("SELECT name, due_ts FROM jobs WHERE id=?", (job_id,)).fetchone()
 
@@ -834,10 +813,10 @@ def reassign_labjob(ack, body, client, view):
     new_assignee = view['state']['values']['userselect']['userselectval']['selected_user']
     job_id = int(view['private_metadata'])
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     db_con.execute("UPDATE jobs SET assignee=? WHERE id=?", (new_assignee, job_id))
     db_con.commit()
+    module_config['hometab_update']('labjobs')
     # Send message updates
     job = db_con.execute("SELECT name, due_ts, assignee FROM jobs WHERE id=?", (job_id,)).fetchone()
     reminders = db_con.execute("SELECT channel, slack_message_ts FROM reminder_messages WHERE job_id=?", (job_id,)).fetchall()
@@ -849,8 +828,8 @@ def reassign_labjob(ack, body, client, view):
             text=f'Lab job {job["name"]} reassigned'
         )
 
-    block_message = build_reminder_message(job_id, job['name'], datetime.datetime.fromisoformat(job['due_ts']))
-    block_message[0]['text']['text'] = "Job reassigned to you.\n" + block_message[0]['text']['text']
+    block_message = build_reminder_message(job_id, job['name'], datetime.datetime.fromisoformat(job['due_ts']),
+                                           intro="Job reassigned to you.\n")
     new_message = module_config['slack_client'].chat_postMessage(
         channel=job['assignee'],
         blocks=block_message,
@@ -869,8 +848,7 @@ def reassign_labjob(ack, body, client, view):
 def add_reminder_schedule(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     db_con.execute("""
         INSERT INTO reminder_schedules (name, reminders)
@@ -889,8 +867,7 @@ def add_reminder_schedule(ack, body, client):
 def edit_reminder_schedule(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     client.views_push(
         view=build_edit_reminder_schedule_modal(db_con, int(body['actions'][0]['value']), body['container']['view_id']),
         trigger_id=body['trigger_id']
@@ -907,8 +884,7 @@ def edit_reminder_schedule_modal(ack, body, client, view):
     name = view['state']['values']['reminder_schedule-name']['reminder_schedule-nameval']['value']
     reminders = view['state']['values']['reminder_schedule-schedule']['reminder_schedule-scheduleval']['value']
     module_config['logger'](f'Schedule update: {name},{reminders}')
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     db_con.execute("""
         UPDATE reminder_schedules
         SET name=?, reminders=?
@@ -928,8 +904,7 @@ def delete_reminder_schedule(ack, body, client):
     
     # NULL out any template jobs and jobs that reference this schedule
     schedule_id = int(body['actions'][0]['value'])
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     db_con.execute("UPDATE template_jobs SET reminder_schedule=NULL WHERE reminder_schedule=?", (schedule_id,))
     db_con.execute("UPDATE jobs SET reminder_schedule=NULL WHERE reminder_schedule=?", (schedule_id,))
     db_con.execute("DELETE FROM reminder_schedules WHERE id=?", (schedule_id,))
@@ -946,14 +921,14 @@ def delete_reminder_schedule(ack, body, client):
 def add_labjob(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     db_con.execute("""
         INSERT INTO template_jobs (sort_priority, name, last_generated_ts, recurrence)
         VALUES (0, "Unnamed", "1970-01-01", "FREQ=WEEKLY;INTERVAL=1;BYDAY=MO")
     """)
     db_con.commit()
+    module_config['hometab_update']('labjobs')
 
     client.views_update(
         view=build_view_jobs_modal(db_con),
@@ -966,8 +941,7 @@ def add_labjob(ack, body, client):
 def edit_labjob(ack, body, client):
     ack()
     
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     client.views_push(
         view=build_edit_job_modal(db_con, int(body['actions'][0]['value']), body['container']['view_id']),
         trigger_id=body['trigger_id']
@@ -987,8 +961,7 @@ def edit_labjob(ack, body, client, view):
     reminder_schedule = int(view['state']['values']['labjob-reminder_schedule']['labjob-reminder_scheduleval']['selected_option']['value'])
     recurrence = view['state']['values']['labjob-recurrence']['labjob-recurrenceval']['value']
     module_config['logger'](f'Job update: {name},{assignee},{sort_priority},{reminder_schedule},{recurrence}')
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     db_con.execute("""
         UPDATE template_jobs
         SET sort_priority=?, name=?, reminder_schedule=?, recurrence=?, assignee=?
@@ -1007,10 +980,10 @@ def delete_labjob(ack, body, client):
     ack()
 
     labjob_id = int(body['actions'][0]['value'])
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
     db_con.execute("DELETE FROM template_jobs WHERE id=?", (labjob_id,))
     db_con.commit()
+    module_config['hometab_update']('labjobs')
 
     client.views_update(
         view=build_view_jobs_modal(db_con),
@@ -1022,8 +995,7 @@ def delete_labjob(ack, body, client):
 def show_labjob_view_modal(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     client.views_open(
         view=build_view_jobs_modal(db_con),
@@ -1036,8 +1008,7 @@ def show_labjob_view_modal(ack, body, client):
 def show_schedule_view_modal(ack, body, client):
     ack()
 
-    db_con = sqlite3.connect('labjobs.db')
-    db_con.row_factory = sqlite3.Row
+    db_con = module_config['storage'].connect('labjobs.db', row_factory=sqlite3.Row)
 
     client.views_open(
         view=build_reminder_schedule_modal(db_con),
@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
 from typing import Optional
-import copy
 import csv
 import pytz
 import uuid
@@ -10,11 +9,14 @@ from fastapi import HTTPException
 from pydantic import BaseModel
 
 from labbot.module_loader import ModuleLoader
+from labbot.views import ViewTemplate, Slot
 
 ETC = pytz.timezone('America/New_York')
 module_config = {'client_key': '000000'}
 
-label_queue = []
+# Queued label jobs live in the shared store (module_config['store']) under
+# this name, so that any worker process can dequeue them.
+LABEL_QUEUE = 'label_queue'
 
 loader = ModuleLoader()
 
@@ -25,7 +27,7 @@ def register_module(config):
     # Return
     return loader
 
-label_model = {
+label_model = ViewTemplate({
     "type": "modal",
     "title": {
         "type": "plain_text",
@@ -70,7 +72,7 @@ label_model = {
             "block_id": "date",
             "element": {
                 "type": "datepicker",
-                "initial_date": "1990-04-28",
+                "initial_date": Slot('initial_date'),
                 "placeholder": {
                     "type": "plain_text",
                     "text": "Select a date",
@@ -187,7 +189,7 @@ label_model = {
                 "action_id": "labels-input",
                 "placeholder": {
                     "type": "plain_text",
-                    "text": "pKG_number, description",
+                    "text": Slot('box_placeholder'),
                     "emoji": True
                 }
             },
@@ -198,11 +200,12 @@ label_model = {
             }
         }
     ]
-}
+})
 
-print_status_modal = {
+print_status_modal = ViewTemplate({
 	"type": "modal",
     "private_metadata": "",
+    "external_id": Slot('external_id'),
     "callback_id": "print_status_view_submit",
 	"title": {
 		"type": "plain_text",
@@ -223,24 +226,23 @@ print_status_modal = {
 			"type": "section",
 			"text": {
 				"type": "mrkdwn",
-				"text": ""
+				"text": Slot('status_text')
 			}
 		}
         ]
-}
+})
 
-def build_modal_view(*, box_placeholder:Optional[str]=None):
-    view_copy = copy.deepcopy(label_model)
-    if box_placeholder is not None:
-        view_copy['blocks'][6]['element']['placeholder']['text'] = box_placeholder
-    return view_copy
+def build_modal_view(*, box_placeholder:Optional[str]=None, initial_date:str='1990-04-28'):
+    return label_model.render(
+        box_placeholder=box_placeholder if box_placeholder is not None else 'pKG_number, description',
+        initial_date=initial_date
+    )
 
 def build_status_view(*, external_id:str, status_text:Optional[str]=None):
-    view_copy = copy.deepcopy(print_status_modal)
-    view_copy['external_id'] = external_id
-    if status_text is not None:
-        view_copy['blocks'][0]['text']['text'] = status_text
-    return view_copy
+    return print_status_modal.render(
+        external_id=external_id,
+        status_text=status_text if status_text is not None else ''
+    )
 
 @loader.slack.shortcut("print_labels")
 def main_tracker(ack, shortcut, client):
@@ -252,8 +254,7 @@ def main_tracker(ack, shortcut, client):
     now_dt = datetime.now(ETC)
 
     # Set the default label date to today
-    view_model = build_modal_view()
-    view_model["blocks"][2]["element"]["initial_date"] = now_dt.strftime('%Y-%m-%d')
+    view_model = build_modal_view(initial_date=now_dt.strftime('%Y-%m-%d'))
 
     # Open the view
     client.views_open(
@@ -387,7 +388,7 @@ def handle_form_submission(ack, body, client, view):
     
     # Add to queue
     external_id = str(uuid.uuid4())
-    label_queue.append({
+    module_config['store'].queue_push(LABEL_QUEUE, {
         'external_id': external_id,
         'label_count': n_copies,
         'labels': converted_labels
@@ -404,17 +405,19 @@ def dequeue_labels(req:DequeueRequest):
     if (req.token != module_config['token']):
         raise HTTPException(status_code=401, detail="Invalid auth token")
 
-    # Long poll for 5 minutes
+    # Long poll for 5 minutes, or until LabBot starts draining for a restart.
+    # Labels stay queued, and the client polls again once LabBot is back.
     for _ in range(60 * 5 * 2):
-        try:
-            labels = label_queue.pop(0)
+        if module_config['draining']():
+            break
+        labels = module_config['store'].queue_pop(LABEL_QUEUE)
+        if labels is not None:
             module_config['slack_client'].views_update(
                 external_id = labels['external_id'],
                 view=build_status_view(status_text="Sent to label client...", external_id=labels['external_id'])
             )
             return labels
-        except IndexError:
-            time.sleep(0.5)
+        time.sleep(0.5)
     return {}
 
 class StatusUpdate(BaseModel):
@@ -1,10 +1,10 @@
-from copy import deepcopy
 from datetime import datetime
 import subprocess
 import pytz
 import re
 
 from labbot.module_loader import ModuleLoader
+from labbot.views import ViewTemplate, Slot
 
 ETC = pytz.timezone('America/New_York')
 
@@ -20,17 +20,20 @@ def register_module(config):
         raise RuntimeError("Must specify the path to the setup.py file, relative to the runtime working directory!")
     return loader
 
+# Recorded once so that the home tab only changes when something else does;
+# unchanged home tabs are not re-published.
+start_time = datetime.now(ETC)
+
 @loader.home_tab
 def dev_tools_home_tab(user):
     # Ignores the user, displaying the same thing
     # for everyone
-    now = datetime.now(ETC)
     return [{
         "type": "section",
         "text": {
                 "type": "mrkdwn",
-                "text": "Last updated _{}_".format(
-                    now.strftime('%B %e, %l:%M:%S %p'))
+                "text": "Running since _{}_".format(
+                    start_time.strftime('%B %e, %l:%M:%S %p'))
         },
         "accessory": {
                 "type": "button",
@@ -80,31 +83,33 @@ def validate_git_commits(branch_name):
 
 "git diff HEAD test_branch --exit-code -s test.txt"
 @loader.slack.action('commit_validate')
-def validate_commit(ack, body, client):
+@loader.deferred
+def validate_commit(body, client):
     """
-    Checks that the commit can be pulled.
+    Checks that the commit can be pulled. Runs `git fetch`, so it is
+    deferred until after the action is acknowledged.
     """
-    ack()
-
     branch_name = body['view']['state']['values']['branch_selection']['branch_name']['value']
 
-    # Update the view to be updated
-    view = deepcopy(dev_tools_view)
-    view['blocks'][2]['elements'][0]['text']['text'] = ':hourglass: Validating commit...'
+    # Update the view to be updated, keeping its status text
+    view = dev_tools_view.render(
+            status=body['view']['blocks'][0]['text']['text'],
+            validate_text=':hourglass: Validating commit...')
     first_update = client.views_update(
             view_id=body['view']['id'],
             hash=body['view']['hash'],
             view=view)
     if validate_git_commits(branch_name):
-        view = deepcopy(dev_tools_validated)
-        view['blocks'][0]['text']['text'] = 'Updating `{}` -> `{}`'.format(
-                get_branch(),
-                get_branch('{}/{}'.format(module_config['remote_name'],branch_name)))
-        view['private_metadata'] = branch_name
+        view = dev_tools_validated.render(
+                status='Updating `{}` -> `{}`'.format(
+                    get_branch(),
+                    get_branch('{}/{}'.format(module_config['remote_name'],branch_name))),
+                branch_name=branch_name)
     else:
-        view = deepcopy(dev_tools_view)
-        view['blocks'][0]['text']['text'] = ('Branch/tag `{}` invalid!\nCheck the name of the branch/tag. If you modified the `setup.py` file (e.g. adding new dependencies)' +
-        ' then you need to reload the server manually after doing `pip install -e .`').format(branch_name)
+        view = dev_tools_view.render(
+                status=('Branch/tag `{}` invalid!\nCheck the name of the branch/tag. If you modified the `setup.py` file (e.g. adding new dependencies)' +
+                ' then you need to reload the server manually after doing `pip install -e .`').format(branch_name),
+                validate_text='Validate commit')
 
     client.views_update(
         view_id=body['view']['id'],
@@ -142,6 +147,27 @@ def handle_shutdown_request(ack, body, client):
             trigger_id=body['trigger_id'],
             view=confirm_modal)
 
+@loader.slack.action('module_reload')
+def handle_module_reload(ack, body, client):
+    """
+    Hot-reloads a single module, without restarting LabBot.
+    """
+    ack()
+
+    module_name = body['view']['state']['values']['module_selection']['module_name']['value']
+    if not module_name:
+        status = 'Enter the name of a module to reload.'
+    elif module_name not in module_config['loaded_modules']():
+        status = 'Module `{}` is not loaded!'.format(module_name)
+    else:
+        try:
+            status = module_config['reload_module'](module_name)
+        except Exception as e:
+            status = 'Could not reload `{}`:\n```{}```'.format(module_name, e)
+    client.views_update(
+        view_id=body['view']['id'],
+        view=dev_tools_view.render(status=status, validate_text='Validate commit'))
+
 @loader.slack.action('open_dev_tools')
 def open_dev_tools(ack, body, client):
     """
@@ -149,13 +175,17 @@ def open_dev_tools(ack, body, client):
     """
     ack()
 
-    view = dev_tools_view
-    view['blocks'][0]['text']['text'] = 'Current HEAD: `{}`'.format(get_branch())
+    status = 'Current HEAD: `{}`'.format(get_branch())
+    if 'status_report' in module_config:
+        status += '\nStatus:\n```{}```'.format(
+                module_config['status_report']())
     client.views_open(
             trigger_id = body['trigger_id'],
-            view=view)
+            view=dev_tools_view.render(status=status, validate_text='Validate commit'))
 
-dev_tools_view = {
+# The dev tools modal. `status` is the text at the top, `validate_text` the
+# label of the validate button.
+dev_tools_view = ViewTemplate({
 	"type": "modal",
         "private_metadata": "",
         "callback_id": "reload_modal",
@@ -174,7 +204,7 @@ dev_tools_view = {
 			"type": "section",
 			"text": {
 				"type": "mrkdwn",
-				"text": "Current HEAD: `{}`"
+				"text": Slot('status')
 			}
 		},
 		{
@@ -198,7 +228,7 @@ dev_tools_view = {
 					"type": "button",
 					"text": {
 						"type": "plain_text",
-						"text": "Validate commit"
+						"text": Slot('validate_text')
 					},
 					"action_id": "commit_validate"
 				},
@@ -213,13 +243,40 @@ dev_tools_view = {
 					"action_id": "shutdown_button",
 				}
 			]
+		},
+		{
+			"type": "input",
+			"element": {
+				"type": "plain_text_input",
+				"action_id": "module_name"
+			},
+			"label": {
+				"type": "plain_text",
+				"text": "Hot-reload module:",
+				"emoji": True
+			},
+                        "block_id": "module_selection",
+                        "optional": True
+		},
+		{
+			"type": "actions",
+			"elements": [
+				{
+					"type": "button",
+					"text": {
+						"type": "plain_text",
+						"text": "Reload module"
+					},
+					"action_id": "module_reload"
+				}
+			]
 		}
 	]
-}
+})
 
-dev_tools_validated = {
+dev_tools_validated = ViewTemplate({
 	"type": "modal",
-        "private_metadata": "",
+        "private_metadata": Slot('branch_name'),
         "callback_id": "validated_reload_modal",
 	"title": {
 		"type": "plain_text",
@@ -236,7 +293,7 @@ dev_tools_validated = {
 			"type": "section",
 			"text": {
 				"type": "mrkdwn",
-				"text": "Current HEAD: `{}`"
+				"text": Slot('status')
 			}
 		},
 		{
@@ -276,7 +333,7 @@ dev_tools_validated = {
 			]
 		}
 	]
-}
+})
 confirm_modal = {
 	"type": "modal",
         "private_metadata": "",
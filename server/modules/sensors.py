@@ -2,6 +2,8 @@
 Module that tracks various in-lab sensors using MQTT and iMonnit.
 """
 from labbot.module_loader import ModuleLoader
+from labbot.slack_client import prioritized, PRIORITY_HIGH
+from labbot.views import ViewTemplate, Splice, Format
 import fastapi 
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
@@ -10,7 +12,6 @@ import sqlite3
 import secrets
 import datetime
 import collections
-import copy
 import functools
 import time
 
@@ -73,7 +74,7 @@ def register_module(config):
     
     
     # Init database connection
-    db_con = sqlite3.connect('sensors.db')
+    db_con = module_config['storage'].connect('sensors.db')
     with db_con:
         db_con.execute('''
         CREATE TABLE IF NOT EXISTS sensors (
@@ -132,6 +133,9 @@ def register_module(config):
 
 imonnit_security = HTTPBasic()
 
+readings_counter = loader.counter(
+        'labbot_sensors_readings_total', 'Sensor readings received from iMonnit.', ('sensor',))
+
 @loader.fastapi.post("/imonnit_endpoint")
 def imonnit_push(message: MonnitMessage, credentials: HTTPBasicCredentials = fastapi.Depends(imonnit_security)):
     if not (
@@ -143,7 +147,7 @@ def imonnit_push(message: MonnitMessage, credentials: HTTPBasicCredentials = fas
             headers={"WWW-Authenticate": "Basic"}
         )
     
-    db_con = sqlite3.connect('sensors.db')
+    db_con = module_config['storage'].connect('sensors.db')
     with db_con:
         for s_message in message.sensorMessages:
             # See if sensor is already in database. If not, add it as a 
@@ -163,6 +167,7 @@ def imonnit_push(message: MonnitMessage, credentials: HTTPBasicCredentials = fas
                 float(s_message.batteryLevel)
             ))
             cursor.close()
+            readings_counter.inc(sensor=s_message.sensorName)
     check_status_alerts(db_con)
     db_con.close()
     return {'success': True}
@@ -222,17 +227,17 @@ def check_status_alerts(db_con:sqlite3.Connection, perform_hometab_update:bool=T
         slack_alert(db_con, k, v)
 
     if perform_hometab_update:
-        module_config['hometab_update']()
+        module_config['hometab_update']('sensors')
     
     return status_dict
 
 
-BASE_ALERT_MESSAGE = [
+BASE_ALERT_MESSAGE = ViewTemplate([
     {
         "type": "section",
         "text": {
             "type": "mrkdwn",
-            "text": "{at_channel} Sensor *{sensor_name}* {status_phrase}\t<{home_tab_url}|View dashboard>"
+            "text": Format("{at_channel} Sensor *{sensor_name}* {status_phrase}\t<{home_tab_url}|View dashboard>")
         }
     },
     {
@@ -241,15 +246,15 @@ BASE_ALERT_MESSAGE = [
             {
                 "type": "mrkdwn",
                 # TODO: actually fill in this stuff
-                "text": "*Recent measurements:*\n{readings}"
+                "text": Format("*Recent measurements:*\n{readings}")
             },
             {
                 "type": "mrkdwn",
-                "text": "{is_resolved}\n{resolved_reading}"
+                "text": Format("{is_resolved}\n{resolved_reading}")
             }
         ]
     }
-]
+])
 
 def measurement_to_str(measurement: Measurement) -> str:
     return f'{measurement.measurement}C _(<!date^{int(measurement.timestamp.timestamp())}^{{date_short_pretty}}, {{time}}|{measurement.timestamp.isoformat()}>)_'
@@ -266,37 +271,26 @@ def measurements_to_str(measurements: List[Measurement], max_n=10) -> str:
 
 
 def build_alert_message(sensor_name: str, sensor_status: SensorStatus, old_status: int):
-    message = copy.deepcopy(BASE_ALERT_MESSAGE)
     if sensor_status.overall != old_status:
         # Alert is over
-        message[0]['text']['text'] = message[0]['text']['text'].format(
+        return BASE_ALERT_MESSAGE.render(
             at_channel='',
             sensor_name=sensor_name,
             status_phrase='was alarming.' if old_status == 2 else 'previously missed heartbeat check-ins.',
-            home_tab_url=module_config['home_tab_url']
-        )
-        message[1]['fields'][0]['text'] = message[1]['fields'][0]['text'].format(
-            readings=measurements_to_str(sensor_status.measurements[1:])
-        )
-        message[1]['fields'][1]['text'] = message[1]['fields'][1]['text'].format(
+            home_tab_url=module_config['home_tab_url'],
+            readings=measurements_to_str(sensor_status.measurements[1:]),
             is_resolved='*Resolved by:*',
             resolved_reading = measurement_to_str(sensor_status.measurements[0])
         )
-    else:
-        message[0]['text']['text'] = message[0]['text']['text'].format(
-            at_channel='' if sensor_status.overall == 1 else '<!channel>',
-            sensor_name=sensor_name,
-            status_phrase='is alarming!' if sensor_status.overall == 2 else 'is missing heartbeat check-ins!',
-            home_tab_url=module_config['home_tab_url']
-        )
-        message[1]['fields'][0]['text'] = message[1]['fields'][0]['text'].format(
-            readings=measurements_to_str(sensor_status.measurements)
-        )
-        message[1]['fields'][1]['text'] = message[1]['fields'][1]['text'].format(
-            is_resolved='',
-            resolved_reading = ''
-        )
-    return message
+    return BASE_ALERT_MESSAGE.render(
+        at_channel='' if sensor_status.overall == 1 else '<!channel>',
+        sensor_name=sensor_name,
+        status_phrase='is alarming!' if sensor_status.overall == 2 else 'is missing heartbeat check-ins!',
+        home_tab_url=module_config['home_tab_url'],
+        readings=measurements_to_str(sensor_status.measurements),
+        is_resolved='',
+        resolved_reading = ''
+    )
 
 def slack_alert(db_con, sensor_name: str, sensor_status: SensorStatus) -> None:
     """
@@ -304,7 +298,8 @@ def slack_alert(db_con, sensor_name: str, sensor_status: SensorStatus) -> None:
     the status message.
     """
     now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    with db_con:
+    # Alerts go ahead of other queued Slack calls
+    with db_con, prioritized(PRIORITY_HIGH):
         sensor_id = db_con.execute("SELECT id FROM sensors WHERE name=?;", (sensor_name,)).fetchone()[0]
         # Check to see if there is an inflight item
         inflight = db_con.execute("SELECT id, status, slack_ts FROM alerts WHERE sensor=? AND inflight=1 LIMIT 1", (sensor_id,)).fetchone()
@@ -349,15 +344,16 @@ def slack_alert(db_con, sensor_name: str, sensor_status: SensorStatus) -> None:
                 now,
             ))
         
-@loader.timer
+# If a check is still running when the next is due, run one more check afterwards
+@loader.timer(overlap='coalesce')
 def status_updates(_):
-    db_con = sqlite3.connect('sensors.db')
+    db_con = module_config['storage'].connect('sensors.db')
     check_status_alerts(db_con)
     db_con.close()
     return 60 * 5
 
 
-BASE_HOME_TAB_MODEL = [
+BASE_HOME_TAB_MODEL = ViewTemplate([
     {
         "type": "header",
         "text": {
@@ -367,8 +363,9 @@ BASE_HOME_TAB_MODEL = [
     },
     {
         "type": "divider"
-    }
-]
+    },
+    Splice('sensor_blocks')
+])
 
 
 
@@ -418,12 +415,12 @@ def generate_sensor_status_item(sensor_name: str, status: int, timestamp:datetim
         #}
     }
 
-@loader.home_tab
+@loader.home_tab(keys=['sensors'])
 def dev_tools_home_tab(user):
     # Ignores the user, displaying the same thing
     # for everyone
-    home_tab_blocks = BASE_HOME_TAB_MODEL.copy()
-    db_con = sqlite3.connect('sensors.db')
+    sensor_blocks = []
+    db_con = module_config['storage'].connect('sensors.db')
     status_dict = check_status_alerts(db_con, False) # prevent infinite loop in home tab
     for id, name in db_con.execute("SELECT id, name FROM sensors WHERE type=0"):
         cursor = db_con.cursor()
@@ -433,7 +430,7 @@ def dev_tools_home_tab(user):
             timestamp = datetime.datetime.fromisoformat(row[0])
             temp = float(row[1])
             if name in status_dict:
-                home_tab_blocks.append(generate_sensor_status_item(name, status_dict[name].overall, timestamp, temp))
+                sensor_blocks.append(generate_sensor_status_item(name, status_dict[name].overall, timestamp, temp))
         cursor.close()
     db_con.close()
-    return home_tab_blocks
+    return BASE_HOME_TAB_MODEL.render(sensor_blocks=sensor_blocks)
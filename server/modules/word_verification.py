@@ -40,7 +40,7 @@ def check_for_bibliography(xml):
     Boolean:
         True if a bibliography exists, False otherwise
     """
-    for elem in root.iter('{*}instrText'):
+    for elem in xml.iter('{*}instrText'):
         if 'ADDIN ZOTERO_BIBL' in elem.text:
             return True
     return False
@@ -69,7 +69,7 @@ def scan_for_superscripts(xml):
     inside_superscript = False
     last_superscript_parent = None
     text_context = []
-    for elem in root.iter():
+    for elem in xml.iter():
         # Check for field code
         if 'fldChar' in elem.tag:
             for key, val in elem.attrib.items():
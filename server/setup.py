@@ -13,5 +13,7 @@ setup(
                           'python-multipart', 'pytz',
                           'slack_bolt', 'uvloop', 'paho-mqtt',
                           'rsa', 'python-dateutil', 'durations',
-                          'google-api-python-client', 'google-auth-httplib2', 'google-auth-oauthlib'],
+                          'google-api-python-client', 'google-auth-httplib2', 'google-auth-oauthlib',
+                          'slack_sdk'],
+        extras_require={'async': ['aiohttp'], 'fast': ['orjson']},
         zip_safe=True)
@@ -0,0 +1,683 @@
+"""
+Micro-benchmarks of module hot paths, on synthetic data.
+
+Each benchmark builds its data in a temporary directory (SQLite databases,
+CSV payloads, .docx files), then times one call of the function under test
+a number of times, resetting the data between runs. Slack calls go to a
+local stand-in client that answers instantly, so only LabBot's own work is
+measured.
+
+The views.* benchmarks build LabBot's largest modals and home tab and send
+them through the real Slack client to tests/fake_slack.py's fake Slack,
+reporting how much of each call is spent rendering the view and encoding
+it as JSON (with labbot.fastjson and with the json module).
+
+Results can be written as JSON and compared against an earlier run, e.g.
+before and after a change:
+
+    python tests/benchmark.py --json before.json
+    git checkout my-branch
+    python tests/benchmark.py --json after.json --compare before.json
+
+--scale multiplies every data size, e.g. --scale 0.1 for a quick run.
+Benchmarks whose module cannot be imported here (e.g. lxml is missing for
+word_verification) are reported as skipped.
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+import zipfile
+
+SERVER_DIR = pathlib.Path(__file__).resolve().parent.parent / 'server'
+sys.path.insert(0, str(SERVER_DIR))
+
+parser = argparse.ArgumentParser(description='Benchmark LabBot module hot paths')
+parser.add_argument('--only', nargs='+', default=None, help='Benchmarks to run (default: all)')
+parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+parser.add_argument('--scale', type=float, default=1.0, help='Multiplier applied to every data size')
+parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data')
+parser.add_argument('--json', default=None, help='Write the results to this file as JSON')
+parser.add_argument('--compare', default=None, help='A JSON file from an earlier run to compare against')
+parser.add_argument('--threshold', type=float, default=0.10,
+        help='Relative slowdown of the median reported as a regression by --compare')
+
+
+class FakeSlackClient:
+    """
+    Answers the Slack Web API calls the benchmarked functions make,
+    without any network traffic.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def _respond(self, **kwargs):
+        self.calls += 1
+        return {'ok': True, 'channel': kwargs.get('channel', 'C00000000'), 'ts': '{:.6f}'.format(time.time())}
+
+    chat_postMessage = _respond
+    chat_update = _respond
+    views_update = _respond
+
+
+def ignore(*args, **kwargs):
+    pass
+
+
+@contextlib.contextmanager
+def frozen_clock(module, now):
+    """
+    Replaces `module`'s datetime module so that datetime.now() and
+    date.today() return `now`, for functions whose work depends on the
+    time of day.
+    """
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz) if tz is not None else now.replace(tzinfo=None)
+
+    class FrozenDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return now.date()
+
+    original = module.datetime
+    module.datetime = types.SimpleNamespace(**dict(vars(datetime), datetime=FrozenDatetime, date=FrozenDate))
+    try:
+        yield
+    finally:
+        module.datetime = original
+
+
+def scaled(args, n):
+    return max(1, int(n * args.scale))
+
+
+_fake_slack_url = None
+
+
+def slack_stand_in():
+    """
+    Starts the fake Slack Web API of tests/fake_slack.py in the background
+    (once per run), returning a RateLimitedWebClient pointed at it. Calls
+    skip the rate limiter, so that timing repeated calls never waits for
+    tokens.
+    """
+    global _fake_slack_url
+    from labbot.slack_client import RateLimitedWebClient, SlackRateLimiter
+
+    class Unlimited(SlackRateLimiter):
+        def call(self, api_method, request_args, send):
+            return send()
+
+    if _fake_slack_url is None:
+        import uvicorn
+        import fake_slack
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(fake_slack.api, log_level='warning', lifespan='off'))
+        threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+        while not server.started:
+            time.sleep(1e-3)
+        _fake_slack_url = 'http://127.0.0.1:{}/api/'.format(sock.getsockname()[1])
+    return RateLimitedWebClient(
+            token='xoxb-benchmark',
+            base_url=_fake_slack_url,
+            rate_limiter=Unlimited())
+
+
+# -- Benchmarks --
+#
+# Each benchmark is called as bench(args, rng) in a fresh temporary working
+# directory, and returns a dictionary with the callable to time ('run'), an
+# optional callable restoring the data between runs ('reset'), and a
+# description of the data size ('size'). Fast calls can ask to be run
+# 'loops' times per timed run; times are then per call. 'parts' maps names
+# to callables doing part of the work of 'run', timed the same way and
+# reported as a share of it.
+
+def bench_sensors_check_status_alerts(args, rng):
+    from labbot.storage import Storage
+    from modules import sensors
+
+    n_sensors = 4
+    n_readings = scaled(args, 50000)
+    storage = Storage()
+    sensors.module_config.update({
+        'storage': storage,
+        'iMonnit_webhook': {'username': 'u', 'password': 'p'},
+        'channel_id': 'C00000000',
+        'home_tab_url': 'https://slack.com/app',
+        'slack_client': FakeSlackClient(),
+        'hometab_update': ignore,
+        'logger': ignore,
+        'sensor_limits': {
+            'Sensor {}'.format(i): {'temperature_limit': -60, 'heartbeat_timeout_sec': 1800,
+                                    'time_to_alarm_sec': 1200}
+            for i in range(n_sensors)},
+    })
+    sensors.register_module({})
+
+    # A reading every five minutes, the most recent ones alarming for one sensor
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db_con = storage.connect('sensors.db')
+    with db_con:
+        for i in range(n_sensors):
+            db_con.execute("INSERT INTO sensors(type, name) VALUES (0, ?)", ('Sensor {}'.format(i),))
+            sensor_id = db_con.execute("SELECT id FROM sensors WHERE name=?", ('Sensor {}'.format(i),)).fetchone()[0]
+            rows = []
+            for j in range(n_readings):
+                timestamp = (now - datetime.timedelta(minutes=5 * j)).isoformat()
+                temperature = -50.0 if i == 0 and j < 10 else rng.uniform(-85, -75)
+                rows.append((timestamp, timestamp, sensor_id, temperature, 90.0))
+            db_con.executemany(
+                "INSERT INTO temperature_measurements(timestamp, received_timestamp, sensor, measurement, battery_level) "
+                "VALUES (?,?,?,?,?)", rows)
+    db_con.close()
+
+    def run():
+        db_con = storage.connect('sensors.db')
+        sensors.check_status_alerts(db_con, perform_hometab_update=False)
+        db_con.close()
+
+    return {'run': run, 'size': '{} sensors x {} readings'.format(n_sensors, n_readings)}
+
+
+RECURRENCES = [
+    'DTSTART:20200106T090000\nRRULE:FREQ=DAILY',
+    'DTSTART:20200106T090000\nRRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR',
+    'DTSTART:20200106T090000\nRRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=TU',
+    'DTSTART:20200101T090000\nRRULE:FREQ=MONTHLY;BYMONTHDAY=1,15',
+]
+
+
+def setup_lab_jobs(storage):
+    from modules import lab_jobs
+    lab_jobs.module_config.update({
+        'storage': storage,
+        'slack_client': FakeSlackClient(),
+        'hometab_update': ignore,
+        'logger': ignore,
+    })
+    lab_jobs.register_module({})
+    db_con = storage.connect('labjobs.db')
+    with db_con:
+        db_con.executemany("INSERT INTO reminder_schedules(id, name, reminders) VALUES (?,?,?)", [
+            (1, 'Daily', '1d=4h;3d=1h'),
+            (2, 'Weekly', '2d=1d;7d=4h'),
+        ])
+    db_con.close()
+    return lab_jobs
+
+
+def bench_lab_jobs_add_new_jobs(args, rng):
+    from labbot.storage import Storage
+    storage = Storage()
+    lab_jobs = setup_lab_jobs(storage)
+
+    n_templates = scaled(args, 5000)
+    db_con = storage.connect('labjobs.db')
+    with db_con:
+        db_con.executemany(
+            "INSERT INTO template_jobs(sort_priority, name, last_generated_ts, reminder_schedule, recurrence, assignee) "
+            "VALUES (?,?,?,?,?,?)",
+            [(i, 'Job {}'.format(i), '2020-01-01', 1 + i % 2, rng.choice(RECURRENCES), 'U{:08d}'.format(i % 20))
+             for i in range(n_templates)])
+    db_con.close()
+
+    # add_new_jobs only generates jobs after 9am US/Eastern
+    now = lab_jobs.ET.localize(datetime.datetime(2024, 1, 15, 12, 0))
+
+    def run():
+        db_con = storage.connect('labjobs.db', row_factory=sqlite3.Row)
+        with frozen_clock(lab_jobs, now):
+            lab_jobs.add_new_jobs(db_con)
+        db_con.commit()
+        db_con.close()
+
+    def reset():
+        db_con = storage.connect('labjobs.db')
+        with db_con:
+            db_con.execute("DELETE FROM jobs")
+            db_con.execute("UPDATE template_jobs SET last_generated_ts='2020-01-01'")
+        db_con.close()
+
+    return {'run': run, 'reset': reset, 'size': '{} templates'.format(n_templates)}
+
+
+def bench_lab_jobs_send_reminders(args, rng):
+    from labbot.storage import Storage
+    storage = Storage()
+    lab_jobs = setup_lab_jobs(storage)
+
+    # Open jobs, due over the last two weeks; some are due a reminder
+    n_jobs = scaled(args, 5000)
+    now = datetime.datetime.now(lab_jobs.ET)
+    jobs = []
+    for i in range(n_jobs):
+        due = (now - datetime.timedelta(minutes=rng.randrange(14 * 24 * 60))).isoformat()
+        jobs.append((i + 1, 'Job {}'.format(i), due, due, 1 + i % 2, 'U{:08d}'.format(i % 20)))
+    db_con = storage.connect('labjobs.db')
+    with db_con:
+        db_con.executemany(
+            "INSERT INTO jobs(id, done, name, due_ts, last_reminder_ts, reminder_schedule, assignee) "
+            "VALUES (?,0,?,?,?,?,?)", jobs)
+    db_con.close()
+
+    def run():
+        db_con = storage.connect('labjobs.db', row_factory=sqlite3.Row)
+        lab_jobs.send_reminders(db_con, [])
+        db_con.close()
+
+    def reset():
+        db_con = storage.connect('labjobs.db')
+        with db_con:
+            db_con.execute("DELETE FROM reminder_messages")
+            db_con.execute("UPDATE jobs SET last_reminder_ts=due_ts")
+        db_con.close()
+
+    return {'run': run, 'reset': reset, 'size': '{} open jobs'.format(n_jobs)}
+
+
+def covid_rows(args, rng):
+    """
+    Returns hour submissions of ten lab members, four days a week, for
+    `years` years up to last week.
+    """
+    years = scaled(args, 4)
+    monday = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday() + 7)
+    rows = []
+    for week in range(52 * years):
+        week_start = monday - datetime.timedelta(weeks=week)
+        for user in range(10):
+            for day in rng.sample(range(5), 4):
+                arrival = rng.randrange(7, 12)
+                rows.append({
+                    'user': 'user{}'.format(user),
+                    'week': week_start.isoformat(),
+                    'day': (week_start + datetime.timedelta(days=day)).isoformat(),
+                    'arrival_time': '{:02d}:00'.format(arrival),
+                    'departure_time': '{:02d}:30'.format(arrival + rng.randrange(2, 8)),
+                })
+    return years, monday, rows
+
+
+def setup_covidapi(store):
+    from modules import covidapi
+    covidapi.module_config.update({'store': store, 'logger': ignore})
+    return covidapi
+
+
+def bench_covidapi_load_week(args, rng):
+    from labbot.store import Store
+    from labbot.storage import Storage
+    store = Store(storage=Storage())
+    years, monday, rows = covid_rows(args, rng)
+    covidapi = setup_covidapi(store)
+    with open('covid_hours.csv', 'w') as covid_file:
+        writer = csv.DictWriter(covid_file, fieldnames=covidapi.CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    covidapi.register_module({})
+    week = datetime.datetime.combine(monday, datetime.time())
+
+    def run():
+        covidapi.summarize_hour_results(covidapi.load_week(week), week, 'user0')
+
+    return {'run': run, 'size': '{} years, {} rows'.format(years, len(rows))}
+
+
+def bench_covidapi_import_csv(args, rng):
+    from labbot.store import Store
+    from labbot.storage import Storage
+    store = Store(storage=Storage())
+    years, _, rows = covid_rows(args, rng)
+    covidapi = setup_covidapi(store)
+    with open('covid_hours.csv', 'w') as covid_file:
+        writer = csv.DictWriter(covid_file, fieldnames=covidapi.CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    def run():
+        covidapi.register_module({})
+
+    def reset():
+        db_con = store.storage.connect(store.path)
+        with db_con:
+            db_con.execute("DELETE FROM records WHERE name='covid_hours'")
+            db_con.execute("DELETE FROM kv WHERE namespace='imports'")
+        db_con.close()
+
+    return {'run': run, 'reset': reset, 'size': '{} years, {} rows'.format(years, len(rows))}
+
+
+def bench_covidapi_export_csv(args, rng):
+    from labbot.store import Store
+    from labbot.storage import Storage
+    store = Store(storage=Storage())
+    years, _, rows = covid_rows(args, rng)
+    covidapi = setup_covidapi(store)
+    store.import_once('benchmark', lambda: ([], [('covid_hours', row, row['week']) for row in rows]))
+
+    return {'run': covidapi.export_csv, 'size': '{} years, {} rows'.format(years, len(rows))}
+
+
+def bench_label_printing_handle_form_submission(args, rng):
+    from labbot.store import Store
+    from labbot.storage import Storage
+    from modules import label_printing
+
+    store = Store(storage=Storage())
+    label_printing.module_config.update({'store': store, 'logger': ignore})
+    n_labels = scaled(args, 20000)
+    labels = '\n'.join('{},{}'.format(i + 1, 'plasmid {} {}'.format(i + 1, uuid.UUID(int=rng.getrandbits(128))))
+                       for i in range(n_labels))
+    view = {'state': {'values': {
+        'labels': {'labels-input': {'value': labels}},
+        'label_type': {'label_type-input': {'selected_option': {'value': 'bacterial_stock'}}},
+        'date': {'date-input': {'selected_date': '2024-01-15'}},
+        'initials': {'initials-input': {'value': 'LB'}},
+        'num_copies': {'num_copies-input': {'value': '2'}},
+    }}}
+
+    def run():
+        label_printing.handle_form_submission(ignore, {}, None, view)
+
+    def reset():
+        while store.queue_pop(label_printing.LABEL_QUEUE) is not None:
+            pass
+
+    return {'run': run, 'reset': reset, 'size': '{} labels'.format(n_labels)}
+
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def docx_paragraph(rng, i):
+    """
+    Returns the XML of a paragraph with a Zotero citation field code and,
+    every tenth paragraph, a plain superscript number that looks like a
+    citation.
+    """
+    run = '<w:r><w:t xml:space="preserve">{}</w:t></w:r>'
+    superscript = '<w:r><w:rPr><w:vertAlign w:val="superscript"/></w:rPr><w:t>{}</w:t></w:r>'
+    parts = [run.format('Sentence {} about some result '.format(i) + 'lorem ipsum ' * rng.randrange(5, 20))]
+    parts.append('<w:r><w:fldChar w:fldCharType="begin"/></w:r>'
+                 '<w:r><w:instrText xml:space="preserve"> ADDIN ZOTERO_ITEM CSL_CITATION {}</w:instrText></w:r>'
+                 '<w:r><w:fldChar w:fldCharType="separate"/></w:r>'.format('{"citationID":"c%d"}' % i)
+                 + superscript.format(i % 90 + 1)
+                 + '<w:r><w:fldChar w:fldCharType="end"/></w:r>')
+    parts.append(run.format('. More text follows'))
+    if i % 10 == 0:
+        parts.append(superscript.format('{}-{}'.format(i % 90 + 1, i % 90 + 3)))
+    return '<w:p>{}</w:p>'.format(''.join(parts))
+
+
+def write_docx(path, rng, n_paragraphs):
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="{}"><w:body>{}</w:body></w:document>').format(
+        W, ''.join(docx_paragraph(rng, i) for i in range(n_paragraphs)))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8"?><Types/>')
+        docx.writestr('word/document.xml', document)
+
+
+def bench_word_verification_scan_for_superscripts(args, rng):
+    from modules import word_verification
+    n_paragraphs = scaled(args, 20000)
+    write_docx('large.docx', rng, n_paragraphs)
+    root = word_verification.open_word_doc_xml('large.docx').getroot()
+
+    def run():
+        # The scan prints every superscript it finds
+        with contextlib.redirect_stdout(io.StringIO()):
+            word_verification.scan_for_superscripts(root)
+
+    return {'run': run, 'size': '{} paragraphs'.format(n_paragraphs)}
+
+
+def bench_word_verification_open_word_doc_xml(args, rng):
+    from modules import word_verification
+    n_paragraphs = scaled(args, 20000)
+    write_docx('large.docx', rng, n_paragraphs)
+
+    def run():
+        word_verification.open_word_doc_xml('large.docx')
+
+    return {'run': run, 'size': '{} paragraphs, {} kB'.format(
+        n_paragraphs, pathlib.Path('large.docx').stat().st_size // 1024)}
+
+
+def view_benchmark(build, send, n_loops=50):
+    """
+    Returns a benchmark of building a view and sending it to the Slack
+    stand-in, with the rendering and JSON encoding also timed on their own.
+    """
+    from labbot import fastjson
+    view = build()
+    return {
+        'run': lambda: send(build()),
+        'loops': n_loops,
+        'parts': {
+            'render': build,
+            'encode': lambda: fastjson.dumps(view),
+            'encode with json': lambda: json.dumps(view),
+        },
+        'size': '{} blocks, {} kB JSON'.format(len(view['blocks']) if isinstance(view, dict) else len(view),
+                                             len(json.dumps(view)) // 1024),
+    }
+
+
+def bench_view_lab_jobs_view_jobs_modal(args, rng):
+    from labbot.storage import Storage
+    storage = Storage()
+    lab_jobs = setup_lab_jobs(storage)
+    client = slack_stand_in()
+
+    # A modal holds at most 100 blocks
+    db_con = storage.connect('labjobs.db')
+    with db_con:
+        db_con.executemany(
+            "INSERT INTO template_jobs(sort_priority, name, last_generated_ts, reminder_schedule, recurrence, assignee) "
+            "VALUES (?,?,?,?,?,?)",
+            [(i, 'Job {} ({})'.format(i, 'lorem ipsum ' * rng.randrange(1, 8)), '2020-01-01', 1 + i % 2,
+              rng.choice(RECURRENCES), 'U{:08d}'.format(i % 20)) for i in range(99)])
+    db_con.close()
+
+    def build():
+        db_con = storage.connect('labjobs.db', row_factory=sqlite3.Row)
+        view = lab_jobs.build_view_jobs_modal(db_con)
+        db_con.close()
+        return view
+
+    return view_benchmark(build, lambda view: client.views_open(trigger_id='1.2.3', view=view))
+
+
+def bench_view_lab_jobs_home_tab(args, rng):
+    from labbot.storage import Storage
+    storage = Storage()
+    lab_jobs = setup_lab_jobs(storage)
+    client = slack_stand_in()
+
+    db_con = storage.connect('labjobs.db')
+    with db_con:
+        db_con.executemany(
+            "INSERT INTO jobs(done, name, due_ts, last_reminder_ts, reminder_schedule, assignee) VALUES (0,?,?,?,1,?)",
+            [('Job {} ({})'.format(i, 'lorem ipsum ' * rng.randrange(1, 8)), '2024-01-15T12:00:00-05:00',
+              '2024-01-15T12:00:00-05:00', 'U{:08d}'.format(i % 20)) for i in range(500)])
+    db_con.close()
+
+    def build():
+        return {'type': 'home', 'blocks': lab_jobs.lab_job_home_tab(None)}
+
+    return view_benchmark(build, lambda view: client.views_publish(user_id='U00000000', view=view))
+
+
+def bench_view_label_printing_modal(args, rng):
+    from modules import label_printing
+    client = slack_stand_in()
+
+    def build():
+        return label_printing.build_modal_view(initial_date='2024-01-15')
+
+    return view_benchmark(build, lambda view: client.views_open(trigger_id='1.2.3', view=view))
+
+
+BENCHMARKS = {
+    'sensors.check_status_alerts': bench_sensors_check_status_alerts,
+    'lab_jobs.add_new_jobs': bench_lab_jobs_add_new_jobs,
+    'lab_jobs.send_reminders': bench_lab_jobs_send_reminders,
+    'covidapi.load_week': bench_covidapi_load_week,
+    'covidapi.import_csv': bench_covidapi_import_csv,
+    'covidapi.export_csv': bench_covidapi_export_csv,
+    'label_printing.handle_form_submission': bench_label_printing_handle_form_submission,
+    'word_verification.open_word_doc_xml': bench_word_verification_open_word_doc_xml,
+    'word_verification.scan_for_superscripts': bench_word_verification_scan_for_superscripts,
+    'views.lab_jobs.view_jobs_modal': bench_view_lab_jobs_view_jobs_modal,
+    'views.lab_jobs.home_tab': bench_view_lab_jobs_home_tab,
+    'views.label_printing.modal': bench_view_label_printing_modal,
+}
+
+
+# -- Running and comparing --
+
+def run_benchmark(args, name):
+    """
+    Runs one benchmark in a temporary directory, returning its result.
+    """
+    workdir = tempfile.mkdtemp(prefix='labbot-bench-')
+    cwd = pathlib.Path.cwd()
+    try:
+        os.chdir(workdir)
+        try:
+            benchmark = BENCHMARKS[name](args, random.Random(args.seed))
+        except ImportError as e:
+            return {'name': name, 'skipped': 'cannot import {}'.format(e.name)}
+        loops = benchmark.get('loops', 1)
+
+        def time_runs(func):
+            times = []
+            for _ in range(args.repeat):
+                if benchmark.get('reset') is not None:
+                    benchmark['reset']()
+                start = time.perf_counter()
+                for _ in range(loops):
+                    func()
+                times.append((time.perf_counter() - start) / loops)
+            return times
+
+        times = time_runs(benchmark['run'])
+        parts = {part: statistics.median(time_runs(func)) for part, func in benchmark.get('parts', {}).items()}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {
+        'name': name,
+        'size': benchmark['size'],
+        'repeat': args.repeat,
+        'loops': loops,
+        'min_sec': min(times),
+        'median_sec': statistics.median(times),
+        'mean_sec': statistics.mean(times),
+        'max_sec': max(times),
+        'times_sec': times,
+    }
+    if len(parts) > 0:
+        result['parts_median_sec'] = parts
+        result['parts_share'] = {part: seconds / result['median_sec'] for part, seconds in parts.items()}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(SERVER_DIR), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, threshold):
+    """
+    Prints the change of each benchmark's median against a previous run,
+    returning the names of benchmarks that got slower than `threshold`.
+    """
+    before = {r['name']: r for r in previous['results'] if 'median_sec' in r}
+    print('\nCompared to {} ({}):'.format(previous.get('commit') or 'unknown commit', previous.get('scale')))
+    print('{:<42} {:>12} {:>12} {:>8}'.format('benchmark', 'before ms', 'after ms', 'change'))
+    regressions = []
+    for result in results:
+        if 'median_sec' not in result or result['name'] not in before:
+            continue
+        old = before[result['name']]['median_sec']
+        new = result['median_sec']
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions.append(result['name'])
+        elif change < -threshold:
+            flag = '  faster'
+        print('{:<42} {:>12.2f} {:>12.2f} {:>+7.0%}{}'.format(result['name'], old * 1000, new * 1000, change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    names = args.only if args.only is not None else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark {}; choose from {}'.format(name, ', '.join(BENCHMARKS)))
+
+    results = []
+    print('{:<42} {:<28} {:>10} {:>10} {:>10}'.format('benchmark', 'data', 'min ms', 'median ms', 'max ms'))
+    for name in names:
+        result = run_benchmark(args, name)
+        results.append(result)
+        if 'skipped' in result:
+            print('{:<42} skipped: {}'.format(name, result['skipped']))
+        else:
+            print('{name:<42} {size:<28} {0:>10.2f} {1:>10.2f} {2:>10.2f}'.format(
+                result['min_sec'] * 1000, result['median_sec'] * 1000, result['max_sec'] * 1000, **result))
+            for part, seconds in result.get('parts_median_sec', {}).items():
+                print('    {:<38} {:>39.3f} ms ({:.0%} of the call)'.format(
+                    part, seconds * 1000, result['parts_share'][part]))
+
+    output = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(output, json_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        if previous.get('scale') != args.scale:
+            print('Warning: {} was run with --scale {}'.format(args.compare, previous.get('scale')))
+        if len(compare(results, previous, args.threshold)) > 0:
+            sys.exit(1)
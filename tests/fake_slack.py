@@ -0,0 +1,166 @@
+"""
+A local stand-in for the Slack Web API, for load testing LabBot without a
+real workspace.
+
+Implements the Web API methods LabBot uses (chat.postMessage, chat.update,
+views.open/push/update/publish, files.upload and the files_upload_v2
+flow, auth.test, ...) with plausible responses, and can inject latency and
+HTTP 429 rate limiting. Any other method is answered with {"ok": true}.
+
+Run it, then point LabBot at it by setting "api_url" in the "slack" section
+of labbot.secret:
+
+    python tests/fake_slack.py --port 8901 --latency-ms 80 --ratelimit-rps 1
+    # labbot.secret: "slack": {..., "api_url": "http://localhost:8901/api/"}
+
+GET /stats returns the number of calls and 429s per method.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+import urllib.parse
+
+import fastapi
+import uvicorn
+
+parser = argparse.ArgumentParser(description='Fake Slack Web API server')
+parser.add_argument('--host', default='localhost')
+parser.add_argument('--port', type=int, default=8901)
+parser.add_argument('--latency-ms', type=float, default=0.0, help='Latency added to every call')
+parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra latency, up to this much')
+parser.add_argument('--ratelimit-prob', type=float, default=0.0,
+        help='Fraction of calls answered with HTTP 429, at random')
+parser.add_argument('--ratelimit-rps', type=float, default=None,
+        help='Answer 429 once a method is called more than this many times per second')
+parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of 429 responses, in seconds')
+
+api = fastapi.FastAPI()
+settings = argparse.Namespace(latency_ms=0.0, jitter_ms=0.0, ratelimit_prob=0.0, ratelimit_rps=None, retry_after=1)
+calls = collections.Counter()
+rate_limited = collections.Counter()
+windows = {}
+ids = itertools.count(1)
+
+
+def next_id(prefix):
+    return '{}{:08d}'.format(prefix, next(ids))
+
+
+def next_ts():
+    return '{:.6f}'.format(time.time() + next(ids) * 1e-6)
+
+
+def is_rate_limited(method):
+    if settings.ratelimit_prob > 0 and random.random() < settings.ratelimit_prob:
+        return True
+    if settings.ratelimit_rps is not None:
+        window_start, count = windows.get(method, (0.0, 0))
+        now = time.monotonic()
+        if now - window_start >= 1.0:
+            window_start, count = now, 0
+        windows[method] = (window_start, count + 1)
+        return count + 1 > settings.ratelimit_rps
+    return False
+
+
+async def read_args(request):
+    """
+    Returns the call arguments, whether sent as a query string, a form or JSON.
+    """
+    args = dict(request.query_params)
+    body = await request.body()
+    if len(body) > 0:
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('application/json'):
+            args.update(json.loads(body))
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            args.update(urllib.parse.parse_qsl(body.decode('utf-8')))
+    return args
+
+
+def parse_json_arg(args, name):
+    value = args.get(name)
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def view_response(args):
+    view = parse_json_arg(args, 'view') or {}
+    view = dict(view) if isinstance(view, dict) else {}
+    view.setdefault('id', args.get('view_id') or next_id('V'))
+    view['hash'] = next_id('h')
+    view.setdefault('external_id', args.get('external_id', ''))
+    return {'view': view}
+
+
+def respond(method, args, request):
+    channel = args.get('channel', 'C00000000')
+    if method == 'auth.test':
+        return {'url': 'https://fake.slack.com/', 'team': 'Fake', 'user': 'labbot', 'team_id': 'T00000000',
+                'user_id': 'U00000000', 'bot_id': 'B00000000'}
+    if method == 'chat.postMessage':
+        return {'channel': channel, 'ts': next_ts(), 'message': {'text': args.get('text', '')}}
+    if method in ('chat.update', 'chat.delete'):
+        return {'channel': channel, 'ts': args.get('ts', next_ts())}
+    if method == 'chat.postEphemeral':
+        return {'message_ts': next_ts()}
+    if method in ('views.open', 'views.push', 'views.update', 'views.publish'):
+        return view_response(args)
+    if method == 'conversations.open':
+        return {'channel': {'id': next_id('D')}}
+    if method == 'files.upload':
+        return {'file': {'id': next_id('F'), 'name': args.get('filename', '')}}
+    if method == 'files.getUploadURLExternal':
+        file_id = next_id('F')
+        return {'upload_url': '{}://{}/upload/{}'.format(request.url.scheme, request.url.netloc, file_id),
+                'file_id': file_id}
+    if method == 'files.completeUploadExternal':
+        files = parse_json_arg(args, 'files') or []
+        return {'files': [{'id': f.get('id'), 'title': f.get('title', '')} for f in files]}
+    if method == 'users.info':
+        return {'user': {'id': args.get('user', 'U00000000'), 'name': 'fake-user'}}
+    return {}
+
+
+@api.post('/api/{method}')
+@api.get('/api/{method}')
+async def api_method(method: str, request: fastapi.Request):
+    delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    calls[method] += 1
+    if is_rate_limited(method):
+        rate_limited[method] += 1
+        return fastapi.responses.JSONResponse(
+                {'ok': False, 'error': 'ratelimited'},
+                status_code=429,
+                headers={'Retry-After': str(settings.retry_after)})
+    args = await read_args(request)
+    return dict(ok=True, **respond(method, args, request))
+
+
+@api.post('/upload/{file_id}')
+async def upload(file_id: str, request: fastapi.Request):
+    # files_upload_v2 sends the file contents to the URL it was given
+    await request.body()
+    return fastapi.responses.PlainTextResponse('OK - {}'.format(file_id))
+
+
+@api.get('/stats')
+def stats():
+    return {'calls': dict(calls), 'rate_limited': dict(rate_limited)}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for name in ('latency_ms', 'jitter_ms', 'ratelimit_prob', 'ratelimit_rps', 'retry_after'):
+        setattr(settings, name, getattr(args, name))
+    uvicorn.run(api, host=args.host, port=args.port, log_level='warning')
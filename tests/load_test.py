@@ -0,0 +1,278 @@
+"""
+End-to-end load test of a running LabBot.
+
+Fires signed /slack/events payloads (events, shortcuts, block actions and
+view submissions) and iMonnit webhooks at LabBot's webserver, and reports
+latency percentiles and sustained throughput per scenario. Each scenario
+exercises one module; scenarios whose module is not loaded simply fail
+with 404s (webhooks) or get acked by nobody.
+
+Start tests/fake_slack.py and point LabBot's slack.api_url at it first, so
+that LabBot's own Slack API calls do not hit a real workspace. E.g.:
+
+    python tests/load_test.py --url http://localhost:8000 --signing-secret SECRET \\
+        --scenarios mention labjob_complete imonnit --requests 500 --concurrency 8 \\
+        --fake-slack-url http://localhost:8901 --json results.json
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import http.client
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description='Load test a running LabBot')
+parser.add_argument('--url', default='http://localhost:8000', help="LabBot's webserver")
+parser.add_argument('--signing-secret', required=True, help='The Slack signing secret LabBot is configured with')
+parser.add_argument('--scenarios', nargs='+', default=None, help='Scenarios to run (default: all)')
+parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+parser.add_argument('--concurrency', type=int, default=4, help='Concurrent connections')
+parser.add_argument('--rate', type=float, default=None,
+        help='Target requests per second (open loop). By default requests are sent back to back')
+parser.add_argument('--imonnit-user', default='imonnit', help='iMonnit webhook basic auth username')
+parser.add_argument('--imonnit-password', default='imonnit', help='iMonnit webhook basic auth password')
+parser.add_argument('--sensor-name', default='Fridge', help='Sensor name used in iMonnit webhooks')
+parser.add_argument('--flowjo-token', default='token', help='FlowJo checkout token')
+parser.add_argument('--labjob-id', type=int, default=1, help='Lab job id used by labjob_complete')
+parser.add_argument('--fake-slack-url', default=None,
+        help='If given, Slack API calls made by LabBot are read from the fake Slack server\'s /stats')
+parser.add_argument('--json', default=None, help='Write the results to this file as JSON')
+
+
+# -- Payloads --
+
+USER = {'id': 'U0LOADTEST', 'username': 'loadtest', 'name': 'loadtest', 'team_id': 'T00000000'}
+
+
+def event_callback(event):
+    return {
+        'token': 'x', 'team_id': 'T00000000', 'api_app_id': 'A00000000', 'type': 'event_callback',
+        'event_id': 'Ev' + uuid.uuid4().hex[:12].upper(), 'event_time': int(time.time()),
+        'event': event,
+    }
+
+
+def interactive(payload):
+    payload.update({'token': 'x', 'team': {'id': 'T00000000'}, 'user': USER, 'api_app_id': 'A00000000',
+                    'trigger_id': '{}.{}'.format(int(time.time()), uuid.uuid4().hex)})
+    return payload
+
+
+def mention():
+    return event_callback({'type': 'app_mention', 'user': USER['id'], 'text': '<@U00000000> hi',
+                           'ts': '{:.6f}'.format(time.time()), 'channel': 'C0LOADTEST',
+                           'event_ts': '{:.6f}'.format(time.time())})
+
+
+def home_opened():
+    return event_callback({'type': 'app_home_opened', 'user': USER['id'], 'channel': 'D0LOADTEST',
+                           'tab': 'home', 'event_ts': '{:.6f}'.format(time.time())})
+
+
+def covid_shortcut():
+    return interactive({'type': 'shortcut', 'callback_id': 'track_hours', 'action_ts': '{:.6f}'.format(time.time())})
+
+
+def labjob_complete(args):
+    return interactive({
+        'type': 'block_actions',
+        'container': {'type': 'message', 'message_ts': '1.0', 'channel_id': 'C0LOADTEST'},
+        'channel': {'id': 'C0LOADTEST'},
+        'actions': [{'action_id': 'labjob-complete', 'block_id': 'b', 'type': 'button',
+                     'value': str(args.labjob_id), 'action_ts': '{:.6f}'.format(time.time())}],
+    })
+
+
+def label_submit(n_labels=50):
+    csv_rows = '\n'.join('{},plasmid {}'.format(i + 1, i + 1) for i in range(n_labels))
+    return interactive({
+        'type': 'view_submission',
+        'view': {
+            'id': 'V' + uuid.uuid4().hex[:10].upper(), 'hash': 'h', 'callback_id': 'label_print_view_submit',
+            'state': {'values': {
+                'labels': {'labels-input': {'type': 'plain_text_input', 'value': csv_rows}},
+                'label_type': {'label_type-input': {'type': 'static_select',
+                                                    'selected_option': {'value': 'bacterial_stock'}}},
+                'date': {'date-input': {'type': 'datepicker', 'selected_date': '2024-01-01'}},
+                'initials': {'initials-input': {'type': 'plain_text_input', 'value': 'LT'}},
+                'num_copies': {'num_copies-input': {'type': 'plain_text_input', 'value': '1'}},
+            }},
+        },
+    })
+
+
+def imonnit(args):
+    now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    sensor = {key: '' for key in ('sensorID', 'sensorName', 'applicationID', 'networkID', 'dataMessageGUID',
+        'state', 'messageDate', 'rawData', 'dataType', 'dataValue', 'plotValues', 'plotLabels',
+        'batteryLevel', 'signalStrength', 'pendingChange', 'voltage')}
+    sensor.update({'sensorID': '1', 'sensorName': args.sensor_name, 'messageDate': now,
+                   'dataValue': '-80.0', 'batteryLevel': '90', 'dataMessageGUID': str(uuid.uuid4())})
+    gateway = {key: '' for key in ('gatewayID', 'gatewayName', 'accountID', 'networkID', 'messageType',
+        'power', 'batteryLevel', 'date', 'count', 'signalStrength', 'pendingChange')}
+    return {'gatewayMessage': gateway, 'sensorMessages': [sensor]}
+
+
+# -- Requests --
+
+def sign(secret, timestamp, body):
+    base = 'v0:{}:{}'.format(timestamp, body).encode('utf-8')
+    return 'v0=' + hmac.new(secret.encode('utf-8'), base, hashlib.sha256).hexdigest()
+
+
+def slack_request(args, payload, form=False):
+    """
+    Returns (method, path, body, headers) of a signed /slack/events request.
+    """
+    if form:
+        body = urllib.parse.urlencode({'payload': json.dumps(payload)})
+        content_type = 'application/x-www-form-urlencoded'
+    else:
+        body = json.dumps(payload)
+        content_type = 'application/json'
+    timestamp = str(int(time.time()))
+    return ('POST', '/slack/events', body, {
+        'Content-Type': content_type,
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': sign(args.signing_secret, timestamp, body),
+    })
+
+
+def imonnit_request(args):
+    credentials = base64.b64encode('{}:{}'.format(args.imonnit_user, args.imonnit_password).encode('utf-8'))
+    return ('POST', '/imonnit_endpoint', json.dumps(imonnit(args)), {
+        'Content-Type': 'application/json',
+        'Authorization': 'Basic ' + credentials.decode('ascii'),
+    })
+
+
+SCENARIOS = {
+    # scenario: (module, function returning a request)
+    'mention': ('example', lambda args: slack_request(args, mention())),
+    'home_opened': ('core', lambda args: slack_request(args, home_opened())),
+    'covid_shortcut': ('covidapi', lambda args: slack_request(args, covid_shortcut(), form=True)),
+    'labjob_complete': ('lab_jobs', lambda args: slack_request(args, labjob_complete(args), form=True)),
+    'label_submit': ('label_printing', lambda args: slack_request(args, label_submit(), form=True)),
+    'imonnit': ('sensors', imonnit_request),
+    'flowjo_state': ('flowjo_checkout',
+                     lambda args: ('GET', '/flowjo/state?token=' + urllib.parse.quote(args.flowjo_token), None, {})),
+}
+
+
+class Connections(threading.local):
+    """
+    One keep-alive connection per sending thread.
+    """
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        cls = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.connection = cls(parsed.netloc, timeout=30)
+
+    def send(self, method, path, body, headers):
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            return None
+
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def fake_slack_calls(url):
+    if url is None:
+        return None
+    parsed = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parsed.netloc, timeout=10)
+    connection.request('GET', '/stats')
+    return json.loads(connection.getresponse().read())['calls']
+
+
+def run_scenario(args, name):
+    module, build = SCENARIOS[name]
+    connections = Connections(args.url)
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    slack_calls_before = fake_slack_calls(args.fake_slack_url)
+
+    def one(i):
+        if args.rate is not None:
+            # Open loop: request i is due at i / rate, however slow the previous ones were
+            delay = start + i / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        method, path, body, headers = build(args)
+        sent = time.monotonic()
+        status = connections.send(method, path, body, headers)
+        latency = time.monotonic() - sent
+        with lock:
+            latencies.append(latency)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith('2'))
+    result = {
+        'scenario': name,
+        'module': module,
+        'requests': len(latencies),
+        'ok': ok,
+        'statuses': statuses,
+        'seconds': elapsed,
+        'events_per_sec': ok / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p90_ms': percentile(latencies, 0.9) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+    slack_calls_after = fake_slack_calls(args.fake_slack_url)
+    if slack_calls_after is not None:
+        result['slack_calls'] = {method: count - slack_calls_before.get(method, 0)
+                                 for method, count in slack_calls_after.items()
+                                 if count != slack_calls_before.get(method, 0)}
+    return result
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    scenarios = args.scenarios if args.scenarios is not None else list(SCENARIOS)
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error('Unknown scenario {}; choose from {}'.format(name, ', '.join(SCENARIOS)))
+
+    results = []
+    print('{:<16} {:<16} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'scenario', 'module', 'requests', 'ok', 'p50 ms', 'p99 ms', 'max ms', 'events/s'))
+    for name in scenarios:
+        result = run_scenario(args, name)
+        results.append(result)
+        print('{scenario:<16} {module:<16} {requests:>8} {ok:>8} {p50_ms:>9.1f} {p99_ms:>9.1f} '
+              '{max_ms:>9.1f} {events_per_sec:>9.1f}'.format(**result))
+        if result['ok'] != result['requests']:
+            print('    statuses: {}'.format(result['statuses']))
+        if 'slack_calls' in result:
+            print('    Slack API calls: {}'.format(result['slack_calls']))
+
+    if args.json is not None:
+        with open(args.json, 'w') as output:
+            json.dump({'url': args.url, 'concurrency': args.concurrency, 'rate': args.rate,
+                       'time': time.time(), 'results': results}, output, indent=2)